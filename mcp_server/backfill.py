@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+import time
+from base64 import b64encode
+import numpy as np
+from config import (
+    logger,
+    BACKFILL_PAGE_SIZE,
+    BACKFILL_BATCH_SIZE,
+    BACKFILL_UPLOAD_CONCURRENCY,
+    BACKFILL_QUEUE_BATCHES,
+)
+from http_client import api_request
+from bulk_writer import send_with_retries
+from embedding_cache import EMBEDDING_CACHE
+
+# Pipelined, resumable embedding backfill:
+#   page fetcher -> [pending queue] -> batch encoder -> [upload queue] -> N concurrent PATCH uploaders
+# Queues are bounded, so fetching, encoding and uploading overlap without buffering the whole corpus.
+# Uploads are retried on transient failures like bulk writes (the PATCH is idempotent). Uploaded ids are
+# appended to a checkpoint (one JSON line per batch) after every batch; an interrupted run skips them when restarted.
+# Items that already have embeddings are recognised from `known_ids` (ids in the local cache), so
+# pages are fetched without the embedding payload. The local cache may be behind the backend (items added
+# or embedded by another process since), so known ids are only used when current_cache_ids() finds the
+# cache matches the backend; otherwise we fall back to fetching embeddings.
+
+_DONE = object()  # Queue sentinel
+
+
+async def current_cache_ids(list_path, cache, list_params=None, newest_first=False):
+    """Ids of the cached items (all with embeddings) if the cache is as current as the backend, else None.
+
+    Compares the backend's total with the cached items plus the ones cached as still missing an embedding,
+    and, for lists ordered newest first, the newest id with the cache's watermark.
+    """
+    if cache["data"] is None:
+        return None
+    try:
+        resp = await api_request("GET", list_path, params={"page": 1, "count": 1, **(list_params or {})})
+        resp.raise_for_status()
+        head = resp.json()
+    except Exception as e:
+        logger.error(f"current_cache_ids: Could not check {list_path} against the local cache: {e}")
+        return None
+    pending = cache.get("pending_ids") or []
+    newest = head["results"][0]["id"] if newest_first and head.get("results") else None
+    if head.get("total") != len(cache["data"]) + len(pending) or (newest is not None and newest > (cache.get("max_seen_id") or 0)):
+        logger.warning(f"current_cache_ids: Local cache of {list_path} is behind the backend "
+                       f"({len(cache['data'])} + {len(pending)} pending cached, {head.get('total')} on the backend).")
+        return None
+    return set(cache["data"].ids.tolist())
+
+
+def checkpoint_path(name):
+    return f"backfill_{name}.checkpoint.json"
+
+
+def load_checkpoint(name):
+    path = checkpoint_path(name)
+    if not os.path.exists(path):
+        return set()
+    done_ids = set()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done_ids.update(json.loads(line).get("done_ids", []))
+                except ValueError:  # Torn last line of an interrupted append
+                    continue
+        logger.info(f"load_checkpoint: Resuming {name} backfill, {len(done_ids)} items already uploaded.")
+        return done_ids
+    except (OSError, AttributeError) as e:
+        logger.error(f"load_checkpoint: Ignoring unreadable checkpoint {path}: {e}")
+        return set()
+
+
+def append_checkpoint(name, batch_ids):
+    """Records one uploaded batch: appends a line instead of rewriting every id uploaded so far."""
+    with open(checkpoint_path(name), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"done_ids": list(batch_ids), "updated_at": time.time()}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def run_embedding_backfill(name, list_path, update_path, text_fn, model, known_ids=None,
+                                 list_params=None, batch_size=BACKFILL_BATCH_SIZE,
+                                 page_size=BACKFILL_PAGE_SIZE, upload_concurrency=BACKFILL_UPLOAD_CONCURRENCY):
+    """Embeds and uploads every item of `list_path` that has no embedding yet.
+
+    `text_fn(item)` builds the text to embed; uploads go to `update_path` as {"updates": [{id, vector_embedding}]}.
+    `list_params` are extra query params used when embeddings are not requested (e.g. {"vector_embedding": False}).
+    Returns the list of uploaded rows ({"item": item, "embedding": float32 vector}).
+    """
+    start_time = time.time()
+    done_ids = load_checkpoint(name)
+    pending = asyncio.Queue(maxsize=batch_size * BACKFILL_QUEUE_BATCHES)
+    uploads = asyncio.Queue(maxsize=BACKFILL_QUEUE_BATCHES)
+    uploaded_rows = []
+    upload_limit = asyncio.Semaphore(upload_concurrency)
+    stats = {"pages": 0, "queued": 0, "encoded": 0, "uploaded": 0, "failed": 0, "fetch_failed": False}
+    need_embeddings = known_ids is None
+    if need_embeddings:
+        logger.warning(f"run_embedding_backfill[{name}]: No current local cache ids, fetching embeddings to find missing ones.")
+
+    async def fetch_pages():
+        page = 1
+        try:
+            while True:
+                params = {"page": page, "count": page_size}
+                params.update({"vector_embedding": True} if need_embeddings else (list_params or {}))
+                resp = await api_request("GET", list_path, params=params)
+                resp.raise_for_status()
+                data = resp.json()
+                stats["pages"] += 1
+                for item in data.get("results", []):
+                    missing = item.get("vector_embedding") is None if need_embeddings else item["id"] not in known_ids
+                    if missing and item["id"] not in done_ids:
+                        stats["queued"] += 1
+                        await pending.put(item)
+                if not data.get("next"):
+                    break
+                page += 1
+        except Exception as e:
+            stats["fetch_failed"] = True
+            logger.exception(f"run_embedding_backfill[{name}]: Page fetch failed at page {page}: {e}")
+        finally:
+            await pending.put(_DONE)
+
+    async def encode_batches():
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            batch = []
+            while len(batch) < batch_size:
+                item = await pending.get()
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+            if batch:
+                texts = [text_fn(item) for item in batch]
+                encode_start = time.time()
+                try:
+                    embeddings = await loop.run_in_executor(None, lambda: EMBEDDING_CACHE.encode(model, texts))
+                    embeddings = np.asarray(embeddings, dtype=np.float32)
+                    stats["encoded"] += len(batch)
+                    logger.info(f"run_embedding_backfill[{name}]: Encoded {len(batch)} items in {time.time() - encode_start:.2f}s.")
+                    await uploads.put((batch, embeddings))
+                except Exception as e:
+                    stats["failed"] += len(batch)
+                    logger.exception(f"run_embedding_backfill[{name}]: Encoding batch of {len(batch)} failed: {e}")
+        for _ in range(upload_concurrency):
+            await uploads.put(_DONE)
+
+    async def upload_batches():
+        while True:
+            job = await uploads.get()
+            if job is _DONE:
+                return
+            batch, embeddings = job
+            updates = [{"id": item["id"], "vector_embedding": b64encode(emb.tobytes()).decode("utf-8")}
+                       for item, emb in zip(batch, embeddings)]
+            patch_start = time.time()
+            try:
+                status, error, _ = await send_with_retries("PATCH", update_path, {"updates": updates}, True, upload_limit)
+                if status is None or status >= 400:
+                    raise RuntimeError(f"status {status}: {error}")
+            except Exception as e:
+                stats["failed"] += len(batch)
+                logger.error(f"run_embedding_backfill[{name}]: Upload of {len(batch)} items failed after {time.time() - patch_start:.2f}s: {e}")
+                continue
+            stats["uploaded"] += len(batch)
+            uploaded_rows.extend({"item": item, "embedding": emb} for item, emb in zip(batch, embeddings))
+            batch_ids = [item["id"] for item in batch]
+            done_ids.update(batch_ids)
+            append_checkpoint(name, batch_ids)
+            logger.info(f"run_embedding_backfill[{name}]: Uploaded {len(batch)} items in {time.time() - patch_start:.2f}s ({stats['uploaded']} so far).")
+
+    await asyncio.gather(fetch_pages(), encode_batches(), *[upload_batches() for _ in range(upload_concurrency)])
+    if stats["failed"] == 0 and not stats["fetch_failed"] and os.path.exists(checkpoint_path(name)):
+        os.remove(checkpoint_path(name))  # Complete run, next backfill starts fresh
+    logger.info(f"run_embedding_backfill[{name}]: Finished in {time.time() - start_time:.2f}s. {stats}")
+    return uploaded_rows
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Offline, reproducible performance benchmarks (no network, no model download):
+#   python benchmark.py --fetch-sizes 10000,100000 --search-sizes 10000,100000,1000000 --output bench.json
+# The backend is replaced by fake_backend.FakeBackend and the model by StubEmbeddingModel; cache files go to
+# a temp directory, never to the real local cache. Results are JSON so runs can be diffed across commits.
+
+os.environ.setdefault("AI_AGENT_SECRET_KEY", "offline-benchmark")  # Nothing is sent anywhere
+
+from config import logger  # noqa: E402
+import http_client  # noqa: E402
+import utils_cache  # noqa: E402
+from utils_cache import COLLECTIONS, PAIRS_CACHE, empty_cache, init_cache, save_cache_to_file, load_cache_from_file, build_vector_index  # noqa: E402
+from query_cache import QUERY_EMBEDDING_CACHE, RESULT_CACHE  # noqa: E402
+from corpus_fetch import corpus_fetcher  # noqa: E402
+from item_store import ItemStore  # noqa: E402
+from fake_backend import make_backend, make_embeddings, make_pairs, StubEmbeddingModel  # noqa: E402
+import rag  # noqa: E402
+
+
+def summarize_ms(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "mean_ms": round(float(samples.mean()), 3),
+        "n": int(len(samples)),
+    }
+
+
+def timed(fn):
+    start_time = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start_time
+
+
+async def timed_async(coro):
+    start_time = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - start_time
+
+
+def reset_state():
+    PAIRS_CACHE.update(empty_cache())
+    QUERY_EMBEDDING_CACHE.clear()
+    RESULT_CACHE.clear()
+
+
+async def bench_fetch_and_cache(n_pairs, args):
+    """fetch_all_pairs_async, cold init_cache, cache save/load and warm init_cache against the fake backend."""
+    backend = make_backend(n_pairs, args.dim, latency_ms=args.latency_ms, max_page_size=args.page_limit, seed=args.seed)
+    http_client.set_transport(backend.transport())
+    fetch = lambda: rag.fetch_all_pairs_async(count=args.page_size, max_concurrent=args.max_concurrent)
+    # What init_cache runs in the server: pages stream-decoded into one matrix
+    stream = corpus_fetcher(COLLECTIONS["pairs"]["fields"], COLLECTIONS["pairs"]["list_path"], args.page_size, args.max_concurrent)
+    try:
+        reset_state()
+        pairs, fetch_s = await timed_async(fetch())
+        requests = backend.requests
+        reset_state()
+        _, init_cold_s = await timed_async(init_cache(stream, force_refresh=True))
+        _, save_s = timed(lambda: save_cache_to_file(PAIRS_CACHE))
+        _, load_s = timed(load_cache_from_file)
+        reset_state()
+        _, init_warm_s = await timed_async(init_cache(stream))
+    finally:
+        await http_client.close_client()
+        http_client.set_transport(None)
+    return {
+        "benchmark": "fetch_and_cache",
+        "n_pairs": n_pairs,
+        "fetched": len(pairs),
+        "requests": requests,
+        "fetch_all_pairs_s": round(fetch_s, 4),
+        "fetch_pairs_per_s": round(len(pairs) / fetch_s, 1) if fetch_s else None,
+        "init_cache_cold_s": round(init_cold_s, 4),
+        "cache_save_s": round(save_s, 4),
+        "cache_load_s": round(load_s, 4),
+        "init_cache_warm_s": round(init_warm_s, 4),
+    }
+
+
+async def bench_search(n_pairs, args):
+    """get_similar_pairs latency over a cache of n_pairs synthetic pairs (distinct queries, so caches miss)."""
+    reset_state()
+    vectors, build_s = timed(lambda: make_embeddings(n_pairs, args.dim, seed=args.seed))
+    PAIRS_CACHE.update({
+        "data": ItemStore.from_items(make_pairs(n_pairs, args.seed), COLLECTIONS["pairs"]["fields"]),
+        "db_embeddings": vectors,
+        "last_updated_timestamp": time.time(),
+        "max_seen_id": n_pairs,
+    })
+    save_cache_to_file(PAIRS_CACHE)
+    _, index_s = timed(lambda: build_vector_index(PAIRS_CACHE))
+    await rag.get_similar_pairs("warm up vs query", args.k)  # Starts the encode worker, loads full vectors
+    latencies = []
+    for i in range(args.queries):
+        _, elapsed = await timed_async(rag.get_similar_pairs(f"query{i} vs probe{i}", args.k))
+        latencies.append(elapsed)
+    batch = [f"batch{i} vs probe{i}" for i in range(args.batch_queries)]
+    _, batch_s = await timed_async(rag.get_similar_pairs_batch(batch, args.k))
+    index = PAIRS_CACHE["index"]
+    return {
+        "benchmark": "get_similar_pairs",
+        "n_pairs": n_pairs,
+        "dim": args.dim,
+        "k": args.k,
+        "index": index.kind,
+        "code_dtype": PAIRS_CACHE["store"].code_dtype,
+        "corpus_build_s": round(build_s, 4),
+        "index_build_s": round(index_s, 4),
+        **summarize_ms(latencies),
+        f"batch_{args.batch_queries}_ms": round(batch_s * 1000.0, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="mcp_bench_")
+    for name, spec in COLLECTIONS.items():
+        spec["prefix"] = os.path.join(workdir, f"bench_{name}")
+    utils_cache.MODEL = StubEmbeddingModel(args.dim)
+    results = []
+    try:
+        for n in args.fetch_sizes:
+            results.append(await bench_fetch_and_cache(n, args))
+            logger.warning(f"benchmark: {results[-1]}")
+        for n in args.search_sizes:
+            results.append(await bench_search(n, args))
+            logger.warning(f"benchmark: {results[-1]}")
+    finally:
+        reset_state()  # Drop memory maps before removing their files
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+
+
+def parse_sizes(value):
+    return [int(float(v)) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the MCP server's fetch, cache and search paths.")
+    parser.add_argument("--fetch-sizes", type=parse_sizes, default=parse_sizes("10000,100000"))
+    parser.add_argument("--search-sizes", type=parse_sizes, default=parse_sizes("10000,100000,1000000"))
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dim (the real model uses 1024)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-queries", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Fake backend latency per request")
+    parser.add_argument("--page-limit", type=int, default=2000, help="Fake backend max page size")
+    parser.add_argument("--page-size", type=int, default=200, help="Page size requested by fetch_all_pairs_async")
+    parser.add_argument("--max-concurrent", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    parser.add_argument("--verbose", action="store_true", help="Keep INFO logs from the server modules")
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        logger.setLevel("WARNING")
+        logging.getLogger("httpx").setLevel("WARNING")  # One INFO line per fake request otherwise
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import random
+import time
+import httpx
+from config import (
+    logger,
+    BULK_CHUNK_ITEMS,
+    BULK_CHUNK_MAX_BYTES,
+    BULK_MAX_CONCURRENT_CHUNKS,
+    BULK_MAX_RETRIES,
+    BULK_RETRY_BACKOFF_SECONDS,
+)
+from http_client import api_request
+from metrics import inc, describe, stage
+
+# Shared engine for the batch_* write tools. Instead of one request with the whole input:
+# - items are split into chunks of at most BULK_CHUNK_ITEMS items and BULK_CHUNK_MAX_BYTES of JSON
+# - chunks are sent concurrently, at most BULK_MAX_CONCURRENT_CHUNKS at a time (on top of the
+#   shared client's global limit)
+# - transient failures (429, 5xx, timeouts, dropped connections) are retried with jittered exponential
+#   backoff, honouring Retry-After. Non-idempotent writes (creates) are only retried when the request
+#   was refused before processing (connect errors, 429, 503), so a retry never creates items twice.
+# - a chunk rejected as a bad payload (400/413/422: one bad item fails the whole chunk, nothing is
+#   written) is split, creates included: with the backend's per-item validation errors ({key: [{...}, {}]})
+#   the flagged items fail and the rest are resent once, otherwise the chunk is bisected until the bad
+#   items are isolated. A rejection that reports partial application ("updated_count" > 0, as ratings
+#   can) is never resent; the whole chunk is reported as failed instead.
+# - any other 4xx (auth, routing: 401, 403, 404, ...) would fail every chunk the same way, so the call
+#   stops sending: the unsent items are reported as failed next to what was already written, and it
+#   only raises when nothing was written at all
+# Successful responses are merged in input order: lists are concatenated, dict counters summed and
+# dict lists concatenated. Items that still fail are reported one by one with their input index.
+
+_TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+_NEVER_SENT_STATUS = {429, 503}  # Refused before processing (rate limit, load shedding), safe to retry any write
+_NEVER_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+_PAYLOAD_STATUS = {400, 413, 422}  # The chunk's content was refused, smaller chunks may pass
+
+
+def chunk_items(items, max_items=BULK_CHUNK_ITEMS, max_bytes=BULK_CHUNK_MAX_BYTES):
+    """Yields (start index, chunk) with at most max_items items and about max_bytes of JSON each."""
+    start, size = 0, 0
+    for i, item in enumerate(items):
+        item_bytes = len(json.dumps(item, ensure_ascii=False).encode("utf-8"))
+        if i > start and (i - start >= max_items or size + item_bytes > max_bytes):
+            yield start, items[start:i]
+            start, size = i, 0
+        size += item_bytes
+    if start < len(items):
+        yield start, items[start:]
+
+
+def merge_responses(bodies):
+    """Merges per-chunk response bodies (in input order) into one."""
+    if all(isinstance(body, list) for body in bodies):
+        return [entry for body in bodies for entry in body]
+    merged = {}
+    for body in bodies:
+        for key, value in (body.items() if isinstance(body, dict) else ()):
+            previous = merged.get(key)
+            if isinstance(value, list) and isinstance(previous, list):
+                merged[key] = previous + value
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(previous, (int, float)):
+                merged[key] = previous + value
+            elif previous is None:
+                merged[key] = value
+    return merged
+
+
+def _error_body(resp):
+    try:
+        return resp.json()
+    except ValueError:
+        return None
+
+
+def _item_errors(body, key, n_items):
+    """The backend's per-item validation errors for a rejected chunk ({key: [errors per item]}), or None."""
+    errors = body.get(key) if isinstance(body, dict) else None
+    return errors if isinstance(errors, list) and len(errors) == n_items else None
+
+
+def _partially_applied(body):
+    return isinstance(body, dict) and bool(body.get("updated_count"))
+
+
+def tool_result(merged, failed, list_key="created"):
+    """The backend's own response shape when every item was written, else the merged response plus "failed"."""
+    if not failed:
+        return merged
+    if isinstance(merged, list):
+        return {list_key: merged, "failed": failed}
+    return {**merged, "failed": failed}
+
+
+async def send_with_retries(method, path, payload, idempotent, limit):
+    """One chunk request with retries. Returns (status or None, body on success / error text, last response)."""
+    status, error, resp = None, None, None
+    for attempt in range(BULK_MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            async with limit:
+                resp = await api_request(method, path, json=payload)
+        except httpx.TransportError as e:
+            status, error, resp = None, f"{type(e).__name__}: {e}", None
+            retryable = idempotent or isinstance(e, _NEVER_SENT_ERRORS)
+        else:
+            if resp.status_code < 400:
+                return resp.status_code, (resp.json() if resp.content else None), resp
+            status, error = resp.status_code, resp.text[:500]
+            retry_after = resp.headers.get("Retry-After")
+            retryable = status in _TRANSIENT_STATUS and (idempotent or status in _NEVER_SENT_STATUS)
+        if not retryable or attempt == BULK_MAX_RETRIES:
+            break
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else BULK_RETRY_BACKOFF_SECONDS * 2 ** attempt * (0.5 + random.random())
+        inc("bulk_retries_total", endpoint=path)
+        logger.warning(f"bulk_write: {method} {path} chunk failed ({status or error}), retry {attempt + 1}/{BULK_MAX_RETRIES} in {delay:.2f}s.")
+        await asyncio.sleep(delay)
+    return status, error, resp
+
+
+async def bulk_write(method, path, key, items, idempotent=True, max_items=BULK_CHUNK_ITEMS,
+                     max_bytes=BULK_CHUNK_MAX_BYTES, max_concurrent=BULK_MAX_CONCURRENT_CHUNKS):
+    """Writes `items` to `path` as {key: chunk} requests.
+
+    Returns (merged response, failed) where failed lists {"index", "item", "status", "error"} per item
+    that could not be written. Use tool_result() to shape it for a tool. Raises httpx.HTTPStatusError
+    on a non-payload 4xx (auth, routing) only when no chunk had been written yet.
+    """
+    start_time = time.time()
+    limit = asyncio.Semaphore(max_concurrent)
+    done, failed = [], []  # done: (first input index, body)
+    stats = {"requests": 0, "bisections": 0, "abort": None}
+
+    def fail(indexes, chunk, status, error):
+        failed.extend({"index": index, "item": item, "status": status, "error": error} for index, item in zip(indexes, chunk))
+
+    async def write(indexes, chunk):
+        if stats["abort"] is not None:
+            fail(indexes, chunk, stats["abort"].status_code, f"not sent: the backend answered {stats['abort'].status_code} to another chunk")
+            return
+        stats["requests"] += 1
+        status, body, resp = await send_with_retries(method, path, {key: chunk}, idempotent, limit)
+        if status is not None and status < 400:
+            done.append((indexes[0], body))
+            return
+        if status is not None and 400 <= status < 500 and status not in _TRANSIENT_STATUS and status not in _PAYLOAD_STATUS:
+            stats["abort"] = stats["abort"] or resp  # Auth or routing error: every other chunk would get the same
+            fail(indexes, chunk, status, body)
+            return
+        error_body = _error_body(resp) if status in _PAYLOAD_STATUS else None
+        if status not in _PAYLOAD_STATUS or len(chunk) == 1 or _partially_applied(error_body):
+            if _partially_applied(error_body) and len(chunk) > 1:
+                logger.warning(f"bulk_write: {method} {path} applied part of a rejected chunk of {len(chunk)} items ({status}); not resent.")
+            fail(indexes, chunk, status, body)
+            return
+        # Nothing was written: isolate the bad items, from the backend's per-item errors when it lists them
+        item_errors = _item_errors(error_body, key, len(chunk))
+        if item_errors is not None and 0 < sum(1 for e in item_errors if e) < len(chunk):
+            bad = [i for i, e in enumerate(item_errors) if e]
+            failed.extend({"index": indexes[i], "item": chunk[i], "status": status, "error": item_errors[i]} for i in bad)
+            good = [i for i, e in enumerate(item_errors) if not e]
+            await write([indexes[i] for i in good], [chunk[i] for i in good])
+            return
+        stats["bisections"] += 1
+        mid = len(chunk) // 2
+        await asyncio.gather(write(indexes[:mid], chunk[:mid]), write(indexes[mid:], chunk[mid:]))
+
+    with stage("bulk_write"):
+        chunks = list(chunk_items(items, max_items, max_bytes))
+        inc("bulk_chunks_total", len(chunks), endpoint=path)
+        await asyncio.gather(*(write(list(range(start, start + len(chunk))), chunk) for start, chunk in chunks))
+    if stats["abort"] is not None:
+        logger.error(f"bulk_write: {method} {path} stopped after {stats['requests']} requests, {len(done)} chunks written: "
+                     f"{stats['abort'].status_code} {stats['abort'].text[:200]}")
+        if not done:
+            stats["abort"].raise_for_status()
+    done.sort(key=lambda entry: entry[0])
+    failed.sort(key=lambda entry: entry["index"])
+    if failed:
+        inc("bulk_failed_items_total", len(failed), endpoint=path)
+    logger.info(f"bulk_write: {method} {path} wrote {len(items) - len(failed)}/{len(items)} items in {len(chunks)} chunks "
+                f"({stats['requests']} requests, {stats['bisections']} bisections) in {time.time() - start_time:.2f}s.")
+    return merge_responses([body for _, body in done]), failed
+
+
+describe("bulk_chunks_total", "Chunks submitted by the bulk writer (before retries and bisection)")
+describe("bulk_retries_total", "Bulk writer chunk retries after transient failures")
+describe("bulk_failed_items_total", "Items the bulk writer could not write")
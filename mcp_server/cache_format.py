@@ -0,0 +1,165 @@
+import glob
+import json
+import os
+import time
+import numpy as np
+from config import logger, CACHE_KEEP_GENERATIONS
+from item_store import ItemStore
+from host_lock import locked
+
+# On-disk cache format (replaces the old pickle file).
+# A cache is stored under a path prefix as:
+#   <prefix>.header.json          - format version, generation, dim, count, model name, timestamp
+#   <prefix>.<gen>.npy            - normalised float32 embedding block, opened with np.load(mmap_mode="r")
+#   <prefix>.<gen>.meta.npz       - item metadata sidecar, columnar (see item_store.py), row-aligned with the block
+#                                   (older generations used <prefix>.<gen>.meta.json, still readable)
+#   <prefix>.<gen>.index.npz      - optional persisted vector index (see vector_index.py)
+#   <prefix>.<gen>.codes.*        - optional persisted coarse codes of the embedding store (see embedding_store.py)
+#   <prefix>.lock                 - write lock, generations are allocated and published under it
+#   <prefix>.owner.lock           - held by the process that refreshes the cache (see cache_sharing.py)
+# Every file is written to a temp name and renamed into place. Data files of a new generation are
+# written first and the header is replaced last, so a crash mid-save leaves the previous generation intact.
+# The previous generation is kept (CACHE_KEEP_GENERATIONS) for processes that read its header just before
+# the switch; a reader that still finds its files gone re-reads the header and opens the newer one.
+# Nothing on the load path unpickles or executes stored data.
+
+FORMAT_VERSION = 1
+
+
+def header_path(prefix):
+    return f"{prefix}.header.json"
+
+
+def generation_path(prefix, generation, suffix):
+    return f"{prefix}.{generation:06d}{suffix}"
+
+
+def atomic_write(path, write_fn, mode="wb"):
+    """Writes via `write_fn(file)` to a temp file, fsyncs it and renames it over `path`."""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, mode) as f:
+            write_fn(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_header(prefix):
+    """Returns the parsed header dict, or None if missing/unreadable/of another format version."""
+    path = header_path(prefix)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"read_header: Could not read cache header {path}: {e}")
+        return None
+    if header.get("format_version") != FORMAT_VERSION:
+        logger.warning(f"read_header: Cache header {path} has format version {header.get('format_version')}, expected {FORMAT_VERSION}.")
+        return None
+    return header
+
+
+def write_cache(prefix, items, embeddings, model_name, timestamp, extra=None, fields=("item1", "item2")):
+    """Writes a new cache generation and publishes it by replacing the header. Returns the new header.
+    `items` is an ItemStore or a list of dicts; `fields` are the item fields stored next to the ids;
+    `extra` holds additional header fields (e.g. the sync watermark)."""
+    start_time = time.time()
+    # Serialised across processes, so two writers never allocate the same generation
+    with locked(f"{prefix}.lock"):
+        previous = read_header(prefix)
+        generation = (previous["generation"] + 1) if previous else 1
+        embeddings_file = generation_path(prefix, generation, ".npy")
+        metadata_file = generation_path(prefix, generation, ".meta.npz")
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        store = items if isinstance(items, ItemStore) else ItemStore.from_items(items, fields)
+        atomic_write(embeddings_file, lambda f: np.save(f, embeddings))
+        atomic_write(metadata_file, lambda f: np.savez(f, **store.to_arrays()))
+        header = {
+            "format_version": FORMAT_VERSION,
+            "generation": generation,
+            "count": int(embeddings.shape[0]),
+            "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+            "model": model_name,
+            "last_updated_timestamp": timestamp,
+            "normalized": True,
+            "embeddings_file": os.path.basename(embeddings_file),
+            "metadata_file": os.path.basename(metadata_file),
+            "fields": list(fields),
+            **(extra or {}),
+        }
+        atomic_write(header_path(prefix), lambda f: json.dump(header, f, indent=2), mode="w")
+        remove_stale_generations(prefix, generation)
+    logger.info(f"write_cache: Wrote generation {generation} ({header['count']} rows) in {time.time() - start_time:.2f}s.")
+    return header
+
+
+def update_header(prefix, **fields):
+    """Atomically rewrites header fields of the current generation (data files are untouched)."""
+    with locked(f"{prefix}.lock"):
+        header = read_header(prefix)
+        if header is None:
+            return None
+        header.update(fields)
+        atomic_write(header_path(prefix), lambda f: json.dump(header, f, indent=2), mode="w")
+    return header
+
+
+def open_embeddings(prefix, header):
+    """Memory-maps the embedding block referenced by `header` (read-only, zero-copy)."""
+    return np.load(os.path.join(os.path.dirname(prefix), header["embeddings_file"]), mmap_mode="r")
+
+
+def read_cache(prefix, model_name, retries=3):
+    """Opens the current generation. Returns (header, items as an ItemStore, embeddings memory-mapped),
+    or None if there is no valid cache for `model_name`. If the generation's files were removed between
+    reading the header and opening them (superseded meanwhile), the header is re-read up to `retries` times."""
+    for attempt in range(retries + 1):
+        header = read_header(prefix)
+        if header is None:
+            return None
+        if header.get("model") != model_name:
+            logger.warning(f"read_cache: Cache was built with model {header.get('model')}, expected {model_name}. Ignoring it.")
+            return None
+        try:
+            return _read_generation(prefix, header)
+        except FileNotFoundError as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"read_cache: Generation {header['generation']} was removed while opening it ({e}), re-reading the header.")
+
+
+def _read_generation(prefix, header):
+    embeddings = open_embeddings(prefix, header)
+    fields = header.get("fields", ["item1", "item2"])  # Caches written before collections stored pairs only
+    metadata_path = os.path.join(os.path.dirname(prefix), header["metadata_file"])
+    if metadata_path.endswith(".npz"):
+        with np.load(metadata_path, allow_pickle=False) as arrays:
+            items = ItemStore.from_arrays(dict(arrays), fields)
+    else:
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        items = ItemStore.from_columns(metadata["ids"], metadata, fields)
+    if embeddings.shape[0] != header["count"] or len(items) != header["count"]:
+        logger.error(f"read_cache: Row count mismatch in generation {header['generation']} (header {header['count']}, "
+                     f"embeddings {embeddings.shape[0]}, metadata {len(items)}).")
+        return None
+    return header, items, embeddings
+
+
+def remove_stale_generations(prefix, keep_generation, keep=CACHE_KEEP_GENERATIONS):
+    """Deletes data files of generations older than the `keep` newest up to `keep_generation`.
+    Files still mapped by another process may fail to delete on Windows."""
+    oldest_kept = keep_generation - max(keep, 1) + 1
+    for path in glob.glob(f"{glob.escape(prefix)}.[0-9]*"):
+        generation = os.path.basename(path)[len(os.path.basename(prefix)) + 1:].split(".", 1)[0]
+        if generation.isdigit() and int(generation) < oldest_kept:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug(f"remove_stale_generations: Could not remove {path}: {e}")
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from config import logger, CACHE_ROLE, CACHE_GENERATION_CHECK_SECONDS, CACHE_FOLLOWER_WAIT_SECONDS
+from cache_format import read_header
+from host_lock import try_lock
+from utils_cache import CACHES, COLLECTIONS, load_cache_from_file, load_local_cache_async, build_snapshot, publish
+from readiness import single_flight
+
+# Several server processes (and CLI runs) on one host share each collection's cache files.
+# - One process per collection owns the cache: it holds <prefix>.owner.lock for its lifetime and is the
+#   only one that fetches from the backend. If it exits, the OS drops the lock and the next process to
+#   look takes over.
+# - Followers attach to the published generation read-only: embeddings and coarse codes are memory-mapped,
+#   so the corpus sits in the OS page cache once per host however many processes use it.
+# - Every process notices a newer generation (refresh by the owner, delta from a CLI backfill) with a
+#   throttled header check on the query path, loads it in the background and publishes it as a whole.
+# CACHE_ROLE=owner / follower pins the role instead of using the lock.
+
+_OWNER_LOCKS = {}  # collection -> open lock file, held until the process exits
+_LAST_CHECK = {}  # collection -> time of the last header check
+_BACKGROUND = set()  # Running background loads (kept referenced until done)
+
+
+def is_owner(collection="pairs"):
+    if CACHE_ROLE == "owner":
+        return True
+    if CACHE_ROLE == "follower":
+        return False
+    if collection not in _OWNER_LOCKS:
+        handle = try_lock(f"{COLLECTIONS[collection]['prefix']}.owner.lock")
+        if handle is None:
+            return False
+        _OWNER_LOCKS[collection] = handle
+        logger.info(f"is_owner: This process now owns the {collection} cache.")
+    return True
+
+
+async def follow_collection(collection="pairs"):
+    """Follower init: attaches to the owner's current generation without fetching or writing.
+
+    Waits up to CACHE_FOLLOWER_WAIT_SECONDS for a first generation. Returns None if this process became the
+    owner meanwhile (the caller then runs the normal init), else the collection's cache.
+    """
+    start_time = time.time()
+    cache = CACHES[collection]
+    while not await load_local_cache_async(collection):
+        if is_owner(collection):
+            logger.info(f"follow_collection: No {collection} owner left, initialising as the owner.")
+            return None
+        if time.time() - start_time > CACHE_FOLLOWER_WAIT_SECONDS:
+            logger.error(f"follow_collection: No {collection} cache published after {CACHE_FOLLOWER_WAIT_SECONDS:.0f}s.")
+            return cache
+        await asyncio.sleep(1.0)
+    _LAST_CHECK[collection] = time.time()
+    logger.info(f"follow_collection: Attached to {collection} cache generation {cache['generation']} in {time.time() - start_time:.2f}s.")
+    return cache
+
+
+def _newer_generation(collection, force=False):
+    """Throttled to one header read per CACHE_GENERATION_CHECK_SECONDS unless `force`."""
+    cache = CACHES[collection]
+    now = time.time()
+    if cache["data"] is None or (not force and now - _LAST_CHECK.get(collection, 0) < CACHE_GENERATION_CHECK_SECONDS):
+        return False
+    _LAST_CHECK[collection] = now
+    header = read_header(COLLECTIONS[collection]["prefix"])
+    return header is not None and header["generation"] > (cache.get("generation") or 0)
+
+
+def sync_generation(collection="pairs", force=False):
+    """Loads a newer generation published by another process and publishes it once its indexes are
+    built. Blocking; the query path uses sync_generation_soon. Returns True if the cache changed."""
+    if not _newer_generation(collection, force):
+        return False
+    loaded = load_cache_from_file(collection)
+    if not loaded:
+        return False
+    cache = publish(collection, build_snapshot(loaded, collection))
+    logger.info(f"sync_generation: Switched {collection} cache to generation {cache['generation']} ({len(cache['data'])} items).")
+    return True
+
+
+async def _sync_in_background(collection):
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, sync_generation, collection, True)
+    except Exception as e:
+        logger.exception(f"sync_generation_soon: Loading the new {collection} generation failed: {e}")
+
+
+def sync_generation_soon(collection="pairs"):
+    """Query-path check: a newer generation is loaded in the background (shared with the refresher's
+    single-flight key) while requests keep using the current one. Returns True if a load was started."""
+    if not _newer_generation(collection):
+        return False
+    task = asyncio.ensure_future(single_flight(("refresh", collection), lambda: _sync_in_background(collection)))
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+    return True
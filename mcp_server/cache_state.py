@@ -0,0 +1,91 @@
+import threading
+import time
+from config import logger
+from query_cache import RESULT_CACHE
+from metrics import register_gauge
+
+# Collection specs and the published cache state of each collection.
+# A collection's state (items, embeddings, store, vector/lexical index, graph) is only ever replaced as
+# a whole: writers build a complete new state off to the side and publish() it with one dict update,
+# readers take a snapshot() (one dict copy) and use only that for the rest of the request. Both are
+# single C-level dict operations, so a reader never sees half of a refresh, and nothing reachable from
+# a published state is mutated afterwards (delta updates copy the store, index and graph first).
+# The CACHES dicts themselves are kept (aliases like PAIRS_CACHE stay valid); "version" counts publishes.
+
+# Named collections share the model, the on-disk format (see cache_format.py) and the refresh logic.
+# Each one has its own cache files, backend endpoints, stored text fields and embedding text.
+COLLECTIONS = {
+    "pairs": {
+        "prefix": "mcp_server_cache",
+        "fields": ("item1", "item2"),
+        "lexical_fields": ("item1", "item2"),  # Indexed by the lexical index (see lexical_index.py)
+        "neighbour_graph": True,  # Precomputed top-K neighbours (see neighbour_graph.py)
+        "list_path": "/contrast-pairs/",
+        "update_path": "/contrast-pairs/update/",
+        "text": lambda p: f"{p['item1']} vs {p['item2']}",
+    },
+    "topics": {
+        "prefix": "mcp_server_topics_cache",
+        "fields": ("name", "source"),
+        "lexical_fields": ("name",),
+        "list_path": "/topics/",
+        "update_path": "/topics/",  # Same endpoint as the batch_update_topics tool
+        "text": lambda t: t["name"],
+    },
+}
+
+
+def empty_cache():
+    return {
+        "data": None,
+        "db_embeddings": None,  # Normalised float32 matrix, memory-mapped from the cache file when possible
+        "last_updated_timestamp": None,  # Store timestamp directly
+        "generation": None,  # On-disk cache generation the data was loaded from / saved as
+        "max_seen_id": None,  # Delta-sync watermark: highest id fetched from the backend
+        "pending_ids": None,  # Ids fetched without an embedding, re-checked by delta syncs (see corpus_builder.sync_window)
+        "artifact_stamp": None,  # When the rows last changed; saved codes, indexes and graph are keyed on it
+        "index": None,  # Vector index over db_embeddings, loaded/built by build_vector_index
+        "store": None,  # Compact EmbeddingStore used for the first-pass scan
+        "lexical": None,  # LexicalIndex over the text fields, built next to the vector index
+        "graph": None,  # NeighbourGraph (collections with neighbour_graph), built next to the vector index
+        "version": 0,  # Number of states published in this process
+    }
+
+
+CACHES = {name: empty_cache() for name in COLLECTIONS}
+_PUBLISH_LOCK = threading.Lock()
+
+
+def snapshot(collection="pairs"):
+    """Consistent copy of the collection's published state; later publishes don't affect it."""
+    return dict(CACHES[collection])
+
+
+def publish(collection, state):
+    """Makes a completely built `state` the collection's cache in one step. Returns the live cache dict."""
+    cache = CACHES[collection]
+    with _PUBLISH_LOCK:  # Writers may publish from executor threads; keeps versions increasing
+        version = cache["version"] + 1
+        cache.update({**empty_cache(), **state, "version": version})
+    RESULT_CACHE.clear()  # Cached top-k results belong to the previous state
+    logger.info(f"publish: {collection} cache version {version} live (generation {state.get('generation')}, "
+                f"{len(state['data']) if state.get('data') is not None else 0} items).")
+    return cache
+
+
+def _cache_gauge(fn):
+    return lambda: {(("collection", name),): fn(snapshot(name)) for name in CACHES}
+
+
+def _cache_age(cache):
+    stamp = cache.get("last_updated_timestamp")
+    return round(time.time() - stamp, 1) if stamp else None
+
+
+register_gauge("item_store_bytes", _cache_gauge(lambda cache: cache["data"].nbytes if cache["data"] is not None else None),
+               "Bytes held by the columnar item metadata per collection")
+register_gauge("corpus_size", _cache_gauge(lambda cache: len(cache["data"] or [])), "Items with embeddings per collection")
+register_gauge("cache_age_seconds", _cache_gauge(_cache_age), "Seconds since the collection cache was refreshed")
+register_gauge("embedding_store_bytes", _cache_gauge(lambda cache: cache["store"].codes.nbytes if cache.get("store") is not None else None),
+               "Bytes of coarse embedding codes held for the first-pass scan")
+register_gauge("cache_version", _cache_gauge(lambda cache: cache["version"]), "Cache states published per collection in this process")
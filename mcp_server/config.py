@@ -28,3 +28,116 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger('mcp_server')
+
+# Vector index settings (see vector_index.py)
+VECTOR_INDEX_KIND = os.getenv("VECTOR_INDEX_KIND", "auto")  # auto | flat | ivf
+EXACT_SEARCH_MAX_ROWS = int(os.getenv("EXACT_SEARCH_MAX_ROWS", "20000"))  # auto: exact search up to this size
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 = ~4*sqrt(N) buckets
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))  # buckets scanned per query (higher = better recall, slower)
+IVF_TRAIN_ROWS = int(os.getenv("IVF_TRAIN_ROWS", "65536"))  # k-means training sample cap (64 rows per bucket below it)
+
+# Embedding store settings (see embedding_store.py)
+EMBEDDING_TRUNCATE_DIM = int(os.getenv("EMBEDDING_TRUNCATE_DIM", "0"))  # 0 = keep all dims (Matryoshka truncation otherwise)
+EMBEDDING_CODE_DTYPE = os.getenv("EMBEDDING_CODE_DTYPE", "int8")  # float32 | float16 | int8 | binary
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))  # Coarse candidates re-ranked per result (k * factor)
+
+# Lexical index and hybrid search modes (see lexical_index.py)
+LEXICAL_NGRAM = int(os.getenv("LEXICAL_NGRAM", "3"))  # Character n-gram size
+LEXICAL_BM25_K1 = float(os.getenv("LEXICAL_BM25_K1", "1.2"))
+LEXICAL_BM25_B = float(os.getenv("LEXICAL_BM25_B", "0.75"))
+LEXICAL_RRF_K = int(os.getenv("LEXICAL_RRF_K", "60"))  # Reciprocal rank fusion constant (hybrid mode)
+LEXICAL_HYBRID_CANDIDATES = int(os.getenv("LEXICAL_HYBRID_CANDIDATES", "50"))  # Rows taken from each ranking before fusion
+LEXICAL_PREFILTER_MIN_SCORE = float(os.getenv("LEXICAL_PREFILTER_MIN_SCORE", "0.3"))  # Normalised BM25 score of a prefilter candidate
+LEXICAL_PREFILTER_MAX_ROWS = int(os.getenv("LEXICAL_PREFILTER_MAX_ROWS", "5000"))  # More candidates = not selective, full dense scan
+
+# Precomputed neighbour graph for similar-by-id lookups (see neighbour_graph.py), built on the first such lookup
+NEIGHBOUR_GRAPH_K = int(os.getenv("NEIGHBOUR_GRAPH_K", "16"))  # Neighbours stored per item, 0 disables the graph
+NEIGHBOUR_GRAPH_BLOCK_ROWS = int(os.getenv("NEIGHBOUR_GRAPH_BLOCK_ROWS", "64"))  # Rows queried per block while building (small blocks probe few IVF buckets)
+
+# Query caches for the similarity path (see query_cache.py)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))  # Cached query embeddings (0 disables)
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))  # 0 = no expiry
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))  # Cached top-k results (0 disables)
+
+# Micro-batching of concurrent query encodes (see encode_batcher.py)
+ENCODE_MAX_BATCH_SIZE = int(os.getenv("ENCODE_MAX_BATCH_SIZE", "32"))  # Max texts per batched encode
+ENCODE_MAX_LATENCY_MS = float(os.getenv("ENCODE_MAX_LATENCY_MS", "5"))  # Max wait to fill a batch
+
+# Embedding model and backend (see embedding_backend.py)
+MODEL_NAME = "Snowflake/snowflake-arctic-embed-l-v2.0"
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "auto")  # auto | cuda | mps | cpu
+EMBEDDING_CPU_BACKEND = os.getenv("EMBEDDING_CPU_BACKEND", "int8")  # torch | int8 | onnx (CPU only)
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))  # torch intra-op threads, 0 = torch default
+PARITY_MIN_COSINE = float(os.getenv("PARITY_MIN_COSINE", "0.99"))  # Min cosine vs fp32 reference for CPU backends
+EMBEDDING_PARITY_CHECK = os.getenv("EMBEDDING_PARITY_CHECK", "1") == "1"  # Check CPU backends against fp32 at load
+
+# Shared backend HTTP client (see http_client.py)
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+# Per-endpoint timeouts as "path_prefix=seconds" pairs, e.g. "/contrast-pairs/=60,/news/=20"
+HTTP_ENDPOINT_TIMEOUTS = {
+    prefix.strip(): float(seconds)
+    for prefix, seconds in (
+        item.split("=", 1)
+        for item in os.getenv("HTTP_ENDPOINT_TIMEOUTS", "/contrast-pairs/=60,/topics/=60,/news/=30").split(",")
+        if "=" in item
+    )
+}
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+HTTP_MAX_CONCURRENT_REQUESTS = int(os.getenv("HTTP_MAX_CONCURRENT_REQUESTS", "16"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"  # Needs the optional 'h2' package
+
+# Persistent embedding cache shared by backfill and queries (see embedding_cache.py)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite")  # "" disables
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))  # LRU eviction above this much vector data
+
+# Embedding backfill pipeline (see backfill.py)
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "2000"))  # Backend max for contrast pairs
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "256"))  # Texts per encode / PATCH
+BACKFILL_UPLOAD_CONCURRENCY = int(os.getenv("BACKFILL_UPLOAD_CONCURRENCY", "4"))
+BACKFILL_QUEUE_BATCHES = int(os.getenv("BACKFILL_QUEUE_BATCHES", "4"))  # Batches buffered between stages
+
+# Chunked writes for the batch_* tools (see bulk_writer.py)
+BULK_CHUNK_ITEMS = int(os.getenv("BULK_CHUNK_ITEMS", "500"))  # Max items per request
+BULK_CHUNK_MAX_BYTES = int(os.getenv("BULK_CHUNK_MAX_BYTES", "1000000"))  # Max JSON bytes per request (embeddings are ~5 KB each)
+BULK_MAX_CONCURRENT_CHUNKS = int(os.getenv("BULK_MAX_CONCURRENT_CHUNKS", "4"))  # Chunks in flight per tool call
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "3"))  # Retries of a chunk after transient failures
+BULK_RETRY_BACKOFF_SECONDS = float(os.getenv("BULK_RETRY_BACKOFF_SECONDS", "0.5"))  # First retry delay, doubled per retry
+
+# Local news store and news backfill (see news_store.py and news_backfill.py)
+NEWS_STORE_ENABLED = os.getenv("NEWS_STORE_ENABLED", "true").lower() == "true"  # get_news serves fetched ranges locally
+NEWS_STORE_DIR = os.getenv("NEWS_STORE_DIR", "news_store")
+NEWS_SETTLE_SECONDS = float(os.getenv("NEWS_SETTLE_SECONDS", str(2 * 24 * 3600)))  # Ranges this recent are re-fetched later
+NEWS_SCHEDULE_PATH = os.getenv("NEWS_SCHEDULE_PATH", str(Path(__file__).parent.parent / 'documents' / 'news_dates.csv'))
+NEWS_BACKFILL_CONCURRENCY = int(os.getenv("NEWS_BACKFILL_CONCURRENCY", "4"))  # News requests in flight
+NEWS_BACKFILL_RATE_PER_SECOND = float(os.getenv("NEWS_BACKFILL_RATE_PER_SECOND", "5"))  # News request starts per second, 0 = unlimited
+
+# Near-duplicate detection (see dedup.py)
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.95"))  # Cosine similarity at/above which pairs are duplicates
+DEDUP_BLOCK_ROWS = int(os.getenv("DEDUP_BLOCK_ROWS", "2048"))  # Rows per block, the score block is BLOCK x BLOCK floats
+DEDUP_ANN_NEIGHBOURS = int(os.getenv("DEDUP_ANN_NEIGHBOURS", "32"))  # Neighbours checked per row when using the ANN index
+
+# Cache sharing between processes on one host (see cache_sharing.py)
+CACHE_ROLE = os.getenv("CACHE_ROLE", "auto")  # auto (owner lock) | owner | follower
+CACHE_GENERATION_CHECK_SECONDS = float(os.getenv("CACHE_GENERATION_CHECK_SECONDS", "5"))  # Header check interval on the query path
+CACHE_FOLLOWER_WAIT_SECONDS = float(os.getenv("CACHE_FOLLOWER_WAIT_SECONDS", "120"))  # Follower wait for a first generation
+CACHE_KEEP_GENERATIONS = int(os.getenv("CACHE_KEEP_GENERATIONS", "2"))  # Generations kept on disk (current + previous ones still being opened)
+CACHE_REFRESH_INTERVAL_SECONDS = float(os.getenv("CACHE_REFRESH_INTERVAL_SECONDS", "3600"))  # Background refresh of loaded caches, 0 disables
+DELTA_MAX_HOLDBACK_IDS = int(os.getenv("DELTA_MAX_HOLDBACK_IDS", "2000"))  # Delta syncs re-check items without an embedding this far below the newest id
+
+# Startup (see main.py and readiness.py)
+# background: serve immediately, warm the model and caches in the background (vector tools wait for it)
+# blocking: warm everything before serving; lazy: load on the first vector tool call
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")
+
+# Request tracing and on-demand profiling of tool calls (see tracing.py); profiling can also be
+# switched on at runtime with the configure_profiling tool
+TRACE_SLOW_REQUEST_SECONDS = float(os.getenv("TRACE_SLOW_REQUEST_SECONDS", "2"))  # Log calls slower than this with their spans, 0 disables
+PROFILE_NEXT_CALLS = int(os.getenv("PROFILE_NEXT_CALLS", "0"))  # cProfile the next N tool calls after startup
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "0"))  # cProfile every call, keep profiles of calls slower than this, 0 disables
+PROFILE_DIR = LOG_DIR / "profiles"
+
+# Metrics (see metrics.py)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Prometheus text endpoint on this port, 0 = disabled
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
@@ -0,0 +1,97 @@
+from base64 import b64decode
+import numpy as np
+from config import logger, DELTA_MAX_HOLDBACK_IDS
+from metrics import stage, inc
+from item_store import ItemStore
+
+# Streaming decode of backend pages for full cache builds (see corpus_fetch.stream_corpus_async).
+# Each page's base64 embeddings are decoded straight into rows of one float32 matrix preallocated from
+# the backend's reported `total` (doubled if the corpus grew meanwhile), and only the id and the
+# collection's fields are kept (as columns, see item_store.py), so the raw page can be dropped as soon as it is decoded.
+# Rows are in arrival order. Untouched capacity (items without embeddings) is never written, so the
+# OS does not commit it; `embeddings()` returns a view of the filled rows without copying.
+
+
+class DeltaWindowExceeded(RuntimeError):
+    """A delta sync walked its page cap without reaching the watermark; a full refresh is cheaper."""
+
+
+def sync_window(max_seen_id, pending_ids, max_holdback=DELTA_MAX_HOLDBACK_IDS):
+    """(since_id, pending ids) for the next delta sync. The walk starts below the oldest pending item (seen
+    without an embedding) so it is picked up once backfilled, but never more than `max_holdback` ids below
+    the watermark: older pending items wait for the next full refresh instead of pinning every delta."""
+    if max_seen_id is None:
+        return None, []
+    held = sorted(i for i in pending_ids or () if i > max_seen_id - max_holdback)
+    if len(held) < len(pending_ids or ()):
+        logger.warning(f"sync_window: {len(pending_ids) - len(held)} items without an embedding are more than "
+                       f"{max_holdback} ids below the watermark {max_seen_id}; left to the next full refresh.")
+    return (min(held[0] - 1, max_seen_id) if held else max_seen_id), held
+
+
+class CorpusBuilder:
+    def __init__(self, fields=("item1", "item2"), capacity=0):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.ids = []  # Row-aligned with the matrix
+        self.values = {field: [] for field in self.fields}
+        self.matrix = None  # Allocated on the first embedding, when the dim is known
+        self.n_rows = 0
+        self.n_fetched = 0
+        self.max_id = None  # Highest fetched id, with or without an embedding
+        self.missing_ids = []  # Fetched without an embedding (not decode errors: those won't fix themselves)
+        self.decode_errors = 0
+
+    def _reserve(self, rows, dim):
+        if self.matrix is None:
+            self.matrix = np.empty((max(self.capacity, rows), dim), dtype=np.float32)
+        elif self.n_rows + rows > len(self.matrix):
+            grown = np.empty((max(2 * len(self.matrix), self.n_rows + rows), dim), dtype=np.float32)
+            grown[:self.n_rows] = self.matrix[:self.n_rows]
+            logger.info(f"CorpusBuilder: Grew matrix from {len(self.matrix)} to {len(grown)} rows (backend total was low).")
+            self.matrix = grown
+
+    def add_page(self, results):
+        """Decodes one page of backend items. Returns self."""
+        with stage("decode"):
+            for p in results:
+                self.n_fetched += 1
+                self.max_id = p["id"] if self.max_id is None else max(self.max_id, p["id"])
+                if not p.get("vector_embedding"):
+                    self.missing_ids.append(p["id"])
+                    continue
+                try:
+                    emb = np.frombuffer(b64decode(p["vector_embedding"]), dtype=np.float32)
+                    if self.matrix is not None and len(emb) != self.matrix.shape[1]:
+                        raise ValueError(f"dim {len(emb)} != {self.matrix.shape[1]}")
+                except Exception as decode_err:
+                    self.decode_errors += 1
+                    inc("decode_errors_total")
+                    logger.error(f"CorpusBuilder: Could not decode embedding for item {p.get('id', 'N/A')}. Error: {decode_err}")
+                    continue
+                self._reserve(1, len(emb))
+                self.matrix[self.n_rows] = emb
+                self.n_rows += 1
+                self.ids.append(p["id"])
+                for field in self.fields:
+                    self.values[field].append(p.get(field))
+        return self
+
+    @property
+    def max_seen_id(self):
+        """Watermark for the next delta sync: the highest id fetched."""
+        return self.max_id
+
+    @property
+    def pending_ids(self):
+        """Items without an embedding the next delta syncs re-check (see sync_window)."""
+        return sync_window(self.max_id, self.missing_ids)[1]
+
+    def item_store(self):
+        return ItemStore.from_columns(self.ids, self.values, self.fields)
+
+    def embeddings(self):
+        """The decoded (n_rows, dim) float32 rows, or None if nothing had an embedding."""
+        if self.matrix is None or self.n_rows == 0:
+            return None
+        return self.matrix[:self.n_rows]
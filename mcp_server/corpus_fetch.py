@@ -0,0 +1,171 @@
+import asyncio
+import functools
+import time
+import httpx
+from config import logger, BULK_MAX_RETRIES, BULK_RETRY_BACKOFF_SECONDS
+from http_client import api_request
+from corpus_builder import CorpusBuilder, DeltaWindowExceeded
+from utils_cache import COLLECTIONS
+
+# Paged reads of whole collections from the backend.
+# - fetch_all_pairs_async / fetch_all_topics_async: every item as returned by the backend (base64 embeddings included)
+# - stream_corpus_async: full cache builds; each page is decoded into a CorpusBuilder as soon as it arrives,
+#   while the next requests are in flight, so raw pages never pile up (see corpus_builder.py)
+# - fetch_new_pairs_async: delta sync, pairs newer than a watermark id
+
+
+async def fetch_page_async(page: int, count: int, timeout: float = None, path: str = "/contrast-pairs/"):
+    params = {"page": page, "count": count, "vector_embedding": True}
+    logger.debug(f"fetch_page_async: Requesting page {page} with count {count}...")
+    request_start_time = time.time()
+    try:
+        # Shared pooled client (see http_client.py)
+        resp = await api_request("GET", path, params=params, **({"timeout": timeout} if timeout else {}))
+        resp.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+        logger.debug(f"fetch_page_async: Page {page} received status {resp.status_code} in {time.time() - request_start_time:.2f}s.")
+        return resp.json()
+    except httpx.RequestError as exc:
+        logger.error(f"fetch_page_async: HTTP Request error while requesting page {page} after {time.time() - request_start_time:.2f}s: {exc}")
+        return None
+    except Exception as exc:
+        logger.exception(f"fetch_page_async: Unexpected error fetching page {page} after {time.time() - request_start_time:.2f}s: {exc}")
+        return None
+
+
+async def fetch_all_pairs_async(count=200, max_concurrent=4, timeout=30.0, path="/contrast-pairs/"):
+    overall_start_time = time.time()
+    logger.info(f"Starting fetch_all_pairs_async for {path} with count={count}, max_concurrent={max_concurrent}, timeout={timeout}...")
+    # Fetch first page to get total and results
+    logger.info(f"fetch_all_pairs_async: Fetching first page...")
+    first_page_start = time.time()
+    first_page_data = await fetch_page_async(1, count, timeout, path)
+    logger.info(f"fetch_all_pairs_async: First page fetch took {time.time() - first_page_start:.2f}s.")
+
+    if not first_page_data:
+        logger.error("fetch_all_pairs_async: Error fetching the first page. Aborting fetch.")
+        return [] # Return empty list if first page fails
+
+    total = first_page_data.get("total", 0)
+    results = first_page_data.get("results", [])
+    if not results and total > 0:
+         logger.warning(f"fetch_all_pairs_async: No results found on the first page, but backend reported total={total}.")
+         # Continue fetching other pages despite empty first page if total > 0
+    elif not results:
+         logger.info("fetch_all_pairs_async: No results found on the first page and total is 0.")
+         return []
+
+    logger.info(f"fetch_all_pairs_async: Total pairs reported by backend: {total}")
+    num_pages = (total + count - 1) // count
+    logger.info(f"fetch_all_pairs_async: Calculated number of pages: {num_pages}")
+
+    if num_pages <= 1:
+        logger.info("fetch_all_pairs_async: All pairs fetched on the first page.")
+        logger.info(f"fetch_all_pairs_async finished in {time.time() - overall_start_time:.2f}s. Retrieved {len(results)} pairs.")
+        return results
+
+    # Limit concurrency
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def sem_fetch(page):
+        async with semaphore:
+            logger.debug(f"fetch_all_pairs_async: Fetching page {page}/{num_pages}...")
+            page_start_time = time.time()
+            page_data = await fetch_page_async(page, count, timeout, path)
+            duration = time.time() - page_start_time
+            res_count = len(page_data.get("results", [])) if page_data else 0
+            logger.debug(f"fetch_all_pairs_async: Page {page} fetched in {duration:.2f}s with {res_count} results.")
+            return page_data.get("results", []) if page_data else []
+
+    # Prepare tasks for remaining pages
+    tasks = [sem_fetch(page) for page in range(2, num_pages + 1)]
+
+    logger.info(f"fetch_all_pairs_async: Fetching remaining {len(tasks)} pages concurrently (max {max_concurrent})...")
+    remaining_fetch_start = time.time()
+    page_results_list = await asyncio.gather(*tasks)
+    logger.info(f"fetch_all_pairs_async: Fetched remaining pages in {time.time() - remaining_fetch_start:.2f}s.")
+
+    # Extend the main results list with results from other pages
+    for page_res in page_results_list:
+        results.extend(page_res)
+
+    logger.info(f"Finished fetch_all_pairs_async in {time.time() - overall_start_time:.2f}s. Total pairs retrieved: {len(results)} (Expected based on total: {total})")
+    if len(results) != total:
+         logger.warning(f"fetch_all_pairs_async: Mismatch between retrieved pairs ({len(results)}) and reported total ({total}).")
+    return results
+
+
+async def fetch_all_topics_async(count=1000, max_concurrent=4, timeout=30.0):
+    return await fetch_all_pairs_async(count, max_concurrent, timeout, path=COLLECTIONS["topics"]["list_path"])
+
+
+async def fetch_new_pairs_async(since_id, count=200, timeout=30.0, max_pages=1000):
+    """Fetches pairs with id > since_id, walking pages newest-first (the backend's default
+    ordering is by creation date descending) and stopping at the first page that reaches the watermark.
+    Raises DeltaWindowExceeded when `max_pages` pages don't reach it."""
+    start_time = time.time()
+    new_pairs = []
+    for page in range(1, max_pages + 1):
+        page_data = await fetch_page_async(page, count, timeout)
+        if page_data is None:
+            raise RuntimeError(f"fetch_new_pairs_async: Failed to fetch page {page}.")
+        results = page_data.get("results", [])
+        new_pairs.extend(p for p in results if p["id"] > since_id)
+        if not results or not page_data.get("next") or any(p["id"] <= since_id for p in results):
+            break
+    else:
+        logger.error(f"fetch_new_pairs_async: {max_pages} pages did not reach id {since_id}, a full refresh is needed.")
+        raise DeltaWindowExceeded(f"{len(new_pairs)} pairs in {max_pages} pages without reaching id {since_id}")
+    logger.info(f"fetch_new_pairs_async: Found {len(new_pairs)} pairs newer than id {since_id} in {page} page(s), {time.time() - start_time:.2f}s.")
+    return new_pairs
+
+
+async def fetch_page_with_retries(page, count, timeout, path, retries=BULK_MAX_RETRIES):
+    """fetch_page_async, retried with exponential backoff. None if every attempt failed."""
+    for attempt in range(retries + 1):
+        page_data = await fetch_page_async(page, count, timeout, path)
+        if page_data is not None or attempt == retries:
+            return page_data
+        logger.warning(f"fetch_page_with_retries: Page {page} of {path} failed, retry {attempt + 1}/{retries}.")
+        await asyncio.sleep(BULK_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+
+async def stream_corpus_async(fields=("item1", "item2"), count=200, max_concurrent=4, timeout=30.0, path="/contrast-pairs/"):
+    """Fetches a whole collection into a CorpusBuilder (items + preallocated float32 embedding matrix).
+    Failed pages are retried; if one still fails this raises, since a corpus with holes below its
+    watermark would never be completed by delta syncs."""
+    start_time = time.time()
+    first_page_data = await fetch_page_with_retries(1, count, timeout, path)
+    if not first_page_data:
+        # Raised (not an empty corpus) so init_cache keeps a stale cache instead of wiping it
+        raise RuntimeError(f"stream_corpus_async: Failed to fetch the first page of {path}.")
+    total = first_page_data.get("total", 0)
+    builder = CorpusBuilder(fields, capacity=total).add_page(first_page_data.get("results", []))
+    del first_page_data
+    num_pages = (total + count - 1) // count
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def sem_fetch(page):
+        async with semaphore:
+            return await fetch_page_with_retries(page, count, timeout, path)
+
+    failed_pages = 0
+    # Decode in completion order: a page is decoded while the following requests are still in flight
+    for next_page in asyncio.as_completed([sem_fetch(page) for page in range(2, num_pages + 1)]):
+        page_data = await next_page
+        if page_data is None:
+            failed_pages += 1
+            continue
+        builder.add_page(page_data.get("results", []))
+    if failed_pages:
+        # Like a failed first page: init_cache keeps the previous cache instead of publishing a truncated one
+        raise RuntimeError(f"stream_corpus_async: {failed_pages} of {num_pages} pages of {path} failed after retries.")
+    logger.info(f"stream_corpus_async: {builder.n_fetched} items ({builder.n_rows} with embeddings) from {path} in "
+                f"{time.time() - start_time:.2f}s. Reported total {total}.")
+    if builder.n_fetched != total:
+        logger.warning(f"stream_corpus_async: Mismatch between retrieved items ({builder.n_fetched}) and reported total ({total}).")
+    return builder
+
+
+def corpus_fetcher(fields, path, count=200, max_concurrent=4, timeout=30.0):
+    """A no-argument full fetch for init_cache/update_cache."""
+    return functools.partial(stream_corpus_async, fields, count, max_concurrent, timeout, path)
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import sys
+import time
+import numpy as np
+from config import logger, DEDUP_THRESHOLD, DEDUP_BLOCK_ROWS, DEDUP_ANN_NEIGHBOURS
+from vector_index import normalize_rows, FlatIPIndex
+from query_cache import normalize_query
+from cache_format import atomic_write
+from embedding_cache import EMBEDDING_CACHE
+from utils_cache import COLLECTIONS, snapshot, load_model_async, load_local_cache, load_local_cache_async
+from tracing import run_traced
+from rag import init_collection
+
+# Corpus-scale near-duplicate detection over a collection's normalised embeddings.
+# - find_duplicate_edges: every row pair with cosine >= threshold, either exactly with blocked
+#   matrix products over the upper triangle (memory bounded by block_rows^2) or through the ANN index
+# - duplicate_groups: clusters the edges with union-find into groups of duplicates
+# - filter_duplicate_pairs: pre-insert filter for batch_create_contrast_pairs (against the corpus and
+#   within the batch itself), rejecting "B vs A" reversals of existing pairs without touching the model.
+#   Without a local cache the collection is initialised first; if that fails the result says the corpus wasn't checked.
+#   The order-insensitive key -> row map of the corpus is built once per published cache version.
+
+_PAIR_KEYS = {"version": None, "keys": {}}
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:  # Path compression
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def find_duplicate_edges(vectors, threshold=DEDUP_THRESHOLD, block_rows=DEDUP_BLOCK_ROWS):
+    """Exact all-pairs search. Returns (rows_a, rows_b, scores) with rows_a < rows_b and score >= threshold."""
+    start_time = time.time()
+    n = len(vectors)
+    edges_a, edges_b, edges_s = [], [], []
+    for i0 in range(0, n, block_rows):
+        block = np.asarray(vectors[i0:i0 + block_rows], dtype=np.float32)
+        for j0 in range(i0, n, block_rows):  # Upper triangle of blocks only
+            scores = block @ np.asarray(vectors[j0:j0 + block_rows], dtype=np.float32).T
+            if j0 == i0:
+                scores = np.triu(scores, k=1)  # Skip self-matches and mirrored pairs
+            a, b = np.nonzero(scores >= threshold)
+            edges_a.append(a + i0)
+            edges_b.append(b + j0)
+            edges_s.append(scores[a, b])
+    result = _concat_edges(edges_a, edges_b, edges_s)
+    logger.info(f"find_duplicate_edges: {len(result[0])} edges >= {threshold} among {n} rows in {time.time() - start_time:.2f}s.")
+    return result
+
+
+def find_duplicate_edges_ann(index, vectors, threshold=DEDUP_THRESHOLD, k=DEDUP_ANN_NEIGHBOURS, block_rows=DEDUP_BLOCK_ROWS):
+    """Approximate all-pairs search: each row's k nearest neighbours from the index, kept if >= threshold."""
+    start_time = time.time()
+    edges_a, edges_b, edges_s = [], [], []
+    for start in range(0, len(vectors), block_rows):
+        queries = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        scores, neighbours = index.search_batch(queries, k + 1)  # +1, a row finds itself
+        rows = np.arange(start, start + len(queries))[:, None]
+        keep = (scores >= threshold) & (neighbours > rows)  # Each pair once, no self-matches
+        edges_a.append(np.broadcast_to(rows, neighbours.shape)[keep])
+        edges_b.append(neighbours[keep])
+        edges_s.append(scores[keep])
+    result = _concat_edges(edges_a, edges_b, edges_s)
+    logger.info(f"find_duplicate_edges_ann: {len(result[0])} edges >= {threshold} among {len(vectors)} rows in {time.time() - start_time:.2f}s.")
+    return result
+
+
+def _concat_edges(edges_a, edges_b, edges_s):
+    if not edges_a:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    return np.concatenate(edges_a).astype(np.int64), np.concatenate(edges_b).astype(np.int64), np.concatenate(edges_s)
+
+
+def duplicate_groups(collection="pairs", threshold=DEDUP_THRESHOLD, method="auto"):
+    """Groups of near-duplicate items in a loaded collection, largest first.
+
+    `method` is "exact" (blocked products), "ann" (the collection's vector index) or "auto"
+    (exact when the collection uses a flat index, ANN otherwise).
+    """
+    cache = snapshot(collection)
+    items, vectors, index = cache["data"], cache["db_embeddings"], cache.get("index")
+    if not items or vectors is None:
+        return []
+    if method == "auto":
+        method = "exact" if index is None or isinstance(index, FlatIPIndex) else "ann"
+    if method == "ann":
+        rows_a, rows_b, scores = find_duplicate_edges_ann(index, vectors, threshold)
+    else:
+        rows_a, rows_b, scores = find_duplicate_edges(vectors, threshold)
+    uf = UnionFind(len(items))
+    for a, b in zip(rows_a.tolist(), rows_b.tolist()):
+        uf.union(a, b)
+    members, max_score = {}, {}
+    for a, b, score in zip(rows_a.tolist(), rows_b.tolist(), scores.tolist()):
+        root = uf.find(a)
+        members.setdefault(root, set()).update((a, b))
+        max_score[root] = max(max_score.get(root, 0.0), score)
+    groups = [{
+        "size": len(rows),
+        "max_similarity": round(max_score[root], 4),
+        "items": [items[r] for r in sorted(rows)],
+    } for root, rows in members.items()]
+    groups.sort(key=lambda g: (-g["size"], -g["max_similarity"]))
+    logger.info(f"duplicate_groups: {len(groups)} {collection} duplicate groups ({len(rows_a)} edges, method={method}).")
+    return groups
+
+
+def export_duplicate_groups(groups, path):
+    atomic_write(path, lambda f: json.dump(groups, f, ensure_ascii=False, indent=2), mode="w")
+    logger.info(f"export_duplicate_groups: Wrote {len(groups)} groups to {path}.")
+    return path
+
+
+def _pair_key(item1, item2):
+    """Order-insensitive key, so "A vs B" and "B vs A" match."""
+    return frozenset((normalize_query(item1).lower(), normalize_query(item2).lower()))
+
+
+def _invalid_reason(pair):
+    if not isinstance(pair, dict):
+        return "not an object"
+    missing = [field for field in ("item1", "item2") if not isinstance(pair.get(field), str) or not pair[field].strip()]
+    return f"missing or empty {', '.join(missing)}" if missing else None
+
+
+async def _existing_pair_keys(cache):
+    """Key -> row of every pair in the cache snapshot, rebuilt (in an executor) only when a new version is published."""
+    if _PAIR_KEYS["version"] != cache["version"]:
+        items = cache["data"] or []
+        build = lambda: {_pair_key(items.value("item1", row), items.value("item2", row)): row for row in range(len(items))}
+        _PAIR_KEYS["keys"] = await run_traced(build)
+        _PAIR_KEYS["version"] = cache["version"]
+    return _PAIR_KEYS["keys"]
+
+
+async def filter_duplicate_pairs(pairs, threshold=DEDUP_THRESHOLD):
+    """Splits candidate pairs ({item1, item2}) into (accepted, rejected, corpus_checked) before insertion.
+
+    A candidate is rejected if it reverses/repeats an existing pair, is a near-duplicate (cosine >= threshold)
+    of a cached pair, or of a candidate accepted earlier in the same batch. Rejected entries say why.
+    corpus_checked is False when no pairs could be loaded, so only the batch itself was checked.
+    """
+    start_time = time.time()
+    if not await load_local_cache_async("pairs"):
+        try:
+            await init_collection("pairs")
+        except Exception as e:
+            logger.error(f"filter_duplicate_pairs: Could not load the pairs corpus: {e}")
+    cache = snapshot("pairs")
+    corpus_checked = cache["data"] is not None
+    if not corpus_checked:
+        logger.warning("filter_duplicate_pairs: No pairs corpus, only duplicates within the batch are filtered.")
+    items = cache["data"] or []
+    existing = await _existing_pair_keys(cache)
+    accepted, rejected, to_check = [], [], []
+    seen = set()
+    for pair in pairs:
+        reason = _invalid_reason(pair)
+        if reason is not None:
+            rejected.append({**(pair if isinstance(pair, dict) else {"input": pair}), "reason": "invalid", "error": reason})
+            continue
+        key = _pair_key(pair["item1"], pair["item2"])
+        if key in existing:
+            match = items[existing[key]]
+            rejected.append({**pair, "reason": "exists", "match": {"id": match["id"], "item1": match["item1"], "item2": match["item2"]}})
+        elif key in seen:
+            rejected.append({**pair, "reason": "repeated_in_batch"})
+        else:
+            seen.add(key)
+            to_check.append(pair)
+    if to_check:
+        model = await load_model_async()
+        if model is None:
+            logger.error("filter_duplicate_pairs: Model unavailable, only exact matches were filtered.")
+            return accepted + to_check, rejected, corpus_checked
+        texts = [COLLECTIONS["pairs"]["text"](p) for p in to_check]
+        embeddings = await asyncio.get_running_loop().run_in_executor(None, lambda: EMBEDDING_CACHE.encode(model, texts))
+        queries = normalize_rows(embeddings)
+        index = cache.get("index")
+        if index is not None:
+            corpus_scores, corpus_rows = index.search_batch(queries, 1)
+        batch_scores = queries @ queries.T  # Candidate vs candidate
+        kept = []
+        for i, pair in enumerate(to_check):
+            if index is not None and corpus_scores.shape[1] and corpus_scores[i, 0] >= threshold:
+                match = items[corpus_rows[i, 0]]
+                rejected.append({**pair, "reason": "near_duplicate", "similarity": round(float(corpus_scores[i, 0]), 4),
+                                 "match": {"id": match["id"], "item1": match["item1"], "item2": match["item2"]}})
+            elif kept and batch_scores[i, kept].max() >= threshold:
+                j = kept[int(np.argmax(batch_scores[i, kept]))]
+                rejected.append({**pair, "reason": "near_duplicate_in_batch", "similarity": round(float(batch_scores[i, j]), 4),
+                                 "match": {"item1": to_check[j]["item1"], "item2": to_check[j]["item2"]}})
+            else:
+                kept.append(i)
+                accepted.append(pair)
+    logger.info(f"filter_duplicate_pairs: {len(accepted)} accepted, {len(rejected)} rejected of {len(pairs)} in {time.time() - start_time:.2f}s.")
+    return accepted, rejected, corpus_checked
+
+
+if __name__ == "__main__":
+    # Export duplicate groups of the local pairs cache: python dedup.py [threshold] [output.json]
+    if not load_local_cache("pairs"):
+        raise SystemExit("No local cache with embeddings found. Start the server once to build it.")
+    threshold = float(sys.argv[1]) if len(sys.argv) > 1 else DEDUP_THRESHOLD
+    output = sys.argv[2] if len(sys.argv) > 2 else "duplicate_pairs.json"
+    export_duplicate_groups(duplicate_groups("pairs", threshold), output)
@@ -0,0 +1,146 @@
+import time
+import numpy as np
+from config import (
+    logger,
+    MODEL_NAME,
+    EMBEDDING_DEVICE,
+    EMBEDDING_CPU_BACKEND,
+    TORCH_NUM_THREADS,
+    PARITY_MIN_COSINE,
+    EMBEDDING_PARITY_CHECK,
+)
+
+# Embedding backend: picks the device, configures torch threads and, on CPU, an optimised
+# inference path whose embeddings stay compatible with the stored (fp32 reference) ones.
+# - "torch": plain fp32 SentenceTransformer (the reference)
+# - "int8":  dynamically int8-quantised nn.Linear layers (torch.quantization.quantize_dynamic)
+# - "onnx":  SentenceTransformer ONNX Runtime backend (needs `optimum[onnxruntime]`)
+# Non-reference backends must pass a parity check against the reference model or we fall back to it.
+# The reference only embeds PARITY_TEXTS before it is quantised in place (int8) or dropped (onnx), so two
+# copies of the model are never held; EMBEDDING_PARITY_CHECK=0 skips the check and the reference load.
+# torch and sentence_transformers are imported inside the functions, so importing this module (and the
+# server) stays cheap; the ML stack loads with the model (background warm-up or first vector tool call).
+
+PARITY_TEXTS = [
+    "dzień vs noc",
+    "wirtualne vs cyfrowa",
+    "kot vs pies",
+    "apple vs orange",
+    "miasto vs wieś",
+    "ogień vs woda",
+    "sun vs moon",
+    "tradycja vs nowoczesność",
+]
+
+
+class EmbeddingBackend:
+    """Thin wrapper around the loaded model, remembering how it was loaded."""
+
+    def __init__(self, model, kind, device, precision="fp32"):
+        self.model = model
+        self.kind = kind
+        self.device = device
+        self.precision = precision
+
+    @property
+    def cache_id(self):
+        """Embedding cache namespace: vectors of an int8 or ONNX backend never stand in for reference ones."""
+        return f"{MODEL_NAME}|{self.kind}|{self.precision}"
+
+    def encode(self, texts, show_progress_bar=False, batch_size=32):
+        embeddings = self.model.encode(texts, show_progress_bar=show_progress_bar, batch_size=batch_size, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def memory_bytes(self):
+        """Bytes held by torch parameters, buffers and packed int8 weights; None for ONNX."""
+        if not hasattr(self.model, "parameters"):
+            return None
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        total = sum(t.numel() * t.element_size() for t in tensors)
+        for module in self.model.modules():  # Dynamically quantised Linear layers keep packed weights outside both
+            packed = getattr(module, "_packed_params", None)
+            if packed is not None and hasattr(packed, "_weight_bias"):
+                weight, bias = packed._weight_bias()
+                total += weight.numel() * weight.element_size() + (bias.numel() * bias.element_size() if bias is not None else 0)
+        return total
+
+    def __repr__(self):
+        return f"EmbeddingBackend(kind={self.kind}, device={self.device}, precision={self.precision})"
+
+
+def select_device(preferred=EMBEDDING_DEVICE):
+    """Resolves "auto" to cuda, mps or cpu depending on what is available."""
+    if preferred != "auto":
+        return preferred
+    import torch
+    if torch.cuda.is_available():
+        return "cuda"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def configure_threads(num_threads=TORCH_NUM_THREADS):
+    """Sets torch intra-op threads (0 keeps torch's default)."""
+    import torch
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    logger.info(f"configure_threads: torch intra-op threads = {torch.get_num_threads()}.")
+
+
+def parity_check(candidate, reference_embeddings, texts=PARITY_TEXTS, min_cosine=PARITY_MIN_COSINE):
+    """Returns (ok, worst cosine) comparing candidate embeddings to the reference model's embeddings of `texts`."""
+    a = candidate.encode(texts)
+    b = np.asarray(reference_embeddings, dtype=np.float32)
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    worst = float(np.min(np.sum(a * b, axis=1)))
+    return worst >= min_cosine, worst
+
+
+def _load_cpu_backend(kind, check_parity=EMBEDDING_PARITY_CHECK):
+    """Returns (backend, fp32 reference embeddings of PARITY_TEXTS or None when not checked)."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if kind not in ("int8", "onnx"):
+        raise ValueError(f"Unknown CPU embedding backend '{kind}'. Expected torch, int8 or onnx.")
+    reference = None
+    if kind == "onnx":
+        if check_parity:  # The fp32 model is dropped before the ONNX one loads
+            reference = EmbeddingBackend(SentenceTransformer(MODEL_NAME, device="cpu"), "torch", "cpu").encode(PARITY_TEXTS)
+        model = SentenceTransformer(MODEL_NAME, device="cpu", backend="onnx")
+        return EmbeddingBackend(model, "onnx", "cpu"), reference
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    if check_parity:
+        reference = EmbeddingBackend(model, "torch", "cpu").encode(PARITY_TEXTS)
+    # In place: the fp32 Linear weights are replaced, not kept next to the int8 copy
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return EmbeddingBackend(model, "int8", "cpu", precision="int8"), reference
+
+
+def load_embedding_backend(device=EMBEDDING_DEVICE, cpu_backend=EMBEDDING_CPU_BACKEND):
+    """Loads the embedding model on the best available device (blocking, run it in an executor)."""
+    from sentence_transformers import SentenceTransformer
+    start_time = time.time()
+    device = select_device(device)
+    configure_threads()
+    if device != "cpu" or cpu_backend == "torch":
+        backend = EmbeddingBackend(SentenceTransformer(MODEL_NAME, device=device), "torch", device)
+        logger.info(f"load_embedding_backend: Loaded {backend} in {time.time() - start_time:.2f}s.")
+        return backend
+    try:
+        backend, reference = _load_cpu_backend(cpu_backend)
+    except Exception as e:
+        logger.exception(f"load_embedding_backend: Could not load '{cpu_backend}' CPU backend, using fp32 torch: {e}")
+        return EmbeddingBackend(SentenceTransformer(MODEL_NAME, device="cpu"), "torch", "cpu")
+    if reference is None:
+        logger.info(f"load_embedding_backend: Loaded {backend} in {time.time() - start_time:.2f}s without a parity check.")
+        return backend
+    ok, worst = parity_check(backend, reference)
+    if not ok:
+        logger.error(f"load_embedding_backend: {backend} failed parity check (worst cosine {worst:.4f} < {PARITY_MIN_COSINE}). Using fp32 torch.")
+        del backend
+        return EmbeddingBackend(SentenceTransformer(MODEL_NAME, device="cpu"), "torch", "cpu")
+    logger.info(f"load_embedding_backend: Loaded {backend} in {time.time() - start_time:.2f}s. Parity worst cosine {worst:.4f}.")
+    return backend
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from config import logger, MODEL_NAME, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_MB
+from query_cache import normalize_query
+from metrics import inc, describe
+
+# Persistent, content-addressed embedding cache shared by the backfill, dedup and query encoders.
+# Key: blake2b(model id + normalised text), value: the float32 vector model.encode returned. The model id
+# includes the backend kind and precision, so int8/ONNX vectors and fp32 reference ones are kept apart.
+# Stored in one SQLite file (WAL, so several processes can use it) with a last-used time per row;
+# when the file holds more than EMBEDDING_CACHE_MAX_MB of vectors the least recently used tenth is
+# evicted. A retried backfill, a re-inserted pair or a fresh environment with the file copied over
+# reads vectors from disk instead of running the model. EMBEDDING_CACHE_PATH="" disables it.
+
+_ROW_OVERHEAD_BYTES = 64  # Key, timestamp and SQLite page overhead per row (approximate)
+
+
+def model_id(model):
+    """Cache namespace of a model: its `cache_id` (backend kind and precision, or a test stub's), else MODEL_NAME."""
+    return getattr(model, "cache_id", MODEL_NAME)
+
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_mb=EMBEDDING_CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = max_mb * 1024 * 1024
+        self._conn = None
+        self._lock = threading.Lock()
+        self._rows = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._rows = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            logger.info(f"EmbeddingCache: Opened {self.path} with {self._rows} embeddings.")
+        return self._conn
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn):
+        conn.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.blake2b(f"{model_name}\x00{normalize_query(text)}".encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, keys):
+        """key -> float32 vector for the keys present; marks them as used."""
+        if not keys:
+            return {}
+        with self._lock:
+            conn = self._connect()
+            found = {}
+            for start in range(0, len(keys), 500):  # SQLite host parameter limit
+                chunk = keys[start:start + 500]
+                rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            if found:
+                now = time.time()
+                with self._transaction(conn):
+                    conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def put_many(self, entries):
+        """Stores (key, vector) pairs, evicting least recently used rows past the size cap."""
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with self._transaction(conn):
+                conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                                 [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in entries])
+                # Counted in the write transaction: other processes insert into the same file
+                self._rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                max_rows = max(1, self.max_bytes // (len(entries[0][1]) * 4 + _ROW_OVERHEAD_BYTES))
+                if self._rows > max_rows:
+                    evict = conn.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                                         (self._rows - int(max_rows * 0.9),)).rowcount
+                    self._rows -= evict
+                    inc("embedding_cache_evictions_total", evict)
+                    logger.info(f"EmbeddingCache: Evicted {evict} least recently used embeddings ({self._rows} left).")
+
+    def encode(self, model, texts, **kwargs):
+        """model.encode(texts) with cached vectors reused and new ones stored. Blocking, run in an executor."""
+        if not self.enabled or not len(texts):
+            return np.asarray(model.encode(texts, show_progress_bar=False, **kwargs), dtype=np.float32)
+        name = model_id(model)
+        keys = [self.key(name, text) for text in texts]
+        try:
+            found = self.get_many(list(dict.fromkeys(keys)))
+        except sqlite3.Error as e:
+            logger.warning(f"EmbeddingCache: Lookup failed, encoding everything: {e}")
+            found = {}
+        n_hits = sum(key in found for key in keys)
+        self.hits += n_hits
+        self.misses += len(keys) - n_hits
+        inc("embedding_cache_requests_total", n_hits, outcome="hits")
+        inc("embedding_cache_requests_total", len(keys) - n_hits, outcome="misses")
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            text_of = dict(zip(keys, texts))
+            encoded = np.asarray(model.encode([text_of[key] for key in missing], show_progress_bar=False, **kwargs), dtype=np.float32)
+            fresh = list(zip(missing, encoded))
+            found.update(fresh)
+            try:
+                self.put_many(fresh)
+            except sqlite3.Error as e:
+                logger.warning(f"EmbeddingCache: Could not store {len(fresh)} embeddings: {e}")
+        return np.stack([found[key] for key in keys])
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"path": self.path, "rows": self._rows, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+
+EMBEDDING_CACHE = EmbeddingCache()
+
+describe("embedding_cache_requests_total", "Texts looked up in the persistent embedding cache by outcome")
+describe("embedding_cache_evictions_total", "Embeddings evicted from the persistent embedding cache")
@@ -0,0 +1,278 @@
+import json
+import os
+import time
+import numpy as np
+from config import logger, EMBEDDING_TRUNCATE_DIM, EMBEDDING_CODE_DTYPE, RERANK_FACTOR
+from vector_index import top_k, top_k_rows
+from metrics import stage
+from cache_format import atomic_write
+
+# Compact embedding store for the first-pass similarity scan.
+# Keeps a coarse copy of every (normalised) embedding:
+# - optionally truncated to the first `truncate_dim` dims (Matryoshka), then renormalised
+# - encoded as float32 / float16 / int8 (per-dimension scale) / binary (sign bits)
+# Top candidates from the coarse scan are re-ranked against the full-precision vectors,
+# which are only loaded (e.g. memory-mapped from disk) when first needed.
+# Codes can be saved next to a cache generation and memory-mapped back (save_codes / load_codes), so
+# processes sharing the cache share one copy of them in the OS page cache instead of re-encoding.
+
+CODE_DTYPES = ("float32", "float16", "int8", "binary")
+SCAN_BLOCK_ROWS = 8192  # Rows converted to float32 at a time during the coarse scan
+
+
+class EmbeddingStore:
+    def __init__(self, full_loader, n_rows, dim, truncate_dim=EMBEDDING_TRUNCATE_DIM,
+                 code_dtype=EMBEDDING_CODE_DTYPE, rerank_factor=RERANK_FACTOR):
+        if code_dtype not in CODE_DTYPES:
+            raise ValueError(f"Unknown embedding code dtype '{code_dtype}'. Expected one of {CODE_DTYPES}.")
+        self._full_loader = full_loader
+        self._full = None
+        self.n_rows = n_rows
+        self.dim = dim
+        self.truncate_dim = min(truncate_dim or dim, dim)
+        self.code_dtype = code_dtype
+        self.rerank_factor = rerank_factor
+        self.codes = None
+        self.scale = None  # int8 only: per-dimension dequantisation scale
+        self.zero_rows = np.empty(0, dtype=np.int64)
+
+    @property
+    def exact(self):
+        """True when the coarse scan already uses the full vectors, so no re-ranking is needed."""
+        return self.code_dtype == "float32" and self.truncate_dim == self.dim
+
+    def __len__(self):
+        return self.n_rows
+
+    def full_vectors(self):
+        """Full-precision normalised vectors, loaded on first use."""
+        if self._full is None:
+            start_time = time.time()
+            self._full = self._full_loader()
+            logger.info(f"EmbeddingStore: Loaded full-precision vectors {self._full.shape} in {time.time() - start_time:.2f}s.")
+        return self._full
+
+    def release_full(self):
+        """Drops the reference to the full vectors (they will be reloaded lazily)."""
+        self._full = None
+
+    def _truncate(self, vectors):
+        if self.truncate_dim == self.dim:
+            return vectors
+        vectors = np.ascontiguousarray(vectors[..., :self.truncate_dim], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def build(self, block_rows=65536):
+        """Encodes the coarse codes from the full vectors, block by block."""
+        start_time = time.time()
+        full = self.full_vectors()
+        self.zero_rows = np.where(~np.asarray(full).any(axis=1))[0]
+        if self.exact:
+            self.codes = full
+            return self
+        if self.code_dtype == "int8":
+            # Per-dimension symmetric scale so the full int8 range is used
+            max_abs = np.zeros(self.truncate_dim, dtype=np.float32)
+            for start in range(0, self.n_rows, block_rows):
+                block = self._truncate(full[start:start + block_rows])
+                max_abs = np.maximum(max_abs, np.abs(block).max(axis=0))
+            max_abs[max_abs == 0] = 1.0
+            self.scale = max_abs / 127.0
+        self.codes = np.concatenate([self._encode(self._truncate(full[start:start + block_rows]))
+                                     for start in range(0, self.n_rows, block_rows)])
+        logger.info(f"EmbeddingStore: Encoded {self.n_rows} vectors as {self.code_dtype}[{self.truncate_dim}] "
+                    f"({self.bytes_per_row()} bytes/row, {self.compression():.1f}x smaller) in {time.time() - start_time:.2f}s.")
+        return self
+
+    def apply_rows(self, full_loader, row_ids, vectors):
+        """Incrementally applies patched and appended rows instead of re-encoding everything.
+
+        `full_loader` returns the updated full matrix; `row_ids` >= the current row count are appends.
+        The int8 scale is kept from the initial build (out-of-range values are clipped).
+        """
+        self._full_loader = full_loader
+        self._full = None
+        n_rows = max(self.n_rows, int(row_ids.max()) + 1)
+        if self.exact:
+            self.n_rows = n_rows
+            self.codes = self.full_vectors()
+        else:
+            new_codes = self._encode(self._truncate(vectors))
+            # Always a new array: mapped codes are read-only and a published cache state may still scan them
+            if n_rows > self.n_rows:
+                padding = np.zeros((n_rows - self.n_rows,) + new_codes.shape[1:], dtype=new_codes.dtype)
+                self.codes = np.concatenate([self.codes, padding])
+                self.n_rows = n_rows
+            else:
+                self.codes = np.array(self.codes)
+            self.codes[row_ids] = new_codes
+        is_zero = ~vectors.any(axis=1)
+        self.zero_rows = np.union1d(np.setdiff1d(self.zero_rows, row_ids), row_ids[is_zero])
+        return self
+
+    def _encode(self, vectors):
+        if self.code_dtype == "float16":
+            return vectors.astype(np.float16)
+        if self.code_dtype == "int8":
+            return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        if self.code_dtype == "binary":
+            return np.packbits(vectors > 0, axis=-1)
+        return vectors.astype(np.float32)
+
+    def codes_path(self, base):
+        """Codes file for `base` (a cache generation path prefix); the settings are part of the name."""
+        return f"{base}.codes.{self.code_dtype}-{self.truncate_dim}.npy"
+
+    def save_codes(self, base, stamp):
+        """Writes codes (.npy), int8 scale and zero rows (.npz) atomically. No-op for exact stores."""
+        if self.exact or self.codes is None:
+            return
+        path = self.codes_path(base)
+        scale = self.scale if self.scale is not None else np.empty(0, dtype=np.float32)
+        atomic_write(path[:-4] + ".npz", lambda f: np.savez(f, scale=scale, zero_rows=self.zero_rows, stamp=stamp))
+        atomic_write(path, lambda f: np.save(f, self.codes))  # Written last, its presence marks a complete save
+
+    def load_codes(self, base, stamp):
+        """Memory-maps codes saved by save_codes for the same cache `stamp`. Returns False (nothing changed) if missing or stale."""
+        path = self.codes_path(base)
+        if self.exact or not os.path.exists(path):
+            return False
+        try:
+            codes = np.load(path, mmap_mode="r")
+            with np.load(path[:-4] + ".npz", allow_pickle=False) as extra:
+                scale, zero_rows, saved_stamp = extra["scale"], extra["zero_rows"], float(extra["stamp"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"EmbeddingStore: Could not load codes from {path}: {e}")
+            return False
+        if len(codes) != self.n_rows or saved_stamp != stamp:
+            return False
+        self.codes, self.zero_rows = codes, zero_rows
+        self.scale = scale if self.code_dtype == "int8" else None
+        return True
+
+    def bytes_per_row(self):
+        if self.code_dtype == "binary":
+            return (self.truncate_dim + 7) // 8
+        return self.truncate_dim * np.dtype(self.code_dtype).itemsize
+
+    def compression(self):
+        return (self.dim * 4) / self.bytes_per_row()
+
+    def coarse_scores(self, query, rows=None):
+        """First-pass scores for all rows (or the given row ids) against a normalised query."""
+        codes = self.codes if rows is None else self.codes[rows]
+        if self.exact:
+            return codes @ query
+        q = self._truncate(query)
+        if self.code_dtype == "binary":
+            q_bits = np.packbits(q > 0)
+            hamming = np.bitwise_count(codes ^ q_bits).sum(axis=1, dtype=np.int32)
+            return 1.0 - 2.0 * hamming / self.truncate_dim
+        if self.code_dtype == "int8":
+            q = q * self.scale  # codes * scale @ q == codes @ (scale * q)
+        if codes.dtype == np.float32:
+            return codes @ q
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+            scores[start:start + SCAN_BLOCK_ROWS] = codes[start:start + SCAN_BLOCK_ROWS].astype(np.float32) @ q
+        return scores
+
+    def search(self, query, k, rows=None):
+        """Coarse scan, then exact re-rank of the top k * rerank_factor candidates.
+
+        Returns (scores, row_ids) sorted by descending similarity.
+        """
+        with stage("similarity"):
+            scores = self.coarse_scores(query, rows)
+        with stage("topk"):
+            row_ids = np.arange(self.n_rows) if rows is None else np.asarray(rows)
+            if not self.exact:
+                # Sorted row ids keep reads from a memory-mapped full matrix sequential
+                row_ids = np.sort(row_ids[top_k(scores, k * self.rerank_factor)])
+                scores = self.full_vectors()[row_ids] @ query
+            if len(self.zero_rows) > 0:
+                scores[np.isin(row_ids, self.zero_rows)] = -1.0
+            idx = top_k(scores, k)
+        return scores[idx], row_ids[idx]
+
+    def _block_scores(self, codes, queries):
+        """(n_queries, n_codes) first-pass scores of a block of codes against prepared queries."""
+        if self.code_dtype == "binary":
+            hamming = np.bitwise_count(codes[None, :, :] ^ queries[:, None, :]).sum(axis=2, dtype=np.int32)
+            return 1.0 - 2.0 * hamming / self.truncate_dim
+        return queries @ np.asarray(codes, dtype=np.float32).T
+
+    def search_batch(self, queries, k, rows=None, block_rows=SCAN_BLOCK_ROWS):
+        """Batched `search` for a (n_queries, dim) matrix of normalised queries.
+
+        Each block of rows is scored against all queries with one matrix-matrix product while a running
+        top k * rerank_factor per query is kept, so memory stays bounded by the block size.
+        Returns (scores, row_ids), both (n_queries, k) with each row sorted by descending similarity.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        row_ids = np.arange(self.n_rows) if rows is None else np.asarray(rows)
+        n_keep = k if self.exact else k * self.rerank_factor
+        prepared = queries if self.exact else self._truncate(queries)
+        if not self.exact and self.code_dtype == "binary":
+            prepared = np.packbits(prepared > 0, axis=-1)
+        elif not self.exact and self.code_dtype == "int8":
+            prepared = prepared * self.scale
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(row_ids), block_rows):
+            block_ids = row_ids[start:start + block_rows]
+            codes = self.codes[start:start + block_rows] if rows is None else self.codes[block_ids]
+            scores = np.concatenate([best_scores, self._block_scores(codes, prepared)], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(block_ids, (len(queries), len(block_ids)))], axis=1)
+            keep = top_k_rows(scores, n_keep)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_rows = np.take_along_axis(candidates, keep, axis=1)
+        if not self.exact:
+            # One product of the (sorted, de-duplicated) candidate rows with all queries
+            unique_rows, inverse = np.unique(best_rows, return_inverse=True)
+            exact_scores = np.asarray(self.full_vectors()[unique_rows]) @ queries.T
+            best_scores = exact_scores[inverse.reshape(best_rows.shape), np.arange(len(queries))[:, None]]
+        if len(self.zero_rows) > 0:
+            best_scores = np.where(np.isin(best_rows, self.zero_rows), -1.0, best_scores)
+        idx = top_k_rows(best_scores, k)
+        return np.take_along_axis(best_scores, idx, axis=1), np.take_along_axis(best_rows, idx, axis=1)
+
+
+def recall_report(vectors, settings=None, k=10, n_queries=200, seed=0):
+    """Measures recall@k and scan time of each store setting against exact search.
+
+    `vectors` are normalised full embeddings; a random sample of them is used as queries.
+    Returns a list of dicts, one per (truncate_dim, code_dtype) setting.
+    """
+    settings = settings or [(0, dtype) for dtype in CODE_DTYPES] + [(256, "float32"), (256, "int8"), (256, "binary")]
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    exact = [set(top_k(vectors @ q, k)) for q in queries]
+    report = []
+    for truncate_dim, code_dtype in settings:
+        store = EmbeddingStore(lambda: vectors, len(vectors), vectors.shape[1], truncate_dim, code_dtype).build()
+        start_time = time.time()
+        hits = 0
+        for q, truth in zip(queries, exact):
+            _, row_ids = store.search(q, k)
+            hits += len(truth & set(row_ids.tolist()))
+        report.append({
+            "truncate_dim": store.truncate_dim,
+            "code_dtype": code_dtype,
+            "bytes_per_row": store.bytes_per_row(),
+            "compression": round(store.compression(), 1),
+            f"recall@{k}": round(hits / (k * len(queries)), 4),
+            "ms_per_query": round((time.time() - start_time) * 1000 / len(queries), 3),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # Recall-vs-exact report over the local cache: python embedding_store.py
+    from utils_cache import load_cache_from_file
+    cache = load_cache_from_file()
+    if not cache or cache.get("db_embeddings") is None:
+        raise SystemExit("No local cache with embeddings found. Start the server once to build it.")
+    print(json.dumps(recall_report(np.asarray(cache["db_embeddings"])), indent=2))
@@ -0,0 +1,80 @@
+import asyncio
+import time
+import numpy as np
+from config import logger, ENCODE_MAX_BATCH_SIZE, ENCODE_MAX_LATENCY_MS
+from metrics import stage
+from embedding_cache import EMBEDDING_CACHE
+
+# Dynamic micro-batching for query embeddings.
+# Concurrent callers each await `encode(text)`; a single worker collects pending requests for up to
+# `max_latency_ms` (or until `max_batch_size` texts are waiting), runs one batched model.encode in an
+# executor and fans the vectors back out. While a batch is encoding, new requests queue up for the next one.
+
+
+class EncodeBatcher:
+    def __init__(self, model_loader, max_batch_size=ENCODE_MAX_BATCH_SIZE, max_latency_ms=ENCODE_MAX_LATENCY_MS):
+        self.model_loader = model_loader  # async callable returning the model (or None)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self._queue = None
+        self._worker = None
+        self._loop = None
+        self.batches = 0
+        self.encoded = 0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        # Queues and tasks are bound to one event loop (CLI runs may call asyncio.run more than once)
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def encode(self, text):
+        """Returns the float32 embedding of `text`, batched with other concurrent callers."""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Drain anything else that is already waiting, up to the batch limit
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            texts = list(dict.fromkeys(text for text, _ in batch))  # Unique texts, order preserved
+            try:
+                model = await self.model_loader()
+                if model is None:
+                    raise RuntimeError("Embedding model is not available.")
+                with stage("encode_batch") as t:
+                    embeddings = await asyncio.get_running_loop().run_in_executor(
+                        None, lambda: EMBEDDING_CACHE.encode(model, texts)
+                    )
+                embeddings = np.asarray(embeddings, dtype=np.float32)
+                self.batches += 1
+                self.encoded += len(texts)
+                logger.debug(f"EncodeBatcher: Encoded batch of {len(texts)} texts ({len(batch)} requests) in {t.elapsed:.3f}s.")
+                by_text = dict(zip(texts, embeddings))
+                for text, future in batch:
+                    if not future.done():
+                        future.set_result(by_text[text])
+            except Exception as e:
+                logger.exception(f"EncodeBatcher: Batch encode of {len(texts)} texts failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import time
+from base64 import b64encode, b64decode
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+import httpx
+import numpy as np
+
+# Offline stand-ins for benchmarks (see benchmark.py):
+# - make_embeddings / make_pairs / make_topics / make_news: synthetic, reproducible corpora
+# - FakeBackend: in-process fake of the /contrast-pairs/, /topics/ and /news/ agent endpoints served
+#   through an httpx.MockTransport, with configurable per-request latency and page-size limits
+# - StubEmbeddingModel: deterministic hash-seeded encoder, so nothing has to be downloaded
+# Embeddings are kept as one float32 matrix and base64-encoded per page on request.
+
+API_PREFIX = "/words/agent"
+
+
+def make_embeddings(n, dim, n_clusters=256, noise=0.35, seed=0, block=65536):
+    """Clustered unit vectors (closer to real embeddings than uniform noise), generated block by block."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, block):
+        size = min(block, n - start)
+        rows = centroids[rng.integers(0, n_clusters, size)] + noise * rng.standard_normal((size, dim)).astype(np.float32) / np.sqrt(dim)
+        vectors[start:start + size] = rows / np.linalg.norm(rows, axis=1, keepdims=True)
+    return vectors
+
+
+def make_pairs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    words = [f"word{i}" for i in range(max(64, int(np.sqrt(n)) * 4))]
+    picks = rng.integers(0, len(words), (n, 2))
+    return [{"id": i + 1, "item1": words[a], "item2": words[b]} for i, (a, b) in enumerate(picks.tolist())]
+
+
+def make_topics(n, seed=0):
+    rng = np.random.default_rng(seed)
+    sources = ["agent", "news", "user"]
+    return [{"id": i + 1, "name": f"topic {i + 1}", "source": sources[int(s)]} for i, s in enumerate(rng.integers(0, 3, n))]
+
+
+def make_news(n, start=datetime(2024, 5, 1, tzinfo=timezone.utc), seed=0):
+    rng = np.random.default_rng(seed)
+    types = ["general_news", "sport", "tech", "science", "politics", "polish_showbiznes"]
+    news = []
+    for i in range(n):
+        begin = start + timedelta(days=i // len(types) * 7)
+        news.append({
+            "id": i + 1,
+            "data_response": {"summary": f"synthetic news {i + 1}", "score": float(rng.random())},
+            "start_date": begin.isoformat().replace("+00:00", "Z"),
+            "end_date": (begin + timedelta(days=6)).isoformat().replace("+00:00", "Z"),
+            "search_type": "sonar-pro",
+            "news_source": types[i % len(types)],
+        })
+    return news
+
+
+def encode_embedding(vector):
+    return b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("utf-8")
+
+
+class StubEmbeddingModel:
+    """Drop-in for EmbeddingBackend: the same text always maps to the same unit vector."""
+    kind = "stub"
+    device = "cpu"
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.cache_id = f"stub-{dim}"  # Own namespace in the persistent embedding cache
+
+    def encode(self, texts, show_progress_bar=False, batch_size=32):
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+            out[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+class FakeBackend:
+    """In-process fake of the agent API. Install with http_client.set_transport(backend.transport())."""
+
+    def __init__(self, pairs=None, pair_embeddings=None, topics=None, topic_embeddings=None, news=None,
+                 latency_ms=0.0, max_page_size=2000, max_topic_page_size=5000):
+        self.pairs = pairs or []
+        self.pair_embeddings = pair_embeddings  # Row-aligned with pairs; rows of NaN mean "no embedding"
+        self.topics = topics or []
+        self.topic_embeddings = topic_embeddings
+        self.news = news or []
+        self.latency = latency_ms / 1000.0
+        self.max_page_size = max_page_size
+        self.max_topic_page_size = max_topic_page_size
+        self.requests = 0
+        self._pair_row = {p["id"]: i for i, p in enumerate(self.pairs)}
+        self._topic_row = {t["id"]: i for i, t in enumerate(self.topics)}
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = request.url.path[len(API_PREFIX):] if request.url.path.startswith(API_PREFIX) else request.url.path
+        params = request.url.params
+        body = json.loads(request.content) if request.content else {}
+        if path == "/contrast-pairs/" and request.method == "GET":
+            # Newest first, like the backend's creation-date ordering
+            order = range(len(self.pairs) - 1, -1, -1)
+            with_emb = params.get("vector_embedding", "false").lower() == "true"
+            return self._page(request, order, self.pairs, self.pair_embeddings, with_emb, self.max_page_size)
+        if path == "/contrast-pairs/update/" and request.method == "PATCH":
+            return self._update(body, self._pair_row, self.pairs, "pair_embeddings")
+        if path == "/contrast-pairs/" and request.method == "POST":
+            created = []
+            for pair in body.get("pairs", []):
+                item = {"id": len(self.pairs) + 1, "item1": pair["item1"], "item2": pair["item2"]}
+                self._pair_row[item["id"]] = len(self.pairs)
+                self.pairs.append(item)
+                created.append({**item, "tags": [], "ratings": [], "vector_embedding": None})
+            if self.pair_embeddings is not None and created:
+                padding = np.full((len(created), self.pair_embeddings.shape[1]), np.nan, dtype=np.float32)
+                self.pair_embeddings = np.concatenate([self.pair_embeddings, padding])
+            return httpx.Response(201, json=created)
+        if path == "/topics/" and request.method == "GET":
+            order = sorted(range(len(self.topics)), key=lambda i: self.topics[i]["name"])  # Ordered by name
+            with_emb = params.get("vector_embedding", "true").lower() != "false"
+            return self._page(request, order, self.topics, self.topic_embeddings, with_emb, self.max_topic_page_size)
+        if path == "/topics/" and request.method == "PATCH":
+            return self._update(body, self._topic_row, self.topics, "topic_embeddings")
+        if path == "/news/" and request.method == "GET":
+            return httpx.Response(200, json=self._news(params))
+        if path == "/news/" and request.method == "POST":
+            created = [{"id": len(self.news) + i + 1, **item} for i, item in enumerate(body.get("news_items", []))]
+            self.news.extend(created)
+            return httpx.Response(201, json=created)
+        return httpx.Response(404, json={"error": f"No fake for {request.method} {path}"})
+
+    def _page(self, request, order, items, embeddings, with_emb, max_page_size):
+        page = int(request.url.params.get("page", 1))
+        count = min(int(request.url.params.get("count", 10)), max_page_size)
+        rows = list(order[(page - 1) * count:page * count])
+        results = []
+        for row in rows:
+            item = dict(items[row])
+            if with_emb:
+                has_emb = embeddings is not None and not np.isnan(embeddings[row, 0])
+                item["vector_embedding"] = encode_embedding(embeddings[row]) if has_emb else None
+            results.append(item)
+        total = len(items)
+        link = lambda p: f"{request.url.path}?{urlencode({'page': p, 'count': count})}"
+        return httpx.Response(200, json={
+            "total": total, "page": page, "count": len(results),
+            "next": link(page + 1) if page * count < total else None,
+            "previous": link(page - 1) if page > 1 else None,
+            "results": results,
+        })
+
+    def _update(self, body, row_of, items, embeddings_attr):
+        updated = []
+        for update in body.get("updates", []):
+            if update["id"] not in row_of:
+                return httpx.Response(400, json={"error": f"Unknown id {update['id']}"})
+            row = row_of[update["id"]]
+            for field, value in update.items():
+                if field == "vector_embedding" and value:
+                    vector = np.frombuffer(b64decode(value), dtype=np.float32)
+                    getattr(self, embeddings_attr)[row] = vector
+                elif field not in ("id", "vector_embedding"):
+                    items[row][field] = value
+            updated.append(update["id"])
+        return httpx.Response(200, json={"status": "batch update successful", "updated_count": len(updated), "updated_ids": updated})
+
+    def _news(self, params):
+        start, end = params.get("start_time"), params.get("end_time")
+        news_type = params.get("news_type")
+        def parse(value):
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)  # Naive = UTC, as on the backend
+        results = []
+        for item in self.news:
+            if news_type and item["news_source"] != news_type:
+                continue
+            if start and end and (parse(item["end_date"]) < parse(start) or parse(item["start_date"]) > parse(end)):
+                continue
+            results.append(item)
+        return sorted(results, key=lambda item: item["start_date"], reverse=True)
+
+
+def make_backend(n_pairs, dim, n_topics=0, n_news=0, embedded_fraction=1.0, latency_ms=0.0,
+                 max_page_size=2000, seed=0):
+    """A FakeBackend with synthetic pairs/topics/news; `embedded_fraction` of the items carry embeddings."""
+    start_time = time.time()
+    pair_embeddings = make_embeddings(n_pairs, dim, seed=seed)
+    topic_embeddings = make_embeddings(n_topics, dim, seed=seed + 1)
+    rng = np.random.default_rng(seed)
+    for matrix in (pair_embeddings, topic_embeddings):
+        if embedded_fraction < 1.0 and len(matrix):
+            matrix[rng.random(len(matrix)) >= embedded_fraction] = np.nan
+    backend = FakeBackend(make_pairs(n_pairs, seed), pair_embeddings, make_topics(n_topics, seed), topic_embeddings,
+                          make_news(n_news, seed=seed), latency_ms=latency_ms, max_page_size=max_page_size)
+    backend.build_seconds = time.time() - start_time
+    return backend
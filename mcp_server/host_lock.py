@@ -0,0 +1,63 @@
+import time
+from contextlib import contextmanager
+from config import logger
+
+# Host-local advisory file locks, shared by every server/CLI process using the same cache files.
+# fcntl.flock on Unix, msvcrt.locking on Windows. Locks are released by the OS when the holder exits,
+# so a crashed cache owner never blocks the others. Without either module every process acts alone.
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def _acquire(handle, blocking):
+    if fcntl is not None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    elif msvcrt is not None:
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if not blocking:
+                    raise
+                time.sleep(0.05)
+
+
+def _release(handle):
+    if fcntl is not None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def try_lock(path):
+    """Takes an exclusive lock without waiting. Returns the open handle (keep it to hold the lock) or None."""
+    handle = open(path, "a+b")
+    try:
+        _acquire(handle, blocking=False)
+    except OSError:
+        handle.close()
+        return None
+    if fcntl is None and msvcrt is None:
+        logger.warning(f"try_lock: No file locking on this platform, {path} is not exclusive.")
+    return handle
+
+
+@contextmanager
+def locked(path):
+    """Holds an exclusive lock on `path` for the block, waiting for other processes."""
+    with open(path, "a+b") as handle:
+        _acquire(handle, blocking=True)
+        try:
+            yield
+        finally:
+            _release(handle)
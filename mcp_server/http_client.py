@@ -0,0 +1,109 @@
+import asyncio
+from contextlib import asynccontextmanager
+import httpx
+from config import (
+    logger,
+    BASE_URL,
+    HEADERS,
+    HTTP_TIMEOUT_SECONDS,
+    HTTP_ENDPOINT_TIMEOUTS,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    HTTP_MAX_CONCURRENT_REQUESTS,
+    HTTP2_ENABLED,
+)
+from metrics import timer, inc
+from tracing import span
+
+# One long-lived, pooled httpx.AsyncClient shared by all MCP tools and the cache fetchers.
+# Keep-alive connections are reused across tool calls, and a semaphore bounds how many backend
+# requests are in flight at once. Use `api_request` instead of module-level httpx.get/post/patch.
+
+try:
+    import h2  # noqa: F401  Optional dependency, needed for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_CLIENT = None
+_SEMAPHORE = None
+_LOOP = None
+_TRANSPORT = None  # Optional httpx transport override, e.g. the local fake backend in fake_backend.py
+
+
+def endpoint_timeout(path):
+    """Per-endpoint timeout: first matching path prefix in HTTP_ENDPOINT_TIMEOUTS, else the default."""
+    for prefix, timeout in HTTP_ENDPOINT_TIMEOUTS.items():
+        if path.startswith(prefix):
+            return timeout
+    return HTTP_TIMEOUT_SECONDS
+
+
+def get_client():
+    """Returns the shared client, creating it on first use in the running event loop."""
+    global _CLIENT, _SEMAPHORE, _LOOP
+    loop = asyncio.get_running_loop()
+    if _CLIENT is None or _CLIENT.is_closed or _LOOP is not loop:
+        # Connections are bound to the loop that opened them (e.g. a startup loop before mcp.run())
+        if HTTP2_ENABLED and not HTTP2_AVAILABLE:
+            logger.warning("get_client: HTTP/2 requested but the 'h2' package is not installed. Using HTTP/1.1.")
+        _CLIENT = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            http2=HTTP2_ENABLED and HTTP2_AVAILABLE,
+            **({"transport": _TRANSPORT} if _TRANSPORT is not None else {}),
+        )
+        _SEMAPHORE = asyncio.Semaphore(HTTP_MAX_CONCURRENT_REQUESTS)
+        _LOOP = loop
+        logger.info(f"get_client: Created shared HTTP client (max {HTTP_MAX_CONNECTIONS} connections, "
+                    f"{HTTP_MAX_CONCURRENT_REQUESTS} concurrent requests, http2={HTTP2_ENABLED and HTTP2_AVAILABLE}).")
+    return _CLIENT
+
+
+def set_transport(transport):
+    """Routes the shared client through `transport` (None restores the network). Takes effect on the next client."""
+    global _TRANSPORT, _CLIENT
+    _TRANSPORT = transport
+    _CLIENT = None
+
+
+async def close_client():
+    global _CLIENT
+    if _CLIENT is not None and not _CLIENT.is_closed:
+        await _CLIENT.aclose()
+        logger.info("close_client: Shared HTTP client closed.")
+    _CLIENT = None
+
+
+async def api_request(method, path, **kwargs):
+    """Sends a request to BASE_URL + path through the shared client, bounded by the concurrency limit."""
+    client = get_client()
+    kwargs.setdefault("timeout", endpoint_timeout(path))
+    endpoint = "/" + path.strip("/").split("/", 1)[0] + "/"  # Bounded label set: /contrast-pairs/, /topics/, /news/
+    async with _SEMAPHORE:
+        with span(f"http {method} {endpoint}"), timer("http_request_seconds", method=method, endpoint=endpoint) as t:
+            try:
+                resp = await client.request(method, f"{BASE_URL}{path}", **kwargs)
+            except httpx.HTTPError as e:
+                inc("backend_errors_total", endpoint=endpoint, kind=type(e).__name__)
+                raise
+        if resp.status_code >= 500:
+            inc("backend_errors_total", endpoint=endpoint, kind=str(resp.status_code))
+        logger.debug(f"api_request: {method} {path} -> {resp.status_code} in {t.elapsed:.2f}s.")
+        return resp
+
+
+@asynccontextmanager
+async def http_lifespan(server):
+    """FastMCP lifespan: opens the shared client at server start and closes it on shutdown."""
+    get_client()
+    try:
+        yield {}
+    finally:
+        await close_client()
@@ -0,0 +1,125 @@
+import numpy as np
+
+# Columnar item metadata for cached collections, row-aligned with the embedding matrix.
+# - ids: int64 array
+# - per text field: one packed UTF-8 buffer plus int64 offsets (row i is buf[offsets[i]:offsets[i + 1]])
+#   and a null mask, only kept when the field has None values
+# - id -> row dict, built on first lookup, so get(item_id) is O(1) instead of a linear scan
+# Rows read back as small {"id", *fields} dicts, so code indexing or iterating cache["data"] keeps working;
+# nothing is stored per item as a Python object. Persisted as arrays in the cache's .meta.npz sidecar.
+
+
+def _pack(values):
+    encoded = [b"" if v is None else str(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    nulls = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+    return b"".join(encoded), offsets, (nulls if nulls.any() else None)
+
+
+class ItemStore:
+    def __init__(self, ids, columns, fields):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.fields = tuple(fields)
+        self._columns = columns  # field -> (buffer bytes, offsets, null mask or None)
+        self._row_of = None
+
+    @classmethod
+    def from_columns(cls, ids, values, fields):
+        """`values` maps each field to a list of str/None, row-aligned with `ids`."""
+        return cls(ids, {field: _pack(values[field]) for field in fields}, fields)
+
+    @classmethod
+    def from_items(cls, items, fields):
+        items = list(items)
+        return cls.from_columns([item["id"] for item in items], {field: [item.get(field) for item in items] for field in fields}, fields)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(f"row {row} out of range for {len(self)} items")
+        return {"id": int(self.ids[row]), **{field: self.value(field, row) for field in self.fields}}
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def value(self, field, row):
+        buf, offsets, nulls = self._columns[field]
+        if nulls is not None and nulls[row]:
+            return None
+        return buf[offsets[row]:offsets[row + 1]].decode("utf-8")
+
+    def row_of(self, item_id):
+        """Row of an item id, or None."""
+        if self._row_of is None:
+            self._row_of = dict(zip(self.ids.tolist(), range(len(self))))
+        return self._row_of.get(item_id)
+
+    def get(self, item_id):
+        row = self.row_of(item_id)
+        return None if row is None else self[row]
+
+    def with_rows(self, items):
+        """Returns (new store, row of each item): known ids replace their row, new ids are appended.
+        The common delta (new items, or existing items with unchanged text) appends to the buffers without re-packing."""
+        n = len(self)
+        self.row_of(None)  # Builds the id -> row dict
+        new_rows, appended, replaced = {}, [], {}
+        rows = np.empty(len(items), dtype=np.int64)
+        for i, item in enumerate(items):
+            row = self._row_of.get(item["id"], new_rows.get(item["id"]))
+            if row is None:
+                row = new_rows[item["id"]] = n + len(appended)
+                appended.append(item)
+            elif row >= n:
+                appended[row - n] = item
+            elif any(item.get(field) != self.value(field, row) for field in self.fields):
+                replaced[row] = item
+            rows[i] = row
+        if replaced:
+            store = ItemStore.from_items([replaced.get(r) or self[r] for r in range(n)] + appended, self.fields)
+        else:
+            store = ItemStore(np.concatenate([self.ids, np.array([item["id"] for item in appended], dtype=np.int64)]),
+                              {field: self._extend_column(field, [item.get(field) for item in appended]) for field in self.fields},
+                              self.fields)
+        store._row_of = {**self._row_of, **new_rows}
+        return store, rows
+
+    def _extend_column(self, field, values):
+        buf, offsets, nulls = self._columns[field]
+        if not values:
+            return buf, offsets, nulls
+        new_buf, new_offsets, new_nulls = _pack(values)
+        if nulls is not None or new_nulls is not None:
+            nulls = np.concatenate([nulls if nulls is not None else np.zeros(len(self), dtype=bool),
+                                    new_nulls if new_nulls is not None else np.zeros(len(values), dtype=bool)])
+        return buf + new_buf, np.concatenate([offsets, new_offsets[1:] + offsets[-1]]), nulls
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns (the lazily built id -> row dict is not counted)."""
+        return self.ids.nbytes + sum(len(buf) + offsets.nbytes + (nulls.nbytes if nulls is not None else 0)
+                                     for buf, offsets, nulls in self._columns.values())
+
+    def to_arrays(self):
+        """Plain arrays for np.savez (loadable with allow_pickle=False)."""
+        arrays = {"ids": self.ids}
+        for field, (buf, offsets, nulls) in self._columns.items():
+            arrays[f"{field}__buf"] = np.frombuffer(buf, dtype=np.uint8)
+            arrays[f"{field}__offsets"] = offsets
+            if nulls is not None:
+                arrays[f"{field}__nulls"] = nulls
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, fields):
+        columns = {field: (arrays[f"{field}__buf"].tobytes(), arrays[f"{field}__offsets"],
+                           arrays[f"{field}__nulls"] if f"{field}__nulls" in arrays else None) for field in fields}
+        return cls(arrays["ids"], columns, fields)
@@ -0,0 +1,128 @@
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+import numpy as np
+from config import logger, LEXICAL_NGRAM, LEXICAL_BM25_K1, LEXICAL_BM25_B, LEXICAL_PREFILTER_MIN_SCORE, LEXICAL_PREFILTER_MAX_ROWS, LEXICAL_RRF_K
+from vector_index import top_k
+from cache_format import atomic_write
+
+# BM25 over character n-grams of the collection's text fields, built next to the vector index.
+# Words are lower-cased and padded ("#kot#" -> "#ko", "kot", "ot#"), so shared Polish stems and small
+# typos still match without a stemmer. Postings are CSR arrays with the BM25 term weight precomputed
+# per posting; a query is a handful of slices and one bincount, no model call.
+# Scores are divided by the query's score against itself, so an exact match scores about 1.0.
+# Search modes (see rag.search_collection):
+# - dense: embeddings only (default)
+# - lexical: this index only, sub-millisecond, for exact / near-exact checks
+# - hybrid: dense and lexical rankings merged with reciprocal rank fusion
+# - prefilter: dense scoring restricted to lexical candidates when the query is selective
+
+SEARCH_MODES = ("dense", "lexical", "hybrid", "prefilter")
+_WORD_RE = re.compile(r"\w+")
+
+
+def ngrams(text, n=LEXICAL_NGRAM):
+    grams = []
+    for word in _WORD_RE.findall(unicodedata.normalize("NFC", text).lower()):
+        padded = f"#{word}#"
+        grams.extend([padded] if len(padded) <= n else [padded[i:i + n] for i in range(len(padded) - n + 1)])
+    return grams
+
+
+class LexicalIndex:
+    def __init__(self, vocab, indptr, postings, weights, n_docs, avgdl, k1=LEXICAL_BM25_K1, b=LEXICAL_BM25_B):
+        self.vocab = vocab  # n-gram -> term id
+        self.indptr = indptr  # Term t's postings are [indptr[t], indptr[t + 1])
+        self.postings = postings  # Row ids (int32)
+        self.weights = weights  # tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)), float32
+        self.n_docs = n_docs
+        self.avgdl = avgdl
+        self.k1, self.b = k1, b
+        df = np.diff(indptr)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts, k1=LEXICAL_BM25_K1, b=LEXICAL_BM25_B):
+        start_time = time.time()
+        vocab, terms, rows, tfs = {}, [], [], []
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(ngrams(text))
+            doc_len[row] = sum(counts.values())
+            terms.extend(vocab.setdefault(gram, len(vocab)) for gram in counts)
+            tfs.extend(counts.values())
+            rows.extend([row] * len(counts))
+        terms = np.asarray(terms, dtype=np.int32)
+        order = np.argsort(terms, kind="stable")  # Postings of a term stay in row order
+        rows = np.asarray(rows, dtype=np.int32)[order]
+        tf = np.asarray(tfs, dtype=np.float32)[order]
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=indptr[1:])
+        avgdl = float(doc_len.mean()) if len(texts) and doc_len.any() else 1.0
+        weights = (tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len[rows] / avgdl))).astype(np.float32)
+        index = cls(vocab, indptr, rows, weights, len(texts), avgdl, k1, b)
+        logger.info(f"LexicalIndex: Built over {len(texts)} docs ({len(vocab)} {LEXICAL_NGRAM}-grams, {len(rows)} postings) in {time.time() - start_time:.2f}s.")
+        return index
+
+    def __len__(self):
+        return self.n_docs
+
+    def scores(self, text):
+        """Normalised BM25 score of every row for `text` (float32, 0 where nothing matches)."""
+        counts = Counter(ngrams(text))
+        known = [(self.vocab[gram], qtf) for gram, qtf in counts.items() if gram in self.vocab]
+        if not known:
+            return np.zeros(self.n_docs, dtype=np.float32)
+        rows = np.concatenate([self.postings[self.indptr[t]:self.indptr[t + 1]] for t, _ in known])
+        weights = np.concatenate([self.weights[self.indptr[t]:self.indptr[t + 1]] * (self.idf[t] * qtf) for t, qtf in known])
+        scores = np.bincount(rows, weights=weights, minlength=self.n_docs).astype(np.float32)
+        # The query scored as a document of its own length: all its n-grams match with their own tf
+        query_len = sum(counts.values())
+        norm = self.k1 * (1 - self.b + self.b * query_len / self.avgdl)
+        self_score = sum(float(self.idf[self.vocab[g]]) * qtf * qtf * (self.k1 + 1) / (qtf + norm) for g, qtf in counts.items() if g in self.vocab)
+        return scores / self_score if self_score > 0 else scores
+
+    def top(self, scores, k):
+        """(scores, rows) of the k best rows with a non-zero score, best first."""
+        rows = top_k(scores, k)
+        rows = rows[scores[rows] > 0]
+        return scores[rows], rows
+
+    def prefilter_rows(self, scores, min_score=LEXICAL_PREFILTER_MIN_SCORE, max_rows=LEXICAL_PREFILTER_MAX_ROWS):
+        """Rows worth dense-scoring when the query is selective (few rows above min_score), else None."""
+        rows = np.flatnonzero(scores >= min_score)
+        return rows if 0 < len(rows) <= max_rows else None
+
+    def save(self, path, stamp):
+        grams = sorted(self.vocab, key=self.vocab.get)
+        vocab = np.frombuffer("\x00".join(grams).encode("utf-8"), dtype=np.uint8)
+        atomic_write(path, lambda f: np.savez(f, vocab=vocab, indptr=self.indptr, postings=self.postings, weights=self.weights,
+                                              n_docs=self.n_docs, avgdl=self.avgdl, k1=self.k1, b=self.b, stamp=stamp))
+
+    @classmethod
+    def load(cls, path, stamp, n_docs):
+        """Index saved for the same cache `stamp` and row count, else None."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if float(data["stamp"]) != stamp or int(data["n_docs"]) != n_docs:
+                    return None
+                grams = data["vocab"].tobytes().decode("utf-8").split("\x00") if len(data["vocab"]) else []
+                return cls({gram: i for i, gram in enumerate(grams)}, data["indptr"], data["postings"], data["weights"],
+                           n_docs, float(data["avgdl"]), float(data["k1"]), float(data["b"]))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"LexicalIndex: Could not load {path}: {e}")
+            return None
+
+
+def rrf_fuse(rankings, k, rrf_k=LEXICAL_RRF_K):
+    """Reciprocal rank fusion of row rankings (best first). Returns (rows, fused scores), best first."""
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking.tolist()):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (rrf_k + rank + 1)
+    best = sorted(fused.items(), key=lambda item: -item[1])[:k]
+    return np.array([row for row, _ in best], dtype=np.int64), np.array([score for _, score in best], dtype=np.float32)
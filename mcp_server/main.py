@@ -1,7 +1,7 @@
 from mcp.server.fastmcp import FastMCP
-import httpx
-from typing import List, Optional
-from config import HEADERS, BASE_URL, logger  # <-- import from config
+from typing import List, Optional, Union
+from config import logger, DEDUP_THRESHOLD, METRICS_PORT, METRICS_HOST, STARTUP_MODE, NEWS_STORE_ENABLED, CACHE_REFRESH_INTERVAL_SECONDS  # <-- import from config
+from http_client import api_request, http_lifespan, close_client
 from datetime import datetime
 from schemas import (
     TopicInsert,
@@ -12,22 +12,59 @@ from schemas import (
     ISO_DATETIME_REGEX,
     PairStringInput,
 )
-from rag import get_similar_pairs
-from utils_cache import init_cache
+from rag import get_similar_pairs, get_similar_topics, get_similar_pairs_batch, similar_by_id, explore_by_id
 import asyncio
-from rag import fetch_all_pairs_async
+from rag import init_collections, init_collection, refresh_loop, generate_embeddings_for_contrasting, generate_embeddings_for_topics
+from dedup import filter_duplicate_pairs, duplicate_groups
+from bulk_writer import bulk_write, tool_result
+from news_backfill import get_news_local, get_store_async as get_news_store, run_news_backfill
+from utils_cache import COLLECTIONS, load_local_cache_async
+from metrics import timed_tool, snapshot, start_metrics_server
+from readiness import set_state, report as readiness_report, PENDING
+from tracing import configure as configure_tracing, run_traced
+from contextlib import asynccontextmanager
+import json
 import time
 from mcp.server.fastmcp import Context
 
+
+async def warm_up():
+    """Loads the model and every collection's cache; failures are logged and show up in readiness."""
+    start_time = time.time()
+    try:
+        await init_collections()
+        logger.info(f"warm_up: Finished in {time.time() - start_time:.2f}s.")
+    except Exception as e:
+        logger.exception(f"warm_up: Failed after {time.time() - start_time:.2f}s: {e}")
+
+
+@asynccontextmanager
+async def server_lifespan(server):
+    """Opens the shared HTTP client and, in background startup mode, starts the warm-up without waiting for it.
+    Loaded caches are refreshed in the background every CACHE_REFRESH_INTERVAL_SECONDS."""
+    async with http_lifespan(server) as state:
+        tasks = [asyncio.create_task(warm_up())] if STARTUP_MODE == "background" else []
+        if CACHE_REFRESH_INTERVAL_SECONDS > 0:
+            tasks.append(asyncio.create_task(refresh_loop(CACHE_REFRESH_INTERVAL_SECONDS)))
+        try:
+            yield state
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
 # Create the MCP server instance
 
-mcp = FastMCP("Cypher Arena MCP Server", log_level="INFO")
+# The lifespan opens the shared pooled HTTP client at server start and closes it on shutdown
+mcp = FastMCP("Cypher Arena MCP Server", log_level="INFO", lifespan=server_lifespan)
 
 # ----------- Contrast Pairs Endpoints -----------
 
 
 @mcp.tool()
-def get_contrast_pairs(
+@timed_tool
+async def get_contrast_pairs(
     page: Optional[int] = 1,
     count: Optional[int] = 10,
     random: Optional[bool] = False,
@@ -39,68 +76,91 @@ def get_contrast_pairs(
         params["random"] = True
     if vector_embedding:
         params["vector_embedding"] = True
-    resp = httpx.get(f"{BASE_URL}/contrast-pairs/", params=params, headers=HEADERS)
+    resp = await api_request("GET", "/contrast-pairs/", params=params)
     resp.raise_for_status()
     return resp.json()
 
 
 @mcp.tool()
-def batch_create_contrast_pairs(pairs: List[dict]) -> list:
-    """Create multiple contrast pairs in a single request."""
-    data = {"pairs": pairs}
-    resp = httpx.post(f"{BASE_URL}/contrast-pairs/", json=data, headers=HEADERS)
-    resp.raise_for_status()
-    return resp.json()
+@timed_tool
+async def batch_create_contrast_pairs(
+    pairs: List[dict],
+    skip_duplicates: Optional[bool] = False,
+    duplicate_threshold: Optional[float] = DEDUP_THRESHOLD,
+) -> Union[list, dict]:
+    """Create multiple contrast pairs, any number per call (sent in parallel chunks). With skip_duplicates, pairs that repeat/reverse an existing pair or are near-duplicates (cosine >= duplicate_threshold) of existing or earlier pairs in the batch are rejected before the POST; the result is then {"created": [...], "rejected": [...]}, with "corpus_checked": false if the existing pairs could not be loaded. Pairs the backend refuses are returned as {"created": [...], "failed": [{index, item, status, error}]}."""
+    rejected = None
+    if skip_duplicates:
+        pairs, rejected, corpus_checked = await filter_duplicate_pairs(pairs, duplicate_threshold)
+        unchecked = {} if corpus_checked else {"corpus_checked": False}
+        if not pairs:
+            return {"created": [], "rejected": rejected, **unchecked}
+    created, failed = await bulk_write("POST", "/contrast-pairs/", "pairs", pairs, idempotent=False)
+    if rejected is not None:
+        return {"created": created, "rejected": rejected, **({"failed": failed} if failed else {}), **unchecked}
+    return tool_result(created, failed)
 
 
 @mcp.tool()
-def batch_rate_contrast_pairs(ratings: List[ContrastPairRating]) -> dict:
-    """Rate multiple contrast pairs in a single request."""
-    data = {"ratings": [r.model_dump() for r in ratings]}
-    resp = httpx.post(f"{BASE_URL}/contrast-pairs/rate/", json=data, headers=HEADERS)
-    resp.raise_for_status()
-    return resp.json()
+@timed_tool
+async def batch_rate_contrast_pairs(ratings: List[ContrastPairRating]) -> dict:
+    """Rate multiple contrast pairs, any number per call (sent in parallel chunks). Ratings the backend refuses are listed under "failed"; a refused chunk the backend partly applied is listed whole and not resent."""
+    merged, failed = await bulk_write("POST", "/contrast-pairs/rate/", "ratings", [r.model_dump() for r in ratings], idempotent=False)
+    return tool_result(merged, failed)
 
 
 @mcp.tool()
-def batch_update_contrast_pairs(updates: List[ContrastPairUpdate]) -> dict:
-    """Update multiple existing contrast pairs in a single request."""
+@timed_tool
+async def batch_update_contrast_pairs(updates: List[ContrastPairUpdate]) -> dict:
+    """Update multiple existing contrast pairs, any number per call (sent in parallel chunks). Updates the backend refuses (e.g. unknown ids) are listed under "failed", the rest are applied."""
     # Convert Pydantic models to dicts, excluding None values
     update_data = [u.model_dump(exclude_unset=True) for u in updates]
-    data = {"updates": update_data}
-    resp = httpx.patch(f"{BASE_URL}/contrast-pairs/update/", json=data, headers=HEADERS)
-    resp.raise_for_status()
-    return resp.json()
+    merged, failed = await bulk_write("PATCH", "/contrast-pairs/update/", "updates", update_data)
+    return tool_result(merged, failed)
 
 
 # ----------- News Endpoints -----------
 
 
 @mcp.tool()
-def get_news(start_time: str, end_time: str, news_type: Optional[str] = None) -> list:
-    """Retrieve news records filtered by a required date range and optional news type."""
+@timed_tool
+async def get_news(start_time: str, end_time: str, news_type: Optional[str] = None) -> list:
+    """Retrieve news records filtered by a required date range and optional news type. Ranges fetched before are served from the local news store; only missing days go to the backend."""
+    if NEWS_STORE_ENABLED:
+        return await get_news_local(start_time, end_time, news_type)
     params = {"start_time": start_time, "end_time": end_time}
     if news_type:
         params["news_type"] = news_type
-    resp = httpx.get(f"{BASE_URL}/news/", params=params, headers=HEADERS)
+    resp = await api_request("GET", "/news/", params=params)
     resp.raise_for_status()
     return resp.json()
 
 
 @mcp.tool()
-def batch_create_news(news_items: List[NewsItem]) -> list:
-    """Create multiple news records in a single request."""
-    data = {"news_items": [item.model_dump(exclude_unset=True) for item in news_items]}
-    resp = httpx.post(f"{BASE_URL}/news/", json=data, headers=HEADERS)
-    resp.raise_for_status()
-    return resp.json()
+@timed_tool
+async def batch_create_news(news_items: List[NewsItem]) -> Union[list, dict]:
+    """Create multiple news records, any number per call (sent in parallel chunks). Records the backend refuses are returned as {"created": [...], "failed": [...]}."""
+    items = [item.model_dump(exclude_unset=True) for item in news_items]
+    created, failed = await bulk_write("POST", "/news/", "news_items", items, idempotent=False)
+    if NEWS_STORE_ENABLED and created:
+        store = await get_news_store()
+        await run_traced(store.add, created)
+    return tool_result(created, failed)
+
+
+@mcp.tool()
+@timed_tool
+async def backfill_news(news_type: Optional[str] = None, include_pending: Optional[bool] = False) -> dict:
+    """Fetch every window of the news schedule (documents/news_dates.csv) that is not in the local news store yet, concurrently and rate-limited. Resumable; returns run stats."""
+    return await run_news_backfill(news_type=news_type, include_pending=include_pending)
 
 
 # ----------- Topics Endpoints -----------
 
 
 @mcp.tool()
-def get_topics(
+@timed_tool
+async def get_topics(
     page: Optional[int] = 1,
     count: Optional[int] = 10,
     source: Optional[str] = None,
@@ -115,44 +175,46 @@ def get_topics(
         params["random"] = True
     if not vector_embedding:  # Only add if False, as True is the default in the API
         params["vector_embedding"] = False
-    resp = httpx.get(f"{BASE_URL}/topics/", params=params, headers=HEADERS)
+    resp = await api_request("GET", "/topics/", params=params)
     resp.raise_for_status()
     return resp.json()
 
 
 @mcp.tool()
-def batch_insert_topics(topics: List[TopicInsert]) -> list:
-    """Insert multiple topics in a single request. Each topic must have a 'name' and can optionally have a 'source' (default: 'agent'). Uses get_or_create logic."""
+@timed_tool
+async def batch_insert_topics(topics: List[TopicInsert]) -> Union[list, dict]:
+    """Insert multiple topics, any number per call (sent in parallel chunks). Each topic must have a 'name' and can optionally have a 'source' (default: 'agent'). Uses get_or_create logic. Topics the backend refuses are returned as {"created": [...], "failed": [...]}."""
     # Pydantic models need explicit conversion to dict for JSON serialization
-    data = {"topics": [t.model_dump(exclude_unset=True) for t in topics]}
-    resp = httpx.post(f"{BASE_URL}/topics/", json=data, headers=HEADERS)
-    resp.raise_for_status()
-    return resp.json()
+    items = [t.model_dump(exclude_unset=True) for t in topics]
+    created, failed = await bulk_write("POST", "/topics/", "topics", items)  # get_or_create: safe to retry
+    return tool_result(created, failed)
 
 
 @mcp.tool()
-def batch_update_topics(updates: List[TopicUpdate]) -> dict:
-    """Update multiple existing topics in a single request."""
+@timed_tool
+async def batch_update_topics(updates: List[TopicUpdate]) -> dict:
+    """Update multiple existing topics, any number per call (sent in parallel chunks). Updates the backend refuses are listed under "failed", the rest are applied."""
     # Convert Pydantic models to dicts, excluding None values
     update_data = [u.model_dump(exclude_unset=True) for u in updates]
-    data = {"updates": update_data}
-    resp = httpx.patch(f"{BASE_URL}/topics/", json=data, headers=HEADERS)
-    resp.raise_for_status()
-    return resp.json()
+    merged, failed = await bulk_write("PATCH", "/topics/", "updates", update_data)
+    return tool_result(merged, failed)
 
 
 @mcp.tool()
-async def get_similar_pairs_tool(pair: PairStringInput, k: int = 10, ctx: Context = None) -> list:
-    '''this tool gets k most similar contrasing pairs in format Item1 vs Item2'''
+@timed_tool
+async def get_similar_pairs_tool(pair: PairStringInput, k: int = 10, mode: str = "dense", ctx: Context = None) -> list:
+    '''this tool gets k most similar contrasing pairs in format Item1 vs Item2.
+    mode: "dense" (embeddings, default), "lexical" (character n-gram BM25, fast exact / near-exact check, no model),
+    "hybrid" (dense and lexical rankings fused) or "prefilter" (dense scoring of lexical candidates only)'''
     # Check if context was provided (it should be by FastMCP)
     if ctx is None:
         logger.warning("Context object (ctx) not provided to get_similar_pairs_tool. Progress reporting disabled.")
         # Fallback or raise error? For now, just log and proceed without progress.
 
-    logger.info(f"Entering get_similar_pairs_tool with pair='{pair.pair_string}', k={k}")
+    logger.info(f"Entering get_similar_pairs_tool with pair='{pair.pair_string}', k={k}, mode={mode}")
     start_time = time.time()
     try:
-        result = await get_similar_pairs(pair, k, ctx)  # Await the async function directly
+        result = await get_similar_pairs(pair, k, ctx, mode)  # Await the async function directly
         end_time = time.time()
         logger.info(f"Exiting get_similar_pairs_tool. Duration: {end_time - start_time:.2f}s. Found {len(result) if result else 0} pairs.")
         return result
@@ -164,16 +226,120 @@ async def get_similar_pairs_tool(pair: PairStringInput, k: int = 10, ctx: Contex
         raise # Re-raise the exception to be handled by FastMCP
 
 
+@mcp.tool()
+@timed_tool
+async def get_similar_pairs_batch_tool(pairs: List[PairStringInput], k: int = 10) -> list:
+    '''this tool gets k most similar contrasing pairs for each of many "Item1 vs Item2" strings in one call (e.g. to check candidates before batch_create_contrast_pairs)'''
+    logger.info(f"Entering get_similar_pairs_batch_tool with {len(pairs)} pairs, k={k}")
+    start_time = time.time()
+    try:
+        result = await get_similar_pairs_batch(pairs, k)
+        logger.info(f"Exiting get_similar_pairs_batch_tool. Duration: {time.time() - start_time:.2f}s.")
+        return result
+    except Exception as e:
+        logger.exception(f"Error during get_similar_pairs_batch execution in get_similar_pairs_batch_tool: {e}")
+        raise
+
+
+@mcp.tool()
+@timed_tool
+async def get_similar_pairs_by_id(pair_id: int, k: int = 10) -> list:
+    '''this tool gets k most similar contrasing pairs to an existing pair given by its id (e.g. from get_contrast_pairs), from precomputed neighbours without encoding any text'''
+    return await similar_by_id("pairs", pair_id, k)
+
+
+@mcp.tool()
+@timed_tool
+async def explore_similar_pairs(pair_id: int, n: int = 10, walk_length: int = 3, seed: Optional[int] = None) -> list:
+    '''this tool suggests n related but diverse contrasing pairs around an existing pair id by random walks over the precomputed neighbour graph (each with similarity to the start pair and hops away); pass a seed for repeatable results'''
+    return await explore_by_id("pairs", pair_id, n, walk_length, seed)
+
+
+@mcp.tool()
+@timed_tool
+async def find_duplicate_pairs_tool(threshold: float = DEDUP_THRESHOLD, max_groups: int = 50) -> list:
+    '''this tool finds groups of near-duplicate contrasting pairs across the whole cached corpus (largest groups first)'''
+    logger.info(f"Entering find_duplicate_pairs_tool with threshold={threshold}, max_groups={max_groups}")
+    start_time = time.time()
+    if not await load_local_cache_async("pairs"):
+        await init_collection("pairs")
+    # CPU-bound blocked matrix products, keep the event loop free
+    groups = await asyncio.get_running_loop().run_in_executor(None, lambda: duplicate_groups("pairs", threshold))
+    logger.info(f"Exiting find_duplicate_pairs_tool. Duration: {time.time() - start_time:.2f}s. Found {len(groups)} groups.")
+    return groups[:max_groups]
+
+
+@mcp.tool()
+@timed_tool
+async def generate_embeddings(collection: str = "pairs") -> dict:
+    '''this tool embeds and uploads every item of a collection ("pairs" or "topics") that has no embedding yet; an interrupted run resumes from its checkpoint. Returns how many items were uploaded'''
+    backfills = {"pairs": generate_embeddings_for_contrasting, "topics": generate_embeddings_for_topics}
+    if collection not in backfills:
+        raise ValueError(f"Unknown collection {collection!r}, expected one of {sorted(backfills)}")
+    return {"collection": collection, "uploaded": await backfills[collection]()}
+
+
+@mcp.tool()
+@timed_tool
+async def get_similar_topics_tool(topic: str, k: int = 10, mode: str = "dense", ctx: Context = None) -> list:
+    '''this tool gets k most similar topics to the given topic name, searched server-side instead of listing all topics.
+    mode: "dense" (default), "lexical", "hybrid" or "prefilter", as in get_similar_pairs_tool'''
+    logger.info(f"Entering get_similar_topics_tool with topic='{topic}', k={k}, mode={mode}")
+    start_time = time.time()
+    try:
+        result = await get_similar_topics(topic, k, ctx, mode)
+        logger.info(f"Exiting get_similar_topics_tool. Duration: {time.time() - start_time:.2f}s. Found {len(result) if result else 0} topics.")
+        return result
+    except Exception as e:
+        logger.exception(f"Error during get_similar_topics execution in get_similar_topics_tool: {e}")
+        raise
+
+
+# ----------- Server Metrics -----------
+
+
+@mcp.tool()
+async def server_stats() -> dict:
+    '''this tool returns server metrics: per-tool and per-stage latency (count, mean, p50/p90/p99 in ms), cache hit/miss and error counters, corpus size, cache age and memory'''
+    return snapshot()
+
+
+@mcp.tool()
+async def server_readiness() -> dict:
+    '''this tool reports per-capability readiness (crud, model, pairs, topics): pending, loading, ready or failed'''
+    return readiness_report()
+
+
+@mcp.tool()
+async def configure_profiling(
+    profile_next_calls: Optional[int] = None,
+    profile_slow_seconds: Optional[float] = None,
+    slow_request_seconds: Optional[float] = None,
+) -> dict:
+    '''this tool switches on-demand profiling without a restart: cProfile the next profile_next_calls tool calls, and/or every call keeping profiles of calls slower than profile_slow_seconds (0 turns it off); profiles are written to logs/profiles/. slow_request_seconds sets the threshold for logging slow calls with their stage spans. Omitted arguments keep their setting. Returns the settings and the most recent slow requests with their spans'''
+    return configure_tracing(profile_next_calls, profile_slow_seconds, slow_request_seconds)
+
+
+@mcp.resource("stats://server")
+def server_stats_resource() -> str:
+    """Server metrics snapshot as JSON."""
+    return json.dumps(snapshot())
+
+
 # ----------- Server Entrypoint -----------
 
 if __name__ == "__main__":
-    import time # Add time import for logging duration
-    logger.info("Initializing cache before starting server...")
-    start_cache_init = time.time()
-    # Initialize cache before starting the server
-    loop = asyncio.get_event_loop()
-    if loop.is_running():
-        loop.create_task(init_cache(fetch_all_pairs_async))
+    for capability in ("model", *COLLECTIONS):
+        set_state(capability, PENDING)
+    if STARTUP_MODE == "blocking":
+        logger.info("Initializing cache before starting server...")
+        # Initialize cache before starting the server
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(init_collections())
+        # The warm-up loop's HTTP client can't be reused by mcp.run()'s loop, close it here
+        loop.run_until_complete(close_client())
     else:
-        loop.run_until_complete(init_cache(fetch_all_pairs_async))
+        logger.info(f"Starting server without waiting for the cache (STARTUP_MODE={STARTUP_MODE}).")
+    if METRICS_PORT > 0:
+        start_metrics_server(METRICS_PORT, METRICS_HOST)
     mcp.run()
@@ -0,0 +1,241 @@
+import bisect
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import logger
+from tracing import span, traced_call
+
+# In-process metrics for the MCP server (no external dependency).
+# - Histograms (fixed buckets, seconds): per tool (`tool_seconds`) and per stage (`stage_seconds`)
+# - Counters: cache hits/misses, decode errors, backend errors, tool errors
+# - Gauges: set directly, or computed at read time from registered callbacks (corpus size, cache age, memory)
+# Recording is a bisect plus a few additions under a lock, cheap enough for the query path.
+# Read through `snapshot()` (server_stats tool) or `render_prometheus()` (optional /metrics endpoint).
+# `timer()` yields the measured duration too, so timing log lines use the same numbers as the metrics.
+# Stages and tool calls are also recorded as per-request trace spans (see tracing.py).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LOCK = threading.Lock()
+_HISTOGRAMS = {}  # name -> {labels: [bucket counts..., +Inf count, sum]}
+_COUNTERS = {}  # name -> {labels: value}
+_GAUGES = {}  # name -> {labels: value}
+_CALLBACKS = {"gauge": {}, "counter": {}}  # kind -> name -> fn() returning {labels: value}
+_HELP = {}
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def describe(name, help_text):
+    _HELP[name] = help_text
+
+
+def observe(name, seconds, **labels):
+    key = _labels(labels)
+    slot = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _LOCK:
+        series = _HISTOGRAMS.setdefault(name, {})
+        counts = series.get(key)
+        if counts is None:
+            counts = series[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        counts[slot] += 1
+        counts[-1] += seconds
+
+
+def inc(name, amount=1, **labels):
+    key = _labels(labels)
+    with _LOCK:
+        series = _COUNTERS.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    with _LOCK:
+        _GAUGES.setdefault(name, {})[_labels(labels)] = value
+
+
+def register_gauge(name, fn, help_text=None):
+    """`fn()` returns {labels as a tuple of (key, value) pairs: value}; it is only called when metrics are read."""
+    _CALLBACKS["gauge"][name] = fn
+    if help_text:
+        describe(name, help_text)
+
+
+def register_counter(name, fn, help_text=None):
+    """Like register_gauge, for counters kept elsewhere (e.g. LRUCache hit counts), so nothing runs on the hot path."""
+    _CALLBACKS["counter"][name] = fn
+    if help_text:
+        describe(name, help_text)
+
+
+class Timer:
+    __slots__ = ("start", "elapsed")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+
+@contextmanager
+def timer(name, **labels):
+    """Times the block into histogram `name`; `t.elapsed` (seconds) is available after the block."""
+    t = Timer()
+    try:
+        yield t
+    finally:
+        t.elapsed = time.perf_counter() - t.start
+        observe(name, t.elapsed, **labels)
+
+
+@contextmanager
+def stage(stage_name):
+    with span(stage_name), timer("stage_seconds", stage=stage_name) as t:
+        yield t
+
+
+def timed_tool(fn):
+    """Decorator for async MCP tools: records `tool_seconds` and `tool_errors_total` under the function name,
+    traces the call (slow-request log, profiling, see tracing.py) and counts `slow_requests_total`."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        try:
+            with traced_call(fn.__name__) as trace:
+                return await fn(*args, **kwargs)
+        except Exception:
+            inc("tool_errors_total", tool=fn.__name__)
+            raise
+        finally:
+            observe("tool_seconds", trace.elapsed, tool=fn.__name__)
+            if trace.slow:
+                inc("slow_requests_total", tool=fn.__name__)
+    return wrapper
+
+
+def _quantile(counts, q):
+    """Quantile estimate from bucket counts (linear interpolation inside the bucket)."""
+    total = sum(counts[:-1])
+    if total == 0:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts[:-1]):
+        if seen + count >= rank and count > 0:
+            lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+            upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+def _read(kind):
+    with _LOCK:
+        source = _GAUGES if kind == "gauge" else _COUNTERS
+        values = {name: dict(series) for name, series in source.items()}
+    for name, fn in _CALLBACKS[kind].items():
+        try:
+            values[name] = {key: value for key, value in fn().items() if value is not None}
+        except Exception as e:
+            logger.debug(f"metrics: {kind} callback {name} failed: {e}")
+    return values
+
+
+def _label_str(key):
+    return ",".join(f"{k}={v}" for k, v in key) or "all"
+
+
+def snapshot():
+    """JSON-friendly view: histogram count/sum/mean/p50/p90/p99 (ms), counters and gauges."""
+    with _LOCK:
+        histograms = {name: {key: list(counts) for key, counts in series.items()} for name, series in _HISTOGRAMS.items()}
+    result = {"histograms": {}, "counters": {}, "gauges": {}}
+    for name, series in histograms.items():
+        for key, counts in series.items():
+            count = sum(counts[:-1])
+            result["histograms"].setdefault(name, {})[_label_str(key)] = {
+                "count": count,
+                "sum_s": round(counts[-1], 6),
+                "mean_ms": round(counts[-1] / count * 1000, 3) if count else None,
+                **{f"p{int(q * 100)}_ms": round(_quantile(counts, q) * 1000, 3) for q in (0.5, 0.9, 0.99)},
+            }
+    for name, series in _read("counter").items():
+        result["counters"][name] = {_label_str(key): value for key, value in series.items()}
+    for name, series in _read("gauge").items():
+        result["gauges"][name] = {_label_str(key): value for key, value in series.items()}
+    return result
+
+
+def _prom_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus():
+    """Prometheus text exposition format (version 0.0.4)."""
+    with _LOCK:
+        histograms = {name: {key: list(counts) for key, counts in series.items()} for name, series in _HISTOGRAMS.items()}
+    lines = []
+    for name, series in histograms.items():
+        lines += [f"# HELP mcp_{name} {_HELP.get(name, name)}", f"# TYPE mcp_{name} histogram"]
+        for key, counts in series.items():
+            cumulative = 0
+            for bound, count in zip(list(LATENCY_BUCKETS) + ["+Inf"], counts[:-1]):
+                cumulative += count
+                lines.append(f"mcp_{name}_bucket{_prom_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"mcp_{name}_sum{_prom_labels(key)} {counts[-1]}")
+            lines.append(f"mcp_{name}_count{_prom_labels(key)} {cumulative}")
+    for name, series in _read("counter").items():
+        lines += [f"# HELP mcp_{name} {_HELP.get(name, name)}", f"# TYPE mcp_{name} counter"]
+        lines += [f"mcp_{name}{_prom_labels(key)} {value}" for key, value in series.items()]
+    for name, series in _read("gauge").items():
+        lines += [f"# HELP mcp_{name} {_HELP.get(name, name)}", f"# TYPE mcp_{name} gauge"]
+        lines += [f"mcp_{name}{_prom_labels(key)} {value}" for key, value in series.items()]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics endpoint: {format % args}")
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serves /metrics from a daemon thread (FastMCP 1.6 has no custom HTTP routes). Returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"start_metrics_server: Prometheus metrics on http://{host}:{port}/metrics")
+    return server
+
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+if resource is not None:
+    _RSS_UNIT = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    register_gauge("process_max_rss_bytes", lambda: {(): resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT},
+                   "Peak resident set size of the server process")
+
+describe("tool_seconds", "MCP tool call duration in seconds")
+describe("stage_seconds", "Duration of internal stages (encode, similarity, topk, http_fetch, cache_load, ...)")
+describe("http_request_seconds", "Backend HTTP request duration in seconds")
+describe("decode_errors_total", "Embeddings that could not be decoded")
+describe("backend_errors_total", "Failed backend requests (transport errors and 5xx)")
+describe("tool_errors_total", "MCP tool calls that raised")
+describe("slow_requests_total", "MCP tool calls slower than the slow-request threshold")
@@ -0,0 +1,135 @@
+import os
+import time
+import numpy as np
+from config import logger, NEIGHBOUR_GRAPH_K, NEIGHBOUR_GRAPH_BLOCK_ROWS
+from vector_index import top_k_rows
+from cache_format import atomic_write
+
+# Precomputed top-K neighbour graph of a collection, built next to the vector index.
+# - build: every row's K nearest other rows, queried from the collection's index in blocks of rows
+#   (blocked matrix products for the flat index; IVF blocks follow the bucket order, so each block
+#   probes few buckets)
+# - apply_rows: incremental update (on a copy) for patched/appended rows: their lists are recomputed, entries
+#   that pointed at their old vectors dropped, and every row's list merged with the new rows
+#   (one n x new_rows product). Lists that lost an entry can miss a neighbour until the next full build.
+# - neighbours: the stored list of a row, O(K)
+# - random_walk: similarity-weighted walks over the graph, for related but diverse suggestions
+# Persisted per cache generation as <prefix>.<generation>.graph.npz, keyed by the cache stamp.
+
+
+class NeighbourGraph:
+    def __init__(self, neighbours, scores):
+        self.neighbours = neighbours  # (n, K) int64 rows, -1 = empty slot
+        self.scores = scores  # (n, K) float32 cosine similarities, best first
+
+    @property
+    def k(self):
+        return self.neighbours.shape[1]
+
+    def __len__(self):
+        return len(self.neighbours)
+
+    @staticmethod
+    def _search(index, vectors, rows, k):
+        """K best other rows for each of `rows` from the index (the row itself removed)."""
+        scores, found = index.search_batch(np.asarray(vectors[rows], dtype=np.float32), k + 1)
+        # Stable sort of the "is self" flags moves the row itself last, keeping the rest in score order
+        keep = np.argsort(found == np.asarray(rows)[:, None], axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(found, keep, axis=1), np.take_along_axis(scores, keep, axis=1).astype(np.float32)
+
+    @classmethod
+    def build(cls, index, vectors, k=NEIGHBOUR_GRAPH_K, block_rows=NEIGHBOUR_GRAPH_BLOCK_ROWS):
+        start_time = time.time()
+        n = len(vectors)
+        k = min(k, max(n - 1, 0))
+        neighbours = np.full((n, k), -1, dtype=np.int64)
+        scores = np.full((n, k), -np.inf, dtype=np.float32)
+        order = getattr(index, "order", None)  # IVF: rows grouped by bucket
+        order = np.arange(n) if order is None or len(order) != n else order
+        for start in range(0, n, block_rows):
+            rows = np.sort(order[start:start + block_rows])
+            neighbours[rows], scores[rows] = cls._search(index, vectors, rows, k)
+        logger.info(f"NeighbourGraph: Built {k}-NN graph over {n} rows in {time.time() - start_time:.2f}s.")
+        return cls(neighbours, scores)
+
+    @classmethod
+    def load_or_build(cls, path, stamp, index, vectors):
+        graph = cls.load(path, stamp, len(vectors))
+        if graph is None:
+            graph = cls.build(index, vectors)
+            try:
+                graph.save(path, stamp)
+            except Exception as e:
+                logger.exception(f"NeighbourGraph: Failed to save to {path}: {e}")
+        return graph
+
+    def apply_rows(self, index, vectors, row_ids, block_rows=16384):
+        """Graph updated for patched/appended `row_ids` (`index` and `vectors` already include them), as a
+        new NeighbourGraph: this one may still be read by a published cache state."""
+        start_time = time.time()
+        n, k = len(vectors), self.k
+        changed = np.unique(np.asarray(row_ids, dtype=np.int64))
+        graph = NeighbourGraph(np.array(self.neighbours), np.array(self.scores))
+        if n > len(graph):
+            graph.neighbours = np.concatenate([graph.neighbours, np.full((n - len(graph), k), -1, dtype=np.int64)])
+            graph.scores = np.concatenate([graph.scores, np.full((n - len(graph.scores), k), -np.inf, dtype=np.float32)])
+        stale = np.isin(graph.neighbours, changed)
+        graph.neighbours[stale], graph.scores[stale] = -1, -np.inf
+        changed_vectors = np.asarray(vectors[changed], dtype=np.float32)
+        for start in range(0, n, block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32) @ changed_vectors.T
+            rows = np.arange(start, start + len(block))
+            block[rows[:, None] == changed[None, :]] = -np.inf  # No self-edges
+            merged_scores = np.concatenate([graph.scores[start:start + len(block)], block], axis=1)
+            merged_rows = np.concatenate([graph.neighbours[start:start + len(block)], np.broadcast_to(changed, block.shape)], axis=1)
+            keep = top_k_rows(merged_scores, k)
+            graph.scores[start:start + len(block)] = np.take_along_axis(merged_scores, keep, axis=1)
+            graph.neighbours[start:start + len(block)] = np.take_along_axis(merged_rows, keep, axis=1)
+        graph.neighbours[changed], graph.scores[changed] = self._search(index, vectors, changed, k)
+        graph.neighbours[~np.isfinite(graph.scores)] = -1
+        logger.info(f"NeighbourGraph: Updated for {len(changed)} rows in {time.time() - start_time:.2f}s.")
+        return graph
+
+    def neighbours_of(self, row, k=None):
+        """(rows, scores) of a row's stored neighbours, best first."""
+        valid = self.neighbours[row] >= 0
+        return self.neighbours[row][valid][:k], self.scores[row][valid][:k]
+
+    def random_walk(self, start_row, n=10, walk_length=3, min_hops=2, seed=None):
+        """Rows reached by similarity-weighted random walks from `start_row`.
+
+        Returns [(row, visits, hops)] for up to n rows, preferring rows first reached at least `min_hops`
+        steps away (related, but not the obvious nearest neighbours), then by visit count.
+        """
+        rng = np.random.default_rng(seed)
+        visits, hops = {}, {}
+        for _ in range(max(4 * n, 16)):
+            row = start_row
+            for hop in range(1, walk_length + 1):
+                rows, scores = self.neighbours_of(row)
+                if not len(rows):
+                    break
+                weights = np.maximum(scores, 0) + 1e-6
+                row = int(rng.choice(rows, p=weights / weights.sum()))
+                if row != start_row:
+                    visits[row] = visits.get(row, 0) + 1
+                    hops[row] = min(hops.get(row, hop), hop)
+        ranked = sorted(visits, key=lambda r: (hops[r] < min_hops, -visits[r], hops[r]))
+        return [(row, visits[row], hops[row]) for row in ranked[:n]]
+
+    def save(self, path, stamp):
+        atomic_write(path, lambda f: np.savez(f, neighbours=self.neighbours, scores=self.scores, stamp=stamp))
+
+    @classmethod
+    def load(cls, path, stamp, n_rows, k=NEIGHBOUR_GRAPH_K):
+        """Graph saved for the same cache `stamp`, row count and K, else None."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if float(data["stamp"]) != stamp or len(data["neighbours"]) != n_rows or data["neighbours"].shape[1] != min(k, max(n_rows - 1, 0)):
+                    return None
+                return cls(data["neighbours"], data["scores"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"NeighbourGraph: Could not load {path}: {e}")
+            return None
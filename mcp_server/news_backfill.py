@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import csv
+import time
+from contextlib import asynccontextmanager
+from config import (
+    logger,
+    NEWS_SCHEDULE_PATH,
+    NEWS_BACKFILL_CONCURRENCY,
+    NEWS_BACKFILL_RATE_PER_SECOND,
+)
+from http_client import api_request, close_client
+from news_store import NewsStore, parse_time, format_time
+from metrics import inc, describe
+from tracing import run_traced
+
+# News backfill from a window schedule (documents/news_dates.csv: start_date,end_date,is_done) into the
+# local NewsStore, and the store-first read path behind the get_news tool.
+# - Windows are fetched concurrently, at most NEWS_BACKFILL_CONCURRENCY in flight and
+#   NEWS_BACKFILL_RATE_PER_SECOND started per second.
+# - Only the parts of a window missing from the store's coverage are requested, and each is
+#   checkpointed as soon as its records are stored, so an interrupted run resumes where it stopped and a
+#   daily run only fetches the new days.
+# - Windows with is_done=false have no news yet and are skipped unless include_pending is set.
+# Schedule end dates at midnight mean "up to and including that day".
+# Store loads and appends (file lock, fsync) run in the executor, off the event loop.
+
+DAY_SECONDS = 24 * 3600
+_STORE = None
+
+
+def get_store():
+    global _STORE
+    if _STORE is None:
+        _STORE = NewsStore()
+    return _STORE.load()
+
+
+async def get_store_async():
+    return await run_traced(get_store)
+
+
+class RateLimiter:
+    """Bounds concurrent requests and spaces their starts at least 1/rate seconds apart."""
+
+    def __init__(self, rate=NEWS_BACKFILL_RATE_PER_SECOND, concurrency=NEWS_BACKFILL_CONCURRENCY):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._next_start = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self.semaphore:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield
+
+
+def read_schedule(path=NEWS_SCHEDULE_PATH):
+    """[(start, end, is_done)] in epoch seconds from a start_date,end_date,is_done CSV."""
+    windows = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            start, end = parse_time(row["start_date"].strip()), parse_time(row["end_date"].strip())
+            if end % DAY_SECONDS == 0:
+                end += DAY_SECONDS  # Whole last day, so consecutive windows leave no gap
+            windows.append((start, end, row.get("is_done", "").strip().lower() == "true"))
+    return windows
+
+
+async def fetch_range(store, start, end, news_type=None, limiter=None):
+    """Fetches [start, end] from the backend into the store and checkpoints it. Returns the record count."""
+    params = {"start_time": format_time(start), "end_time": format_time(end)}
+    if news_type:
+        params["news_type"] = news_type
+    fetched_at = time.time()
+    if limiter is not None:
+        async with limiter.slot():
+            resp = await api_request("GET", "/news/", params=params)
+    else:
+        resp = await api_request("GET", "/news/", params=params)
+    resp.raise_for_status()
+    records = resp.json()
+    await run_traced(store.add, records, (start, end), news_type, fetched_at)
+    inc("news_ranges_fetched_total")
+    return len(records)
+
+
+async def get_news_local(start_time, end_time, news_type=None):
+    """get_news served from the store; only the sub-ranges not fetched before go to the backend."""
+    store = await get_store_async()
+    start, end = parse_time(start_time), parse_time(end_time)
+    gaps = store.missing(start, end, news_type)
+    inc("news_store_requests_total", result="hit" if not gaps else "partial" if len(gaps) > 1 or gaps[0] != (start, end) else "miss")
+    if gaps:
+        logger.info(f"get_news_local: Fetching {len(gaps)} missing sub-range(s) of {start_time}..{end_time} (type={news_type}).")
+        await asyncio.gather(*(fetch_range(store, gap_start, gap_end, news_type) for gap_start, gap_end in gaps))
+    return store.query(start, end, news_type)
+
+
+async def run_news_backfill(schedule_path=NEWS_SCHEDULE_PATH, news_type=None, include_pending=False, limiter=None):
+    """Fetches every scheduled window (or the parts of it) missing from the store. Returns run stats."""
+    start_time = time.time()
+    store = await get_store_async()
+    limiter = limiter or RateLimiter()
+    windows = read_schedule(schedule_path)
+    stats = {"windows": len(windows), "skipped_pending": 0, "already_stored": 0, "ranges_fetched": 0, "records": 0, "failed": 0}
+    ranges = []
+    for start, end, is_done in windows:
+        if not is_done and not include_pending:
+            stats["skipped_pending"] += 1
+            continue
+        gaps = store.missing(start, end, news_type)
+        if not gaps:
+            stats["already_stored"] += 1
+        ranges.extend(gaps)
+
+    async def fetch(gap_start, gap_end):
+        try:
+            count = await fetch_range(store, gap_start, gap_end, news_type, limiter)
+            stats["records"] += count
+            stats["ranges_fetched"] += 1
+        except Exception as e:
+            stats["failed"] += 1
+            logger.error(f"run_news_backfill: {format_time(gap_start)}..{format_time(gap_end)} failed, retried on the next run: {e}")
+
+    await asyncio.gather(*(fetch(gap_start, gap_end) for gap_start, gap_end in ranges))
+    stats["seconds"] = round(time.time() - start_time, 2)
+    logger.info(f"run_news_backfill: Finished. {stats}")
+    return stats
+
+
+describe("news_ranges_fetched_total", "Date ranges fetched from the backend into the local news store")
+describe("news_store_requests_total", "get_news calls by store result (hit, partial, miss)")
+
+
+async def _main(args):
+    try:
+        return await run_news_backfill(args.schedule, args.news_type, args.include_pending)
+    finally:
+        await close_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch scheduled news windows into the local news store (resumable).")
+    parser.add_argument("--schedule", default=NEWS_SCHEDULE_PATH, help="CSV with start_date,end_date,is_done")
+    parser.add_argument("--news-type", default=None, help="Only this news type (default: all types)")
+    parser.add_argument("--include-pending", action="store_true", help="Also fetch windows with is_done=false")
+    print(asyncio.run(_main(parser.parse_args())))
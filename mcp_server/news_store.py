@@ -0,0 +1,190 @@
+import bisect
+import heapq
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from config import logger, NEWS_STORE_DIR, NEWS_SETTLE_SECONDS
+from cache_format import atomic_write
+from host_lock import locked
+
+# Local copy of backend news, so get_news only asks the backend for date ranges it has not seen yet.
+# - news.jsonl: append-only, one backend record per line (the last line for an id wins on load)
+# - coverage.json: per news_type ("*" = all types) the merged time intervals already fetched completely.
+#   Rewritten atomically after the records of a window are appended and fsynced, so it is the
+#   per-window checkpoint: a crash in between only means the window is fetched again (and its
+#   records deduplicated by id).
+# In memory, records are indexed per news_source and sorted by start_date. A range query returns the
+# records overlapping [start, end] (the backend's filter), best served by one bisect per type.
+# load() only parses the bytes appended since the previous load, and new records are merged into the
+# index instead of re-sorting everything. The methods block (file lock, fsync): async callers run them
+# in an executor, and an in-process lock keeps those threads and queries apart.
+# Backend ranges that end less than NEWS_SETTLE_SECONDS before they were fetched are stored but not
+# marked covered, because news for recent days is still being created; they are fetched again later.
+
+ALL_TYPES = "*"
+
+
+def parse_time(value):
+    """ISO 8601 string (Z, offset or naive = UTC) or datetime -> epoch seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def format_time(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_intervals(start, end, covered):
+    """Parts of [start, end] not inside the merged, sorted `covered` intervals."""
+    gaps, cursor = [], start
+    for c_start, c_end in covered:
+        if c_end < cursor:
+            continue
+        if c_start > end:
+            break
+        if c_start > cursor:
+            gaps.append((cursor, c_start))
+        cursor = max(cursor, c_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class NewsStore:
+    def __init__(self, directory=NEWS_STORE_DIR):
+        self.directory = directory
+        self.records_path = os.path.join(directory, "news.jsonl")
+        self.coverage_path = os.path.join(directory, "coverage.json")
+        self.lock_path = os.path.join(directory, "news.lock")
+        self.records = {}  # id -> record
+        self.by_type = {}  # news_source -> (sorted start times, ids)
+        self.max_duration = 0.0  # Longest record span, bounds the bisect window
+        self.coverage = {}  # news_type or ALL_TYPES -> merged [start, end] intervals
+        self._loaded_size = 0  # Bytes of news.jsonl parsed so far (up to the last complete line)
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        """Reads records appended since the last load (also by other processes) and the coverage."""
+        with self._lock:
+            size = os.path.getsize(self.records_path) if os.path.exists(self.records_path) else 0
+            if size < self._loaded_size:  # Replaced or truncated file: start over
+                self.records, self.by_type, self.max_duration, self._loaded_size = {}, {}, 0.0, 0
+            if size > self._loaded_size:
+                start_time = time.time()
+                with open(self.records_path, "rb") as f:
+                    f.seek(self._loaded_size)
+                    tail = f.read(size - self._loaded_size)
+                complete = tail[:tail.rfind(b"\n") + 1]  # A torn last line is read again once completed
+                records = []
+                for line in complete.splitlines():
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue  # Line torn by an interrupted append, followed by later appends
+                self._index(records)
+                self._loaded_size += len(complete)
+                logger.info(f"NewsStore: Loaded {len(records)} news records ({len(self.records)} total) in {time.time() - start_time:.2f}s.")
+            if os.path.exists(self.coverage_path):
+                with open(self.coverage_path, "r", encoding="utf-8") as f:
+                    self.coverage = {key: merge_intervals(intervals) for key, intervals in json.load(f).items()}
+        return self
+
+    def _index(self, records):
+        """Adds records (the last one for an id wins) to the records and the per-type start index."""
+        new = {}
+        for record in records:
+            previous = self.records.get(record["id"])
+            if previous is not None:
+                self._unindex(previous)
+                for entries in new.values():  # Also listed earlier in this batch
+                    entries.pop(record["id"], None)
+            self.records[record["id"]] = record
+            start, end = parse_time(record["start_date"]), parse_time(record["end_date"])
+            self.max_duration = max(self.max_duration, end - start)
+            new.setdefault(record.get("news_source"), {})[record["id"]] = start
+        for news_type, entries in new.items():
+            starts, ids = self.by_type.get(news_type, ([], []))
+            entries = sorted((start, item_id) for item_id, start in entries.items())
+            if len(entries) <= 32:  # Few records (a created batch): insert in place
+                for start, item_id in entries:
+                    position = bisect.bisect_right(starts, start)
+                    starts.insert(position, start)
+                    ids.insert(position, item_id)
+            else:
+                merged = list(heapq.merge(zip(starts, ids), entries))
+                starts, ids = [start for start, _ in merged], [item_id for _, item_id in merged]
+            self.by_type[news_type] = (starts, ids)
+
+    def _unindex(self, record):
+        starts, ids = self.by_type.get(record.get("news_source"), ([], []))  # Not there when listed earlier in the batch
+        start = parse_time(record["start_date"])
+        lo, hi = bisect.bisect_left(starts, start), bisect.bisect_right(starts, start)
+        if record["id"] in ids[lo:hi]:
+            position = lo + ids[lo:hi].index(record["id"])
+            del starts[position], ids[position]
+
+    def add(self, records, covered=None, news_type=None, fetched_at=None):
+        """Appends backend records and, with `covered=(start, end)`, checkpoints that range as fetched."""
+        with self._lock, locked(self.lock_path):
+            self.load()  # Picks up appends of other processes first
+            new = [r for r in records if self.records.get(r["id"]) != r]
+            if new:
+                with open(self.records_path, "ab") as f:
+                    if f.tell() > self._loaded_size:  # Torn last line of an interrupted append: end it first
+                        f.write(b"\n")
+                    f.writelines((json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8") for r in new)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._loaded_size = f.tell()
+                self._index(new)
+            if covered is not None:
+                self._checkpoint(covered, news_type or ALL_TYPES, time.time() if fetched_at is None else fetched_at)
+
+    def _checkpoint(self, covered, key, fetched_at):
+        start, end = covered
+        end = min(end, fetched_at - NEWS_SETTLE_SECONDS)
+        if end <= start:
+            return
+        # add() reloaded the coverage under the lock, so checkpoints of other processes are kept
+        self.coverage[key] = merge_intervals(self.coverage.get(key, []) + [[start, end]])
+        atomic_write(self.coverage_path, lambda f: json.dump(self.coverage, f), mode="w")
+
+    def missing(self, start, end, news_type=None):
+        """Sub-ranges of [start, end] (epoch seconds) that have not been fetched for `news_type`."""
+        covered = self.coverage.get(ALL_TYPES, [])
+        if news_type:
+            covered = merge_intervals(covered + self.coverage.get(news_type, []))
+        return subtract_intervals(start, end, covered)
+
+    def query(self, start, end, news_type=None):
+        """Records overlapping [start, end], newest start_date first (the backend's order)."""
+        results = []
+        with self._lock:
+            for record_type, (starts, ids) in self.by_type.items():
+                if news_type and record_type != news_type:
+                    continue
+                lo = bisect.bisect_left(starts, start - self.max_duration)
+                hi = bisect.bisect_right(starts, end)
+                for item_id in ids[lo:hi]:
+                    record = self.records[item_id]
+                    if parse_time(record["end_date"]) >= start:
+                        results.append(record)
+        return sorted(results, key=lambda record: parse_time(record["start_date"]), reverse=True)
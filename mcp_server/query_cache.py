@@ -0,0 +1,79 @@
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from config import QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS, RESULT_CACHE_SIZE
+from metrics import register_counter
+
+# In-memory caches for the similarity path:
+# - QUERY_EMBEDDING_CACHE: (model id, normalised text) -> query embedding, skips the model forward pass
+# - RESULT_CACHE: (normalised text, k, cache version) -> final top-k list, cleared on every cache refresh
+
+
+def normalize_query(text):
+    """Canonical form used as cache key: NFC, trimmed, single spaces."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class LRUCache:
+    """Thread-safe bounded LRU cache with optional TTL and hit/miss counters."""
+
+    def __init__(self, max_size, ttl_seconds=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and self.ttl_seconds and time.time() - entry[0] > self.ttl_seconds:
+                del self._items[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.time(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+QUERY_EMBEDDING_CACHE = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+RESULT_CACHE = LRUCache(RESULT_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+
+register_counter("cache_requests_total", lambda: {
+    (("cache", name), ("outcome", outcome)): getattr(cache, outcome)
+    for name, cache in (("query_embedding", QUERY_EMBEDDING_CACHE), ("result", RESULT_CACHE))
+    for outcome in ("hits", "misses")
+}, "Lookups in the in-memory query caches by cache and outcome")
@@ -1,230 +1,170 @@
-from sentence_transformers import SentenceTransformer
-import torch
-import httpx
-from base64 import b64encode, b64decode
 import numpy as np
 import asyncio
 import time  # Add time import for logging
 from schemas import PairStringInput
-from utils_cache import PAIRS_CACHE, load_model_async, init_cache, update_cache
-from config import logger, BASE_URL, HEADERS # Import logger, BASE_URL, HEADERS
+from utils_cache import (CACHES, COLLECTIONS, MODEL_NAME, CACHE_FULL_REFRESH_SECONDS, snapshot, load_model_async, init_cache,
+                         update_cache, delta_update_cache, build_vector_index, apply_cache_delta, load_local_cache_async, snapshot_with_graph)
+from backfill import run_embedding_backfill, current_cache_ids
+from query_cache import QUERY_EMBEDDING_CACHE, RESULT_CACHE, normalize_query
+from encode_batcher import EncodeBatcher
+from embedding_cache import EMBEDDING_CACHE
+from vector_index import normalize_rows
+from config import logger, LEXICAL_HYBRID_CANDIDATES, CACHE_REFRESH_INTERVAL_SECONDS
+from lexical_index import SEARCH_MODES, rrf_fuse
+from corpus_fetch import fetch_page_async, fetch_all_pairs_async, fetch_all_topics_async, fetch_new_pairs_async, corpus_fetcher
+from metrics import stage
+from cache_sharing import is_owner, follow_collection, sync_generation, sync_generation_soon
+from readiness import set_state, single_flight, LOADING, READY, FAILED
 # Import Context if available, handle optional dependency
 try:
     from mcp.server.fastmcp import Context
 except ImportError:
     Context = None # Define Context as None if mcp is not installed or available
 
-# Load the model on GPU
-# model_name = "Snowflake/snowflake-arctic-embed-l-v2.0"
-# model = SentenceTransformer(model_name, device="cuda")
+# Coalesces concurrent query encodes from get_similar_pairs into batched model calls
+QUERY_ENCODER = EncodeBatcher(load_model_async)
 
 ### function create embeddings for a text
-def generate_embeddings_for_contrasting():
+async def generate_embeddings_for_collection(collection, list_params=None):
     """
-    1. Fetch all contrast pairs with missing embeddings (paginated)
-    2. Generate embeddings for each ("item1 vs item2")
-    3. Batch update pairs with new embeddings
+    1. Stream the collection page by page, keeping items without embeddings
+    2. Generate embeddings in batches (the collection's embedding text) while the next pages download
+    3. Upload batches concurrently; progress is checkpointed so an interrupted run resumes
+    4. Patch the new embeddings into the local cache (no full re-download)
     """
     start_time = time.time()
-    logger.info("Starting generate_embeddings_for_contrasting")
-    count = 4000
-    page = 1
-    params = {"page": page, "count": count, "vector_embedding": True}
-    all_pairs = []
-    logger.info("Fetching contrast pairs with missing embeddings...")
-    fetch_start_time = time.time()
-    while True:
-        page_fetch_start = time.time()
-        logger.debug(f"generate_embeddings: Fetching page {page}...")
-        try:
-            resp = httpx.get(f"{BASE_URL}/contrast-pairs/", params=params, headers=HEADERS)
-            resp.raise_for_status() # Raise HTTP errors
-            data = resp.json()
-            results = data.get("results", [])
-            missing = [p for p in results if p.get("vector_embedding") is None]
-            all_pairs.extend(missing)
-            logger.debug(f"generate_embeddings: Page {page} fetch successful in {time.time() - page_fetch_start:.2f}s. Found {len(missing)} missing embeddings.")
-            if not data.get("next"):
-                break
-            page += 1
-            params["page"] = page
-        except httpx.RequestError as exc:
-            logger.error(f"generate_embeddings: HTTP Request error fetching page {page}: {exc}")
-            break # Stop fetching on error
-        except Exception as exc:
-            logger.exception(f"generate_embeddings: Unexpected error fetching page {page}: {exc}")
-            break # Stop fetching on unexpected error
-
-    logger.info(f"generate_embeddings: Finished fetching pairs in {time.time() - fetch_start_time:.2f}s. Found {len(all_pairs)} pairs needing embeddings.")
-    if not all_pairs:
-        logger.info("generate_embeddings: No pairs to update.")
-        return
-
-    # Prepare texts for embedding
-    texts = [f"{p['item1']} vs {p['item2']}" for p in all_pairs]
-    # Batch process
-    batch_size = 256
-    model = None
+    spec = COLLECTIONS[collection]
+    logger.info(f"Starting generate_embeddings_for_collection for {collection}")
+    model = await load_model_async()
+    if model is None:
+        logger.error("generate_embeddings: Failed to load model.")
+        return 0
+    # Cached items have embeddings, so pages can be fetched without them while the cache is current
+    known_ids = None
+    if await load_local_cache_async(collection):
+        delta_sync = COLLECTION_FETCHERS[collection][1] is not None
+        if delta_sync:
+            await refresh_collection(collection)
+        known_ids = await current_cache_ids(spec["list_path"], snapshot(collection), list_params, newest_first=delta_sync)
+    uploaded = await run_embedding_backfill(
+        collection,
+        spec["list_path"],
+        spec["update_path"],
+        spec["text"],
+        model,
+        known_ids=known_ids,
+        list_params=list_params,
+    )
+    logger.info(f"Embedding generation and update complete. Total {collection} updated: {len(uploaded)}. Total time: {time.time() - start_time:.2f}s.")
+    # Patch the new embeddings straight into the local cache instead of re-downloading the corpus
+    if uploaded:
+        logger.info(f"generate_embeddings: Applying {len(uploaded)} new embeddings to the local {collection} cache.")
+        delta = [{**r["item"], "embedding": r["embedding"]} for r in uploaded]
+        await asyncio.get_running_loop().run_in_executor(None, lambda: apply_cache_delta(delta, collection=collection))
+    return len(uploaded)
+
+
+async def generate_embeddings_for_contrasting():
+    return await generate_embeddings_for_collection("pairs")
+
+
+async def generate_embeddings_for_topics():
+    # /topics/ returns embeddings unless told otherwise
+    return await generate_embeddings_for_collection("topics", list_params={"vector_embedding": False})
+
+
+# Backend fetchers per collection: (full fetch, delta fetch). Full fetches stream-decode pages into one
+# preallocated matrix (see corpus_fetch.py). Topics are ordered by name, so there is no id watermark to
+# walk back to and expired topic caches are re-downloaded in full.
+COLLECTION_FETCHERS = {
+    "pairs": (corpus_fetcher(COLLECTIONS["pairs"]["fields"], COLLECTIONS["pairs"]["list_path"], count=200), fetch_new_pairs_async),
+    "topics": (corpus_fetcher(COLLECTIONS["topics"]["fields"], COLLECTIONS["topics"]["list_path"], count=1000), None),
+}
+
+
+async def init_collection(collection="pairs"):
+    # Single-flight: a search during background warm-up waits for the warm-up's init
+    return await single_flight(("init", collection), lambda: _init_collection(collection))
+
+
+async def _init_collection(collection):
+    fetch_all_async, fetch_new_async = COLLECTION_FETCHERS[collection]
+    set_state(collection, LOADING)
     try:
-        logger.info("generate_embeddings: Loading embedding model...")
-        model_load_start = time.time()
-        model = asyncio.run(load_model_async()) if not asyncio.get_event_loop().is_running() else None
-        if model is None and asyncio.get_event_loop().is_running():
-             # If in running loop (like inside FastAPI/MCP request), run differently
-             model = asyncio.get_event_loop().run_until_complete(load_model_async())
-        logger.info(f"generate_embeddings: Model loaded in {time.time() - model_load_start:.2f}s.")
+        # Followers attach to the owner's published cache; the owner (or a follower taking over) fetches
+        cache = None if is_owner(collection) else await follow_collection(collection)
+        if cache is None:
+            cache = await init_cache(fetch_all_async, fetch_new_async=fetch_new_async, collection=collection)
     except Exception as e:
-        logger.exception("generate_embeddings: Failed to load model.")
-        return # Cannot proceed without model
-
-    logger.info(f"generate_embeddings: Starting embedding generation for {len(texts)} texts in batches of {batch_size}...")
-    total_updates = 0
-    for i in range(0, len(texts), batch_size):
-        batch_start_time = time.time()
-        batch_pairs = all_pairs[i : i + batch_size]
-        batch_texts = texts[i : i + batch_size]
-        batch_num = i // batch_size + 1
-        logger.info(f"generate_embeddings: Encoding batch {batch_num} ({len(batch_texts)} pairs)...")
-        try:
-            encode_start = time.time()
-            # Disable progress bar to prevent tqdm errors
-            embeddings = model.encode(batch_texts, show_progress_bar=False)
-            logger.debug(f"generate_embeddings: Batch {batch_num} encoded in {time.time() - encode_start:.2f}s.")
-
-            if not isinstance(embeddings, np.ndarray):
-                embeddings = np.array(embeddings)
-
-            updates = []
-            for pair, emb in zip(batch_pairs, embeddings):
-                try:
-                    emb_bytes = emb.astype(np.float32).tobytes()
-                    emb_b64 = b64encode(emb_bytes).decode("utf-8")
-                    updates.append({"id": pair["id"], "vector_embedding": emb_b64})
-                except Exception as e_inner:
-                     logger.error(f"generate_embeddings: Error processing embedding for pair {pair.get('id')}: {e_inner}")
-
-            if not updates:
-                 logger.warning(f"generate_embeddings: No valid updates generated for batch {batch_num}.")
-                 continue
-
-            logger.info(f"generate_embeddings: Sending batch update {batch_num} ({len(updates)} pairs)...")
-            patch_data = {"updates": updates}
-            patch_start = time.time()
-            patch_resp = httpx.patch(
-                f"{BASE_URL}/contrast-pairs/update/", json=patch_data, headers=HEADERS
-            )
-            patch_duration = time.time() - patch_start
-            if patch_resp.status_code == 200:
-                total_updates += len(updates)
-                logger.info(f"generate_embeddings: Batch {batch_num} update successful in {patch_duration:.2f}s. Updated {len(updates)} pairs.")
-            else:
-                logger.error(
-                    f"generate_embeddings: Batch {batch_num} update failed. Status {patch_resp.status_code}, Duration: {patch_duration:.2f}s, Response: {patch_resp.text}"
-                )
-        except Exception as batch_err:
-            logger.exception(f"generate_embeddings: Error processing batch {batch_num}: {batch_err}")
-
-        logger.debug(f"generate_embeddings: Batch {batch_num} processed in {time.time() - batch_start_time:.2f}s.")
-
-    logger.info(f"Embedding generation and update complete. Total pairs updated: {total_updates}. Total time: {time.time() - start_time:.2f}s.")
-    # Optionally update cache after adding new embeddings
-    logger.info("generate_embeddings: Triggering async cache update.")
-    asyncio.create_task(update_cache(fetch_all_pairs_async))
-
-
-async def fetch_page_async(client: httpx.AsyncClient, page: int, count: int):
-    params = {"page": page, "count": count, "vector_embedding": True}
-    logger.debug(f"fetch_page_async: Requesting page {page} with count {count}...")
-    request_start_time = time.time()
-    try:
-        resp = await client.get(f"{BASE_URL}/contrast-pairs/", params=params, headers=HEADERS)
-        resp.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-        logger.debug(f"fetch_page_async: Page {page} received status {resp.status_code} in {time.time() - request_start_time:.2f}s.")
-        return resp.json()
-    except httpx.RequestError as exc:
-        logger.error(f"fetch_page_async: HTTP Request error while requesting page {page} after {time.time() - request_start_time:.2f}s: {exc}")
-        return None
-    except Exception as exc:
-        logger.exception(f"fetch_page_async: Unexpected error fetching page {page} after {time.time() - request_start_time:.2f}s: {exc}")
-        return None
-
-
-async def fetch_all_pairs_async(count=200, max_concurrent=4, timeout=30.0):
-    overall_start_time = time.time()
-    logger.info(f"Starting fetch_all_pairs_async with count={count}, max_concurrent={max_concurrent}, timeout={timeout}...")
-    # Create client with timeout
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        # Fetch first page to get total and results
-        logger.info(f"fetch_all_pairs_async: Fetching first page...")
-        first_page_start = time.time()
-        first_page_data = await fetch_page_async(client, 1, count)
-        logger.info(f"fetch_all_pairs_async: First page fetch took {time.time() - first_page_start:.2f}s.")
-
-        if not first_page_data:
-            logger.error("fetch_all_pairs_async: Error fetching the first page. Aborting fetch.")
-            return [] # Return empty list if first page fails
-
-        total = first_page_data.get("total", 0)
-        results = first_page_data.get("results", [])
-        if not results and total > 0:
-             logger.warning(f"fetch_all_pairs_async: No results found on the first page, but backend reported total={total}.")
-             # Continue fetching other pages despite empty first page if total > 0
-        elif not results:
-             logger.info("fetch_all_pairs_async: No results found on the first page and total is 0.")
-             return []
-
-        logger.info(f"fetch_all_pairs_async: Total pairs reported by backend: {total}")
-        num_pages = (total + count - 1) // count
-        logger.info(f"fetch_all_pairs_async: Calculated number of pages: {num_pages}")
-
-        if num_pages <= 1:
-            logger.info("fetch_all_pairs_async: All pairs fetched on the first page.")
-            logger.info(f"fetch_all_pairs_async finished in {time.time() - overall_start_time:.2f}s. Retrieved {len(results)} pairs.")
-            return results
+        set_state(collection, FAILED, str(e))
+        raise
+    loaded = cache["data"] is not None
+    set_state(collection, READY if loaded else FAILED, f"{len(cache['data'])} items" if loaded else "no cache data")
+    return cache
+
+
+async def refresh_collection(collection="pairs"):
+    """Builds the collection's next state off the request path and publishes it when complete.
+    The owner syncs with the backend (delta, or full once the cache is older than CACHE_FULL_REFRESH_SECONDS),
+    followers pick up the newest generation the owner published."""
+    if CACHES[collection]["data"] is None:
+        return await init_collection(collection)
+    if not is_owner(collection):
+        await asyncio.get_running_loop().run_in_executor(None, sync_generation, collection, True)
+        return CACHES[collection]
+    fetch_all_async, fetch_new_async = COLLECTION_FETCHERS[collection]
+    age = time.time() - (CACHES[collection]["last_updated_timestamp"] or 0)
+    if fetch_new_async is not None and CACHES[collection]["max_seen_id"] is not None and age < CACHE_FULL_REFRESH_SECONDS:
+        return await delta_update_cache(fetch_new_async, fetch_all_async, collection)
+    return await update_cache(fetch_all_async, collection)
+
+
+async def refresh_loop(interval=CACHE_REFRESH_INTERVAL_SECONDS):
+    """Refreshes every collection each `interval` seconds until cancelled (started by the server lifespan)."""
+    while True:
+        await asyncio.sleep(interval)
+        for collection in COLLECTION_FETCHERS:
+            if CACHES[collection]["data"] is None:
+                continue  # Not loaded (yet): lazy startup or warm-up still running
+            start_time = time.time()
+            try:
+                # Shares the key with sync_generation_soon, so at most one new state is built at a time
+                await single_flight(("refresh", collection), lambda c=collection: refresh_collection(c))
+                logger.info(f"refresh_loop: Refreshed {collection} in {time.time() - start_time:.2f}s.")
+            except Exception as e:
+                logger.exception(f"refresh_loop: Refreshing {collection} failed, keeping the current cache: {e}")
 
-        # Limit concurrency
-        semaphore = asyncio.Semaphore(max_concurrent)
 
-        async def sem_fetch(page):
-            async with semaphore:
-                logger.debug(f"fetch_all_pairs_async: Fetching page {page}/{num_pages}...")
-                page_start_time = time.time()
-                page_data = await fetch_page_async(client, page, count)
-                duration = time.time() - page_start_time
-                res_count = len(page_data.get("results", [])) if page_data else 0
-                logger.debug(f"fetch_all_pairs_async: Page {page} fetched in {duration:.2f}s with {res_count} results.")
-                return page_data.get("results", []) if page_data else []
+async def init_collections():
+    # One after the other: the first init loads the shared model, the next ones reuse it
+    for collection in COLLECTION_FETCHERS:
+        await init_collection(collection)
 
-        # Prepare tasks for remaining pages
-        tasks = [sem_fetch(page) for page in range(2, num_pages + 1)]
 
-        logger.info(f"fetch_all_pairs_async: Fetching remaining {len(tasks)} pages concurrently (max {max_concurrent})...")
-        remaining_fetch_start = time.time()
-        page_results_list = await asyncio.gather(*tasks)
-        logger.info(f"fetch_all_pairs_async: Fetched remaining pages in {time.time() - remaining_fetch_start:.2f}s.")
+async def get_similar_pairs(pair_string: PairStringInput, k: int = 10, ctx: Context = None, mode: str = "dense"):
+    """Returns the k contrast pairs most similar to an "Item1 vs Item2" string (with similarity score)."""
+    input_text = pair_string.pair_string if isinstance(pair_string, PairStringInput) else pair_string
+    return await search_collection("pairs", input_text, k, ctx, mode)
 
-        # Extend the main results list with results from other pages
-        for page_res in page_results_list:
-            results.extend(page_res)
 
-        logger.info(f"Finished fetch_all_pairs_async in {time.time() - overall_start_time:.2f}s. Total pairs retrieved: {len(results)} (Expected based on total: {total})")
-        if len(results) != total:
-             logger.warning(f"fetch_all_pairs_async: Mismatch between retrieved pairs ({len(results)}) and reported total ({total}).")
-        return results
+async def get_similar_topics(topic: str, k: int = 10, ctx: Context = None, mode: str = "dense"):
+    """Returns the k topics most similar to `topic` (with similarity score)."""
+    return await search_collection("topics", topic, k, ctx, mode)
 
 
-async def get_similar_pairs(pair_string: PairStringInput, k: int = 10, ctx: Context = None):
+async def search_collection(collection: str, input_text: str, k: int = 10, ctx: Context = None, mode: str = "dense"):
     """
-    1. Use cached pairs with embeddings
-    2. Generate embedding for the input pair_string
+    1. Use the collection's cached items with embeddings
+    2. Generate embedding for the input text (skipped in lexical mode)
     3. Use pre-decoded DB embeddings from cache
-    4. Compute cosine similarity
-    5. Return top k most similar pairs (with similarity score)
-    Optionally reports progress using MCP context.
+    4. Compute cosine similarity (fused with / prefiltered by lexical scores in hybrid / prefilter mode)
+    5. Return top k most similar items (with similarity score, and lexical_score outside dense mode)
+    Optionally reports progress using MCP context. Modes are described in lexical_index.py.
     """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}'. Expected one of {SEARCH_MODES}.")
     overall_start_time = time.time()
-    input_text_log = pair_string.pair_string if isinstance(pair_string, PairStringInput) else pair_string
-    logger.info(f"Entering get_similar_pairs for '{input_text_log}', k={k}")
+    logger.info(f"Entering search_collection[{collection}] for '{input_text}', k={k}, mode={mode}")
 
     # Helper for safe progress reporting
     async def report_progress(step, total, message):
@@ -237,7 +177,8 @@ async def get_similar_pairs(pair_string: PairStringInput, k: int = 10, ctx: Cont
 
                 # Report numerical progress
                 logger.debug(f"Reporting progress: Step {step}/{total}")
-                await ctx.report_progress(step, total)
+                with stage("report_progress"):
+                    await ctx.report_progress(step, total)
             except Exception as report_err:
                 logger.warning(f"Failed to report progress/info ({type(report_err).__name__}): {report_err}")
         else:
@@ -245,124 +186,207 @@ async def get_similar_pairs(pair_string: PairStringInput, k: int = 10, ctx: Cont
 
     total_steps = 4 # Define total steps for progress reporting
 
-    # Step 1: Load model (already logged inside load_model_async)
-    await report_progress(0, total_steps, "Loading embedding model...")
-    model = await load_model_async()
-    # Check if model loaded
-    if model is None:
-        logger.error("get_similar_pairs: Failed to load model.")
-        return []
-
-    # Step 2: Ensure cache is initialized
-    await report_progress(1, total_steps, "Checking cache...")
-    if PAIRS_CACHE["data"] is None:
-        logger.warning("get_similar_pairs: Cache not initialized, attempting to initialize now...")
+    # Step 1: Ensure cache is initialized
+    await report_progress(0, total_steps, "Checking cache...")
+    if CACHES[collection]["data"] is None:
+        logger.warning(f"search_collection: {collection} cache not initialized, attempting to initialize now...")
         cache_init_start = time.time()
-        await init_cache(fetch_all_pairs_async)
-        logger.info(f"get_similar_pairs: Cache initialization attempt took {time.time() - cache_init_start:.2f}s.")
-
-    all_pairs = PAIRS_CACHE["data"]
-    db_embs = PAIRS_CACHE["db_embeddings"]
-
-    if not all_pairs or db_embs is None or len(db_embs) == 0:
-        logger.error("get_similar_pairs: No pairs with embeddings found in cache after initialization attempt.")
+        with stage("cache_init"):
+            await init_collection(collection)
+        logger.info(f"search_collection: Cache initialization attempt took {time.time() - cache_init_start:.2f}s.")
+    sync_generation_soon(collection)  # Picks up a generation published by another process (in the background)
+
+    # One snapshot for the whole request: a refresh published during the awaits below can't mix in
+    cache = snapshot(collection)
+    all_items, db_embs, index = cache["data"], cache["db_embeddings"], cache.get("index")
+    store, lexical = cache.get("store"), cache.get("lexical")
+
+    if not all_items or db_embs is None or len(db_embs) == 0:
+        logger.error(f"search_collection: No {collection} with embeddings found in cache after initialization attempt.")
         return []
 
-    logger.info(f"get_similar_pairs: Found {len(all_pairs)} pairs with {len(db_embs)} embeddings (shape: {db_embs.shape}) in cache.")
-
-    # Step 3: Generate input embedding
-    await report_progress(2, total_steps, "Generating input embedding...")
-    input_text = pair_string.pair_string if isinstance(pair_string, PairStringInput) else pair_string
-    logger.debug(f"get_similar_pairs: Generating embedding for input: '{input_text}'")
-    encode_start = time.time()
-    try:
-        # Disable progress bar to prevent tqdm errors
-        input_emb = model.encode([input_text], show_progress_bar=False)[0]
-        input_emb = input_emb.astype(np.float32)
-        logger.debug(f"get_similar_pairs: Input embedding generated in {time.time() - encode_start:.2f}s.")
-    except Exception as e:
-        logger.exception(f"get_similar_pairs: Error generating embedding for input '{input_text}': {e}")
-        return []
-
-    # Step 4: Compute similarity
+    logger.info(f"search_collection: Found {len(all_items)} {collection} with {len(db_embs)} embeddings (shape: {db_embs.shape}) in cache.")
+
+    query_key = normalize_query(input_text)
+    # Results are only valid for the cache version they were computed on
+    result_key = (collection, query_key, k, mode, cache.get("generation"), cache.get("last_updated_timestamp"))
+    cached_result = RESULT_CACHE.get(result_key)
+    if cached_result is not None:
+        await report_progress(4, total_steps, "Completed similarity search (cached result).")
+        logger.info(f"Exiting search_collection[{collection}] for '{input_text}' from result cache. Total duration: {time.time() - overall_start_time:.2f}s.")
+        return [dict(item) for item in cached_result]
+
+    lexical_scores = lexical.scores(query_key) if lexical is not None and mode != "dense" else None
+    if mode == "lexical":
+        # No model call: n-gram BM25 only
+        with stage("lexical_search"):
+            top_scores, top_idx = lexical.top(lexical_scores, k) if lexical is not None else ([], [])
+        top_items = [{**all_items[row], "lexical_score": round(float(score), 4)} for score, row in zip(top_scores, top_idx)]
+        RESULT_CACHE.put(result_key, [dict(item) for item in top_items])
+        await report_progress(4, total_steps, "Completed lexical search.")
+        logger.info(f"Exiting search_collection[{collection}] for '{input_text}' (lexical). Found {len(top_items)}. Total duration: {time.time() - overall_start_time:.2f}s.")
+        return top_items
+
+    # Step 2/3: Generate input embedding, skipping the model entirely on a query-embedding cache hit
+    input_emb = QUERY_EMBEDDING_CACHE.get((MODEL_NAME, query_key))
+    if input_emb is None:
+        await report_progress(1, total_steps, "Loading embedding model...")
+        model = await load_model_async()
+        # Check if model loaded
+        if model is None:
+            logger.error("search_collection: Failed to load model.")
+            return []
+
+        await report_progress(2, total_steps, "Generating input embedding...")
+        logger.debug(f"search_collection: Generating embedding for input: '{input_text}'")
+        try:
+            # Batched with any concurrent requests
+            with stage("encode") as t:
+                input_emb = await QUERY_ENCODER.encode(input_text)
+            QUERY_EMBEDDING_CACHE.put((MODEL_NAME, query_key), input_emb)
+            logger.debug(f"search_collection: Input embedding generated in {t.elapsed:.2f}s.")
+        except Exception as e:
+            logger.exception(f"search_collection: Error generating embedding for input '{input_text}': {e}")
+            return []
+    else:
+        logger.debug(f"search_collection: Query embedding cache hit for '{input_text}'.")
+
+    # Step 4: Search the vector index (embeddings are normalised once at cache build time)
     await report_progress(3, total_steps, "Calculating similarities...")
-    logger.debug(f"get_similar_pairs: Computing cosine similarities for {db_embs.shape[0]} cached embeddings...")
-    sim_start = time.time()
+    if index is None:
+        logger.warning("search_collection: Vector index missing, building it now...")
+        index = build_vector_index(cache, collection)
+    logger.debug(f"search_collection: Searching {index.kind} index over {len(index)} cached embeddings...")
     try:
         # Normalize input embedding
         input_norm_val = np.linalg.norm(input_emb)
         if input_norm_val == 0:
-             logger.error("get_similar_pairs: Input embedding norm is zero. Cannot compute similarity.")
+             logger.error("search_collection: Input embedding norm is zero. Cannot compute similarity.")
              return []
         input_norm = input_emb / input_norm_val
-
-        # Normalize database embeddings
-        db_norms_val = np.linalg.norm(db_embs, axis=1, keepdims=True)
-        # Handle potential zero norms in db embeddings
-        zero_norm_indices = np.where(db_norms_val == 0)[0]
-        if len(zero_norm_indices) > 0:
-            logger.warning(f"get_similar_pairs: Found {len(zero_norm_indices)} zero-norm embeddings in cache. Excluding them from similarity calculation.")
-            # Set norms for zero-norm vectors to a small epsilon to avoid division by zero,
-            # their dot product will be zero anyway if input_norm is not zero.
-            # Or, more simply, ensure they result in zero similarity. We can handle this later.
-            db_norms_val[zero_norm_indices] = 1e-9 # Avoid division by zero
-
-        db_norms = db_embs / db_norms_val
-
-        # Compute dot product (cosine similarity for normalized vectors)
-        sims = np.dot(db_norms, input_norm)
-
-        # Explicitly set similarity to -1 (or lowest possible) for zero-norm vectors if any
-        # This ensures they are ranked last.
-        if len(zero_norm_indices) > 0:
-             sims[zero_norm_indices] = -1.0
-
-        logger.debug(f"get_similar_pairs: Similarity computation took {time.time() - sim_start:.2f}s.")
+        n_candidates = max(k, LEXICAL_HYBRID_CANDIDATES) if mode == "hybrid" else k
+        with stage("search") as t:
+            prefilter = lexical.prefilter_rows(lexical_scores) if mode == "prefilter" and lexical_scores is not None else None
+            if prefilter is not None:
+                # Selective query: exact scoring of the lexical candidates only
+                top_sims, top_idx = store.search(input_norm, k, rows=prefilter)
+            else:
+                top_sims, top_idx = index.search(input_norm, n_candidates)
+            if mode == "hybrid" and lexical_scores is not None:
+                top_idx, _ = rrf_fuse([top_idx, lexical.top(lexical_scores, n_candidates)[1]], k)
+                top_sims = np.asarray(db_embs[top_idx]) @ input_norm
+        logger.debug(f"search_collection: Index search took {t.elapsed:.2f}s.")
     except Exception as e:
-        logger.exception(f"get_similar_pairs: Error during similarity computation: {e}")
+        logger.exception(f"search_collection: Error during similarity computation: {e}")
         return []
 
-    # Step 5: Sort and return (considered part of step 4 for progress)
-    logger.debug(f"get_similar_pairs: Sorting and selecting top {k} pairs...")
-    sort_start = time.time()
-    # Ensure k is not larger than the number of available similarities
-    actual_k = min(k, len(sims))
-    # Use argpartition for efficiency if k is much smaller than len(sims)
-    # top_idx = np.argsort(sims)[::-1][:actual_k]
-    if actual_k < len(sims) // 2 : # Heuristic for when argpartition is faster
-        top_idx = np.argpartition(sims, -actual_k)[-actual_k:]
-        # Need to sort the partitioned indices by similarity score
-        top_sims = sims[top_idx]
-        sorted_indices_of_top = np.argsort(top_sims)[::-1]
-        top_idx = top_idx[sorted_indices_of_top]
-    else: # Otherwise just sort all
-         top_idx = np.argsort(sims)[::-1][:actual_k]
-
-    top_pairs = []
-    for idx in top_idx:
+    top_items = []
+    for idx, score in zip(top_idx, top_sims):
         # Ensure index is valid
-        if idx < 0 or idx >= len(all_pairs):
-            logger.error(f"get_similar_pairs: Invalid index {idx} obtained during sorting.")
+        if idx < 0 or idx >= len(all_items):
+            logger.error(f"search_collection: Invalid index {idx} obtained during search.")
             continue
-        pair = all_pairs[idx]
-        score = float(sims[idx])
-        top_pairs.append({
-            "id": pair["id"],
-            "item1": pair["item1"],
-            "item2": pair["item2"],
-            "similarity": score # Include similarity score for debugging
+        top_items.append({
+            **all_items[idx],  # {id, *fields} from the columnar item store
+            "similarity": float(score), # Include similarity score for debugging
+            **({"lexical_score": round(float(lexical_scores[idx]), 4)} if lexical_scores is not None else {}),
         })
-    logger.debug(f"get_similar_pairs: Sorting and selection took {time.time() - sort_start:.2f}s.")
+
+    RESULT_CACHE.put(result_key, [dict(item) for item in top_items])
+    logger.debug(f"search_collection: Query cache stats: embeddings={QUERY_EMBEDDING_CACHE.stats()}, results={RESULT_CACHE.stats()}")
 
     # Final progress update
     await report_progress(4, total_steps, "Completed similarity search.")
-    logger.info(f"Exiting get_similar_pairs for '{input_text_log}'. Found {len(top_pairs)} similar pairs. Total duration: {time.time() - overall_start_time:.2f}s.")
-    return top_pairs
+    logger.info(f"Exiting search_collection[{collection}] for '{input_text}'. Found {len(top_items)} similar {collection}. Total duration: {time.time() - overall_start_time:.2f}s.")
+    return top_items
+
+
+async def get_similar_pairs_batch(pair_strings, k: int = 10):
+    """Returns [{"query": "Item1 vs Item2", "results": [top k pairs]}] for many pair strings at once."""
+    texts = [p.pair_string if isinstance(p, PairStringInput) else p for p in pair_strings]
+    return await search_collection_batch("pairs", texts, k)
+
+
+async def search_collection_batch(collection: str, texts, k: int = 10):
+    """Batched search_collection: one encode call for all uncached queries and one chunked
+    matrix-matrix scan with a vectorised per-query top-k, instead of one round per query."""
+    overall_start_time = time.time()
+    if CACHES[collection]["data"] is None:
+        await init_collection(collection)
+    sync_generation_soon(collection)
+    cache = snapshot(collection)
+    all_items, index = cache["data"], cache.get("index")
+    if not all_items or index is None or not texts:
+        logger.error(f"search_collection_batch: No {collection} with embeddings in cache (or no queries).")
+        return [{"query": text, "results": []} for text in texts]
+
+    keys = [normalize_query(text) for text in texts]
+    result_keys = {key: (collection, key, k, cache.get("generation"), cache.get("last_updated_timestamp")) for key in keys}
+    results = {key: RESULT_CACHE.get(result_keys[key]) for key in result_keys}
+    pending = [key for key, result in results.items() if result is None]
+    if pending:
+        embeddings = {key: QUERY_EMBEDDING_CACHE.get((MODEL_NAME, key)) for key in pending}
+        to_encode = [key for key, emb in embeddings.items() if emb is None]
+        if to_encode:
+            model = await load_model_async()
+            if model is None:
+                logger.error("search_collection_batch: Failed to load model.")
+                return [{"query": text, "results": []} for text in texts]
+            with stage("encode"):
+                encoded = await asyncio.get_running_loop().run_in_executor(None, lambda: EMBEDDING_CACHE.encode(model, to_encode))
+            for key, emb in zip(to_encode, np.asarray(encoded, dtype=np.float32)):
+                QUERY_EMBEDDING_CACHE.put((MODEL_NAME, key), emb)
+                embeddings[key] = emb
+        queries = normalize_rows(np.stack([embeddings[key] for key in pending]))
+        with stage("batch_search"):
+            top_sims, top_idx = index.search_batch(queries, k)
+        for key, sims, idxs in zip(pending, top_sims, top_idx):
+            results[key] = [{**all_items[i], "similarity": float(score)}
+                            for i, score in zip(idxs, sims) if 0 <= i < len(all_items)]
+            RESULT_CACHE.put(result_keys[key], [dict(item) for item in results[key]])
+    logger.info(f"search_collection_batch[{collection}]: {len(texts)} queries ({len(pending)} searched, {len(texts) - len(pending)} cached) in {time.time() - overall_start_time:.2f}s.")
+    return [{"query": text, "results": [dict(item) for item in results[key]]} for text, key in zip(texts, keys)]
+
+
+async def similar_by_id(collection: str, item_id: int, k: int = 10):
+    """The k items most similar to a cached item, from the neighbour graph (O(k), no model call; built on first use).
+    Falls back to an index search with the item's stored vector when there is no graph or k exceeds it."""
+    if CACHES[collection]["data"] is None:
+        await init_collection(collection)
+    sync_generation_soon(collection)
+    cache = await snapshot_with_graph(collection)
+    all_items, db_embs, index, graph = cache["data"], cache["db_embeddings"], cache.get("index"), cache["graph"]
+    row = all_items.row_of(item_id) if all_items else None
+    if row is None:
+        raise ValueError(f"No {collection} item with id {item_id} and an embedding in the cache.")
+    if graph is not None and k <= graph.k:
+        rows, sims = graph.neighbours_of(row, k)
+    else:
+        with stage("search"):
+            sims, rows = index.search(np.asarray(db_embs[row], dtype=np.float32), k + 1)
+        rows, sims = rows[rows != row][:k], sims[rows != row][:k]
+    return [{**all_items[r], "similarity": float(s)} for r, s in zip(rows, sims)]
+
+
+async def explore_by_id(collection: str, item_id: int, n: int = 10, walk_length: int = 3, seed=None):
+    """Related but diverse items: random walks over the neighbour graph from a cached item."""
+    if CACHES[collection]["data"] is None:
+        await init_collection(collection)
+    sync_generation_soon(collection)
+    cache = await snapshot_with_graph(collection)
+    all_items, db_embs, graph = cache["data"], cache["db_embeddings"], cache["graph"]
+    row = all_items.row_of(item_id) if all_items else None
+    if row is None or graph is None:
+        raise ValueError(f"No {collection} item with id {item_id} in the neighbour graph.")
+    walked = graph.random_walk(row, n, walk_length, seed=seed)
+    sims = np.asarray(db_embs[[r for r, _, _ in walked]]) @ np.asarray(db_embs[row]) if walked else []
+    return [{**all_items[r], "similarity": float(s), "hops": hops, "visits": visits}
+            for (r, visits, hops), s in zip(walked, sims)]
 
 
 async def main():
     # Initialize cache at startup
-    await init_cache(fetch_all_pairs_async)
+    await init_collection("pairs")
     # Test the optimized function
     test_start = time.time()
     top_pairs = await get_similar_pairs(pair_string="wirtualne vs cyfrowa", k=50)
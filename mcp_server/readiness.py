@@ -0,0 +1,57 @@
+import asyncio
+import time
+from config import logger
+
+# Per-capability readiness for non-blocking startup (see STARTUP_MODE in config.py).
+# - "crud": backend passthrough tools (news, topics, pair CRUD); ready as soon as the server runs
+# - "model": the embedding model; torch / sentence_transformers are only imported when it loads
+# - one entry per collection ("pairs", "topics"): cache loaded and vector index built
+# States go pending -> loading -> ready | failed. Warm-up and tool calls share in-flight loads through
+# single_flight(), so a vector tool called during warm-up waits for it instead of loading twice.
+
+PENDING, LOADING, READY, FAILED = "pending", "loading", "ready", "failed"
+
+_STATE = {}  # capability -> {"state", "since", "detail"}
+_INFLIGHT = {}  # key -> (event loop, task)
+
+
+def set_state(capability, state, detail=None):
+    previous = _STATE.get(capability, {}).get("state")
+    _STATE[capability] = {"state": state, "since": time.time(), "detail": detail}
+    if (previous or PENDING) != state:
+        logger.info(f"readiness: {capability} {previous or PENDING} -> {state}" + (f" ({detail})" if detail else ""))
+
+
+def get_state(capability):
+    return _STATE.get(capability, {}).get("state", PENDING)
+
+
+def is_ready(capability):
+    return get_state(capability) == READY
+
+
+def report():
+    """{capability: {state, seconds_in_state, detail}} plus an overall "ready" flag."""
+    now = time.time()
+    capabilities = {
+        name: {"state": entry["state"], "seconds_in_state": round(now - entry["since"], 3), "detail": entry["detail"]}
+        for name, entry in _STATE.items()
+    }
+    return {"ready": all(c["state"] == READY for c in capabilities.values()), "capabilities": capabilities}
+
+
+async def single_flight(key, factory):
+    """Runs `factory()` once per key at a time; concurrent callers await the same task.
+
+    Tasks are bound to the loop that started them, so a call from another loop (e.g. blocking
+    warm-up before mcp.run()) starts its own.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _INFLIGHT.get(key)
+    if entry is None or entry[0] is not loop or entry[1].done():
+        entry = _INFLIGHT[key] = (loop, loop.create_task(factory()))
+    # Shielded: a cancelled caller must not cancel the load other callers wait on
+    return await asyncio.shield(entry[1])
+
+
+set_state("crud", READY)
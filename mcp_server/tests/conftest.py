@@ -0,0 +1,37 @@
+import os
+import sys
+import pytest
+
+# Modules import each other by bare name (the server runs from mcp_server/), and config needs a key
+os.environ.setdefault("AI_AGENT_SECRET_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client
+import news_backfill
+import utils_cache
+from cache_state import CACHES, empty_cache
+from fake_backend import make_backend, StubEmbeddingModel
+from query_cache import QUERY_EMBEDDING_CACHE, RESULT_CACHE
+
+DIM = 32
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Cache files, checkpoints and the news store are written to the working directory."""
+    monkeypatch.chdir(tmp_path)
+    for cache in CACHES.values():
+        cache.update(empty_cache())
+    RESULT_CACHE.clear()
+    QUERY_EMBEDDING_CACHE.clear()
+    news_backfill._STORE = None
+    monkeypatch.setattr(utils_cache, "MODEL", StubEmbeddingModel(DIM))
+    return tmp_path
+
+
+@pytest.fixture
+def backend():
+    """Fake backend with 2000 embedded pairs, 10 topics and 600 news records behind the shared client."""
+    fake = make_backend(2000, DIM, n_topics=10, n_news=600)
+    http_client.set_transport(fake.transport())
+    return fake
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import httpx
+import numpy as np
+import pytest
+import bulk_writer
+import http_client
+import rag
+from backfill import run_embedding_backfill, load_checkpoint, checkpoint_path
+from cache_state import CACHES
+from config import BACKFILL_PAGE_SIZE
+from conftest import DIM
+from fake_backend import make_backend, StubEmbeddingModel
+
+
+@pytest.fixture
+def patches(monkeypatch):
+    """Backend with 10% of its pairs embedded; PATCH statuses can be scripted through `patches["statuses"]`."""
+    monkeypatch.setattr(bulk_writer, "BULK_RETRY_BACKOFF_SECONDS", 0)
+    fake = make_backend(1000, DIM, n_topics=10, embedded_fraction=0.1)
+    state = {"backend": fake, "statuses": [], "sent": []}
+
+    async def handler(request):
+        if request.method == "PATCH":
+            status = state["statuses"].pop(0) if state["statuses"] else 200
+            if status != 200:
+                return httpx.Response(status, text="refused")
+            state["sent"].append(request)
+        return await fake.handle(request)
+
+    http_client.set_transport(httpx.MockTransport(handler))
+    return state
+
+
+def embedded(backend):
+    return int((~np.isnan(backend.pair_embeddings[:, 0])).sum())
+
+
+def backfill(**kwargs):
+    return asyncio.run(run_embedding_backfill("pairs", "/contrast-pairs/", "/contrast-pairs/update/", lambda p: p["item1"],
+                                              StubEmbeddingModel(DIM), batch_size=100, upload_concurrency=1, **kwargs))
+
+
+def test_backfill_uploads_only_items_without_embedding(patches):
+    missing = 1000 - embedded(patches["backend"])
+    assert len(backfill()) == missing
+    assert embedded(patches["backend"]) == 1000
+    assert not os.path.exists(checkpoint_path("pairs"))
+    assert backfill() == []
+
+
+def test_transient_upload_failure_is_retried(patches):
+    missing = 1000 - embedded(patches["backend"])
+    patches["statuses"] = [503]
+    assert len(backfill()) == missing
+    assert embedded(patches["backend"]) == 1000
+
+
+def test_interrupted_backfill_resumes_from_its_checkpoint(patches):
+    patches["statuses"] = [200, 200] + [401] * 20  # Third batch on: refused (not retried)
+    assert len(backfill(known_ids=set())) == 200
+    assert len(load_checkpoint("pairs")) == 200
+    with open(checkpoint_path("pairs"), "a", encoding="utf-8") as f:
+        f.write('{"done_ids": [1, 2')  # Torn last line of an interrupted append
+    patches["statuses"] = []
+    patches["sent"].clear()
+    rows = backfill(known_ids=set())
+    assert len(rows) == 800
+    assert not {r["item"]["id"] for r in rows} & load_checkpoint("pairs")
+    assert not os.path.exists(checkpoint_path("pairs"))
+
+
+def test_stale_local_cache_falls_back_to_fetching_embeddings(patches):
+    backend = patches["backend"]
+    backend.topic_embeddings[:] = backend.topic_embeddings[0]  # Every topic embedded
+    asyncio.run(rag.init_collection("topics"))
+    assert len(CACHES["topics"]["data"]) == 10
+    # Added and embedded by another process after the local cache was built
+    backend.topics.append({"id": 11, "name": "zz", "source": "agent"})
+    backend._topic_row[11] = 10
+    backend.topic_embeddings = np.concatenate([backend.topic_embeddings, backend.topic_embeddings[:1]])
+    assert asyncio.run(rag.generate_embeddings_for_topics()) == 0
+    assert patches["sent"] == []
+
+
+def test_current_local_cache_skips_embedding_payload(patches):
+    asyncio.run(rag.init_collection("pairs"))
+    missing = 1000 - embedded(patches["backend"])
+    pages = []
+    http_client.set_transport(httpx.MockTransport(lambda request: pages.append(request) or patches["backend"].handle(request)))
+    assert asyncio.run(rag.generate_embeddings_for_contrasting()) == missing
+    backfill_pages = [r for r in pages if r.method == "GET" and r.url.params.get("count") == str(BACKFILL_PAGE_SIZE)]
+    assert backfill_pages and all("vector_embedding" not in r.url.params for r in backfill_pages)
+    assert len(CACHES["pairs"]["data"]) == 1000
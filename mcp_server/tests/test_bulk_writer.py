@@ -0,0 +1,81 @@
+import asyncio
+import json
+import httpx
+import pytest
+import http_client
+from bulk_writer import bulk_write
+
+BAD_ITEM = 7
+
+
+def serve(status_of):
+    """Transport answering every chunk with status_of(items) -> status or (status, error body); returns the chunk sizes it saw."""
+    sizes = []
+
+    def handler(request):
+        items = json.loads(request.content)["items"]
+        sizes.append(len(items))
+        status = status_of(items)
+        status, error = status if isinstance(status, tuple) else (status, {"error": "refused"})
+        return httpx.Response(status, json={"n": len(items)} if status < 400 else error)
+
+    http_client.set_transport(httpx.MockTransport(handler))
+    return sizes
+
+
+def write(idempotent):
+    return asyncio.run(bulk_write("POST", "/items/", "items", list(range(100)), idempotent=idempotent, max_items=10))
+
+
+def test_idempotent_400_bisects_down_to_the_bad_item():
+    sizes = serve(lambda items: 400 if BAD_ITEM in items else 200)
+    merged, failed = write(idempotent=True)
+    assert merged == {"n": 99}
+    assert [f["index"] for f in failed] == [BAD_ITEM]
+    assert min(sizes) == 1
+
+
+def test_create_400_is_bisected_too():
+    serve(lambda items: 400 if BAD_ITEM in items else 200)
+    merged, failed = write(idempotent=False)
+    assert merged == {"n": 99}
+    assert [f["index"] for f in failed] == [BAD_ITEM]
+
+
+def test_per_item_errors_fail_only_the_flagged_items():
+    def status_of(items):
+        if BAD_ITEM not in items:
+            return 201
+        return 400, {"items": [{"item": ["invalid"]} if item == BAD_ITEM else {} for item in items]}
+
+    sizes = serve(status_of)
+    merged, failed = write(idempotent=False)
+    assert merged == {"n": 99}
+    assert [(f["index"], f["error"]) for f in failed] == [(BAD_ITEM, {"item": ["invalid"]})]
+    assert sorted(sizes) == [9] + [10] * 10  # One resend of the 9 good items, no bisection
+
+
+def test_partly_applied_rejection_is_not_resent():
+    sizes = serve(lambda items: (400, {"errors": ["pair 7 does not exist"], "updated_count": 7}) if BAD_ITEM in items else 200)
+    merged, failed = write(idempotent=False)
+    assert merged == {"n": 90}
+    assert [f["index"] for f in failed] == list(range(10))
+    assert sizes == [10] * 10
+
+
+def test_401_before_any_write_raises():
+    sizes = serve(lambda items: 401)
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        write(idempotent=True)
+    assert error.value.response.status_code == 401
+    assert len(sizes) == 1
+
+
+def test_401_after_partial_success_reports_what_was_written():
+    sizes = serve(lambda items: 200 if len(sizes) <= 2 else 401)
+    merged, failed = asyncio.run(bulk_write("POST", "/items/", "items", list(range(100)), idempotent=False,
+                                            max_items=10, max_concurrent=1))
+    assert merged == {"n": 20}
+    assert [f["index"] for f in failed] == list(range(20, 100))
+    assert {f["status"] for f in failed} == {401}
+    assert len(sizes) == 3
@@ -0,0 +1,85 @@
+import asyncio
+from unittest import mock
+import numpy as np
+import pytest
+import rag
+import utils_cache
+from cache_state import CACHES
+from corpus_builder import CorpusBuilder, DeltaWindowExceeded, sync_window
+from corpus_fetch import fetch_new_pairs_async
+from fake_backend import encode_embedding
+from utils_cache import apply_cache_delta, build_snapshot, load_cache_from_file
+
+
+def test_empty_delta_keeps_saved_artifacts(backend):
+    asyncio.run(rag.init_collection("pairs"))
+    before = dict(CACHES["pairs"])
+
+    assert apply_cache_delta([], max_seen_id=10 ** 6)
+
+    after = CACHES["pairs"]
+    assert after["last_updated_timestamp"] > before["last_updated_timestamp"]
+    assert after["artifact_stamp"] == before["artifact_stamp"]
+    assert after["max_seen_id"] == 10 ** 6
+    # A reload finds the codes, index and lexical index saved for the unchanged rows
+    loaded = load_cache_from_file("pairs")
+    with mock.patch("utils_cache.build_index", side_effect=AssertionError("index rebuilt")), \
+         mock.patch("embedding_store.EmbeddingStore.build", side_effect=AssertionError("codes rebuilt")), \
+         mock.patch("lexical_index.LexicalIndex.build", side_effect=AssertionError("lexical index rebuilt")):
+        fresh = build_snapshot(loaded, "pairs")
+    assert len(fresh["index"]) == len(before["data"])
+
+
+def test_delta_rechecks_items_without_embedding(backend):
+    missing_row = 1989  # Item id 1990
+    vector = backend.pair_embeddings[missing_row].copy()
+    backend.pair_embeddings[missing_row] = np.nan
+    applied = []
+
+    async def run():
+        await rag.init_collection("pairs")
+        cache = CACHES["pairs"]
+        assert cache["data"].row_of(1990) is None
+        assert cache["max_seen_id"] == 2000 and cache["pending_ids"] == [1990]
+        backend.pair_embeddings[missing_row] = vector  # Backfilled by another process
+        with mock.patch("utils_cache.apply_cache_delta", side_effect=lambda rows, *a: applied.extend(rows) or apply_cache_delta(rows, *a)):
+            await rag.refresh_collection("pairs")
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache["data"].row_of(1990) is not None
+    assert cache["pending_ids"] == []
+    # Rows above the pending item that were cached already are not re-applied
+    assert [row["id"] for row in applied] == [1990]
+
+
+def test_pending_items_hold_the_delta_back_only_so_far():
+    assert sync_window(2000, [10, 1995], max_holdback=100) == (1994, [1995])
+    assert sync_window(2000, [], max_holdback=100) == (2000, [])
+    corpus = CorpusBuilder().add_page([{"id": i, "item1": "a", "item2": "b", "vector_embedding": None} for i in (1, 10000)])
+    assert corpus.max_seen_id == 10000 and corpus.pending_ids == [10000]
+
+
+def test_decode_errors_are_not_pending():
+    corpus = CorpusBuilder().add_page([
+        {"id": 1, "item1": "a", "item2": "b", "vector_embedding": encode_embedding(np.ones(4))},
+        {"id": 2, "item1": "c", "item2": "d", "vector_embedding": "not base64!"},
+        {"id": 3, "item1": "e", "item2": "f", "vector_embedding": None},
+    ])
+    assert corpus.decode_errors == 1
+    assert corpus.max_seen_id == 3 and corpus.pending_ids == [3]
+
+
+def test_delta_walk_past_the_page_cap_runs_a_full_refresh(backend):
+    fetch_all, _ = rag.COLLECTION_FETCHERS["pairs"]
+
+    async def run():
+        await rag.init_collection("pairs")
+        with pytest.raises(DeltaWindowExceeded):
+            await fetch_new_pairs_async(0, count=100, max_pages=3)
+        with mock.patch("utils_cache.update_cache", wraps=utils_cache.update_cache) as full:
+            await utils_cache.delta_update_cache(lambda since_id: fetch_new_pairs_async(since_id - 1000, count=100, max_pages=3),
+                                                 fetch_all, "pairs")
+        return full
+
+    assert asyncio.run(run()).called
@@ -0,0 +1,58 @@
+import asyncio
+import os
+from unittest import mock
+import numpy as np
+import cache_format
+import cache_sharing
+import rag
+from cache_format import write_cache, read_cache, generation_path
+from cache_state import CACHES, empty_cache
+from utils_cache import apply_cache_delta
+
+PREFIX = "shared"
+
+
+def write_generation(n):
+    items = [{"id": i + 1, "item1": f"a{i}", "item2": f"b{i}"} for i in range(n)]
+    return write_cache(PREFIX, items, np.eye(n, 4, dtype=np.float32), "model", float(n))
+
+
+def test_previous_generation_is_kept():
+    for n in (1, 2, 3):
+        write_generation(n)
+    assert not os.path.exists(generation_path(PREFIX, 1, ".npy"))
+    assert os.path.exists(generation_path(PREFIX, 2, ".npy")) and os.path.exists(generation_path(PREFIX, 3, ".npy"))
+
+
+def test_reader_of_a_removed_generation_opens_the_newer_one():
+    stale = write_generation(1)
+    write_generation(2)
+    write_generation(3)  # Removes generation 1
+    headers = [stale]
+    real_read_header = cache_format.read_header
+    with mock.patch("cache_format.read_header", side_effect=lambda prefix: headers.pop() if headers else real_read_header(prefix)):
+        header, items, embeddings = read_cache(PREFIX, "model")
+    assert header["generation"] == 3 and len(items) == 3
+
+
+def test_follower_attaches_to_and_follows_the_owner(backend, monkeypatch):
+    monkeypatch.setattr(cache_sharing, "CACHE_ROLE", "owner")
+    asyncio.run(rag.init_collection("pairs"))
+    owner = dict(CACHES["pairs"])
+    requests = backend.requests
+
+    # Another process: attaches to the owner's generation without calling the backend
+    monkeypatch.setattr(cache_sharing, "CACHE_ROLE", "follower")
+    CACHES["pairs"].update(empty_cache())
+    asyncio.run(rag.init_collection("pairs"))
+    follower = dict(CACHES["pairs"])
+    assert follower["generation"] == owner["generation"] and len(follower["data"]) == 2000
+    assert backend.requests == requests
+
+    # The owner publishes a delta, the follower picks up the new generation
+    CACHES["pairs"].update(owner)
+    apply_cache_delta([{"id": 2001, "item1": "new", "item2": "pair", "embedding": np.ones(32, dtype=np.float32)}], max_seen_id=2001)
+    CACHES["pairs"].update(follower)
+    assert cache_sharing.sync_generation("pairs", force=True)
+    assert CACHES["pairs"]["generation"] == owner["generation"] + 1
+    assert CACHES["pairs"]["data"].row_of(2001) is not None
@@ -0,0 +1,46 @@
+import asyncio
+import httpx
+import pytest
+import corpus_fetch
+import http_client
+import rag
+from cache_state import CACHES
+
+
+@pytest.fixture
+def flaky(backend, monkeypatch):
+    """Backend whose page 3 fails `failures["left"]` times (5xx) before it is served."""
+    monkeypatch.setattr(corpus_fetch, "BULK_RETRY_BACKOFF_SECONDS", 0)
+    failures = {"left": 0}
+
+    async def handler(request):
+        if request.url.params.get("page") == "3" and failures["left"] > 0:
+            failures["left"] -= 1
+            return httpx.Response(502, text="bad gateway")
+        return await backend.handle(request)
+
+    http_client.set_transport(httpx.MockTransport(handler))
+    return failures
+
+
+def test_failed_page_is_retried(flaky):
+    flaky["left"] = 2
+    corpus = asyncio.run(corpus_fetch.stream_corpus_async(count=100))
+    assert flaky["left"] == 0
+    assert corpus.n_fetched == 2000 and corpus.max_seen_id == 2000
+
+
+def test_page_failing_every_retry_keeps_the_previous_cache(flaky):
+    async def run():
+        await rag.init_collection("pairs")
+        before = CACHES["pairs"]["version"]
+        flaky["left"] = 100
+        fetch_all, _ = rag.COLLECTION_FETCHERS["pairs"]
+        with pytest.raises(RuntimeError, match="failed after retries"):
+            await corpus_fetch.stream_corpus_async(count=100)
+        await rag.update_cache(fetch_all, "pairs")
+        return before
+
+    before = asyncio.run(run())
+    assert CACHES["pairs"]["version"] == before
+    assert len(CACHES["pairs"]["data"]) == 2000
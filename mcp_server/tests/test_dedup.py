@@ -0,0 +1,42 @@
+import asyncio
+import httpx
+import rag
+import http_client
+from dedup import filter_duplicate_pairs, duplicate_groups
+from fake_backend import StubEmbeddingModel
+from conftest import DIM
+
+
+def test_filter_without_cache_file_checks_the_corpus(backend):
+    backend.pair_embeddings[4] = StubEmbeddingModel(DIM).encode(["fire vs water"])[0]  # Pair id 5
+    first = backend.pairs[0]
+    candidates = [
+        {"item1": first["item2"].upper(), "item2": first["item1"]},  # Reversal of pair 1
+        {"item1": "fire", "item2": "water"},
+        {"item1": "brand", "item2": "new"},
+        {"item1": "new", "item2": "brand"},
+        {"item1": "", "item2": "x"},
+    ]
+    accepted, rejected, corpus_checked = asyncio.run(filter_duplicate_pairs(candidates))
+    assert corpus_checked
+    assert accepted == [{"item1": "brand", "item2": "new"}]
+    assert sorted((r["reason"], r.get("match", {}).get("id") or 0) for r in rejected) == [
+        ("exists", 1), ("invalid", 0), ("near_duplicate", 5), ("repeated_in_batch", 0)]
+
+
+def test_filter_says_when_the_corpus_could_not_be_checked():
+    http_client.set_transport(httpx.MockTransport(lambda request: httpx.Response(404, json={"error": "down"})))
+    accepted, rejected, corpus_checked = asyncio.run(filter_duplicate_pairs([{"item1": "a", "item2": "b"}, {"item1": "b", "item2": "a"}]))
+    assert not corpus_checked
+    assert accepted == [{"item1": "a", "item2": "b"}]
+    assert [r["reason"] for r in rejected] == ["repeated_in_batch"]
+
+
+def test_duplicate_groups_exact_and_ann_agree(backend):
+    backend.pair_embeddings[[10, 11, 12]] = backend.pair_embeddings[10]  # Ids 11-13
+    backend.pair_embeddings[100] = backend.pair_embeddings[200]  # Ids 101 and 201
+    asyncio.run(rag.init_collection("pairs"))
+    for method in ("exact", "ann"):
+        groups = duplicate_groups("pairs", threshold=0.9999, method=method)
+        assert [sorted(item["id"] for item in group["items"]) for group in groups[:2]] == [[11, 12, 13], [101, 201]]
+        assert groups[0]["size"] == 3
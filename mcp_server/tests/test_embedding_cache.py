@@ -0,0 +1,50 @@
+import sqlite3
+import numpy as np
+from embedding_cache import EmbeddingCache, _ROW_OVERHEAD_BYTES
+from fake_backend import StubEmbeddingModel
+
+DIM = 8
+
+
+class CountingModel(StubEmbeddingModel):
+    def __init__(self, dim, cache_id=None):
+        super().__init__(dim)
+        self.cache_id = cache_id or self.cache_id
+        self.encoded = 0
+
+    def encode(self, texts, **kwargs):
+        self.encoded += len(texts)
+        return super().encode(texts, **kwargs)
+
+
+def entries(prefix, n):
+    return [(EmbeddingCache.key("m", f"{prefix}{i}"), np.full(DIM, i, dtype=np.float32)) for i in range(n)]
+
+
+def rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def test_encode_reuses_stored_vectors_per_model():
+    cache, model = EmbeddingCache("emb.sqlite"), CountingModel(DIM)
+    first = cache.encode(model, ["kot vs pies", " kot  vs pies", "dzień vs noc"])
+    assert model.encoded == 2  # Normalised duplicates are encoded once
+    assert np.array_equal(EmbeddingCache("emb.sqlite").encode(model, ["dzień vs noc", "kot vs pies"]), first[[2, 0]])
+    assert model.encoded == 2
+    other = CountingModel(DIM, cache_id="other-backend")
+    cache.encode(other, ["kot vs pies"])
+    assert other.encoded == 1
+
+
+def test_eviction_counts_rows_written_by_other_processes():
+    a, b = EmbeddingCache("emb.sqlite"), EmbeddingCache("emb.sqlite")
+    for cache in (a, b):
+        cache.max_bytes = 100 * (DIM * 4 + _ROW_OVERHEAD_BYTES)  # 100 rows
+        cache.get_many([b"connect"])  # Both open the file while it is empty
+    a.put_many(entries("a", 60))
+    a.get_many([key for key, _ in entries("a", 10)])  # Recently used, kept
+    b.put_many(entries("b", 60))
+    assert rows("emb.sqlite") == 90
+    assert len(b.get_many([key for key, _ in entries("b", 60)])) == 60
+    assert len(a.get_many([key for key, _ in entries("a", 10)])) == 10
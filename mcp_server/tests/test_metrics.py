@@ -0,0 +1,47 @@
+import asyncio
+import urllib.request
+import pytest
+import metrics
+import rag
+from metrics import timed_tool, snapshot, render_prometheus, start_metrics_server
+
+
+def test_timed_tool_records_latency_and_errors():
+    @timed_tool
+    async def metrics_test_tool(fail=False):
+        await asyncio.sleep(0.01)
+        if fail:
+            raise ValueError("boom")
+        return "ok"
+
+    assert asyncio.run(metrics_test_tool()) == "ok"
+    with pytest.raises(ValueError):
+        asyncio.run(metrics_test_tool(fail=True))
+    stats = snapshot()
+    latency = stats["histograms"]["tool_seconds"]["tool=metrics_test_tool"]
+    assert latency["count"] == 2 and latency["sum_s"] >= 0.02
+    assert 5 <= latency["p50_ms"] <= latency["p99_ms"]
+    assert stats["counters"]["tool_errors_total"]["tool=metrics_test_tool"] == 1
+
+
+def test_search_stages_and_gauges_are_reported(backend):
+    asyncio.run(rag.get_similar_pairs("ogień vs woda", k=5))
+    stats = snapshot()
+    assert {"stage=encode", "stage=search"} <= set(stats["histograms"]["stage_seconds"])
+    assert stats["gauges"]["process_max_rss_bytes"]["all"] > 0
+
+
+def test_prometheus_endpoint_serves_the_same_series():
+    metrics.observe("metrics_test_seconds", 0.003, tool="x")
+    metrics.observe("metrics_test_seconds", 7.0, tool="x")
+    text = render_prometheus()
+    assert 'mcp_metrics_test_seconds_bucket{tool="x",le="0.005"} 1' in text
+    assert 'mcp_metrics_test_seconds_bucket{tool="x",le="+Inf"} 2' in text
+    assert 'mcp_metrics_test_seconds_count{tool="x"} 2' in text
+    server = start_metrics_server(0)
+    try:
+        host, port = server.server_address[:2]
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as resp:
+            assert resp.status == 200 and 'mcp_metrics_test_seconds_count{tool="x"} 2' in resp.read().decode("utf-8")
+    finally:
+        server.shutdown()
@@ -0,0 +1,50 @@
+import asyncio
+import os
+from unittest import mock
+import numpy as np
+import rag
+from cache_state import CACHES
+from neighbour_graph import NeighbourGraph
+from utils_cache import apply_cache_delta, _graph_path
+
+
+def brute_force(item_id, k):
+    cache = CACHES["pairs"]
+    vectors = np.asarray(cache["db_embeddings"])
+    row = cache["data"].row_of(item_id)
+    scores = vectors @ vectors[row]
+    scores[row] = -np.inf
+    return [int(cache["data"].ids[r]) for r in np.argsort(-scores)[:k]]
+
+
+def test_graph_is_built_on_first_use_and_saved(backend):
+    asyncio.run(rag.init_collection("pairs"))
+    assert CACHES["pairs"]["graph"] is None
+    similar = asyncio.run(rag.similar_by_id("pairs", 42, k=10))
+    graph = CACHES["pairs"]["graph"]
+    assert graph is not None and os.path.exists(_graph_path(CACHES["pairs"], "pairs"))
+    expected = brute_force(42, 10)
+    assert len({item["id"] for item in similar} & set(expected)) >= 9
+    assert 42 not in {item["id"] for item in similar}
+    assert [item["similarity"] for item in similar] == sorted((item["similarity"] for item in similar), reverse=True)
+    # A restart picks up the saved graph instead of building it again
+    with mock.patch.object(NeighbourGraph, "build", side_effect=AssertionError("graph rebuilt")):
+        CACHES["pairs"]["graph"] = None
+        assert [item["id"] for item in asyncio.run(rag.similar_by_id("pairs", 42, k=10))] == [item["id"] for item in similar]
+
+
+def test_delta_rows_join_the_graph(backend):
+    asyncio.run(rag.similar_by_id("pairs", 42, k=5))
+    vector = np.asarray(CACHES["pairs"]["db_embeddings"][CACHES["pairs"]["data"].row_of(42)])
+    apply_cache_delta([{"id": 2001, "item1": "new", "item2": "twin", "embedding": vector}], max_seen_id=2001)
+    assert CACHES["pairs"]["graph"] is not None
+    similar = asyncio.run(rag.similar_by_id("pairs", 42, k=5))
+    assert similar[0]["id"] == 2001 and similar[0]["similarity"] > 0.999
+    assert asyncio.run(rag.similar_by_id("pairs", 2001, k=1))[0]["id"] == 42
+
+
+def test_explore_walks_away_from_the_start(backend):
+    walked = asyncio.run(rag.explore_by_id("pairs", 42, n=8, seed=7))
+    assert len(walked) == 8 and 42 not in {item["id"] for item in walked}
+    assert all(item["hops"] >= 1 and item["visits"] >= 1 for item in walked)
+    assert walked == asyncio.run(rag.explore_by_id("pairs", 42, n=8, seed=7))
@@ -0,0 +1,57 @@
+import asyncio
+from news_backfill import get_news_local
+from news_store import NewsStore, merge_intervals, subtract_intervals, parse_time
+from fake_backend import make_news
+
+DAY = 24 * 3600
+
+
+def test_interval_helpers():
+    assert merge_intervals([[5, 7], [0, 2], [1, 3], [7, 9]]) == [[0, 3], [5, 9]]
+    assert subtract_intervals(0, 10, [[2, 4], [6, 7]]) == [(0, 2), (4, 6), (7, 10)]
+    assert subtract_intervals(3, 5, [[0, 10]]) == []
+    assert subtract_intervals(0, 10, []) == [(0, 10)]
+
+
+def test_coverage_gaps_per_type_and_settle_window():
+    store = NewsStore("news").load()
+    store.add([], covered=(0, 10 * DAY), fetched_at=100 * DAY)
+    store.add([], covered=(20 * DAY, 30 * DAY), news_type="sport", fetched_at=100 * DAY)
+    assert store.missing(5 * DAY, 25 * DAY) == [(10 * DAY, 25 * DAY)]
+    assert store.missing(5 * DAY, 25 * DAY, "sport") == [(10 * DAY, 20 * DAY)]
+    # Ranges ending within the settle window are only covered up to it, so recent days are fetched again
+    store.add([], covered=(40 * DAY, 50 * DAY), fetched_at=50 * DAY)
+    assert store.missing(40 * DAY, 50 * DAY) == [(48 * DAY, 50 * DAY)]
+    # Coverage is persisted
+    assert NewsStore("news").load().coverage == store.coverage
+
+
+def test_store_reloads_appends_incrementally():
+    records = make_news(300)
+    store = NewsStore("news").load()
+    store.add(records[:200])
+    other = NewsStore("news").load()  # Another process
+    other.add(records[200:] + [{**records[0], "news_source": "sport"}])
+    store.load()
+    assert len(store.records) == 300
+    start, end = parse_time(records[0]["start_date"]), parse_time(records[-1]["end_date"])
+    # Records with the same start_date may come in any order
+    assert {r["id"] for r in store.query(start, end)} == {r["id"] for r in NewsStore("news").load().query(start, end)} == set(store.records)
+    assert records[0]["id"] in {r["id"] for r in store.query(start, end, "sport")}
+
+
+def test_get_news_fetches_only_missing_ranges(backend):
+    def fetch(start_time, end_time, news_type=None):
+        before = backend.requests
+        news = asyncio.run(get_news_local(start_time, end_time, news_type))
+        return news, backend.requests - before
+
+    news, requests = fetch("2024-06-01T00:00:00Z", "2024-07-01T00:00:00Z")
+    assert requests == 1
+    expected = backend._news({"start_time": "2024-06-01T00:00:00Z", "end_time": "2024-07-01T00:00:00Z"})
+    assert [r["id"] for r in news] == [r["id"] for r in expected]
+    assert fetch("2024-06-10T00:00:00Z", "2024-06-20T00:00:00Z", "sport")[1] == 0
+    # Only the two uncovered ends of a wider range are requested
+    news, requests = fetch("2024-05-15T00:00:00Z", "2024-07-15T00:00:00Z")
+    assert requests == 2
+    assert len(news) == len(backend._news({"start_time": "2024-05-15T00:00:00Z", "end_time": "2024-07-15T00:00:00Z"}))
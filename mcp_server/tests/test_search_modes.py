@@ -0,0 +1,51 @@
+import asyncio
+import numpy as np
+import rag
+from cache_state import snapshot
+from config import LEXICAL_HYBRID_CANDIDATES
+from lexical_index import LexicalIndex, rrf_fuse
+
+
+def test_rrf_prefers_rows_ranked_well_by_both():
+    rows, scores = rrf_fuse([np.array([1, 2, 3]), np.array([3, 2, 4])], k=4)
+    # 3 (ranks 3 and 1) just beats 2 (ranks 2 and 2); rows found by one ranking come last
+    assert rows.tolist() == [3, 2, 1, 4]
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_prefilter_only_for_selective_queries():
+    texts = [f"kot vs pies {i}" for i in range(50)] + ["ogień vs woda", "ogień vs ziemia"]
+    lexical = LexicalIndex.build(texts)
+    rows = lexical.prefilter_rows(lexical.scores("ogień"))
+    assert set(rows.tolist()) == {50, 51}
+    assert lexical.prefilter_rows(lexical.scores("kot pies"), max_rows=10) is None
+    assert lexical.prefilter_rows(lexical.scores("xyz"), max_rows=10) is None
+
+
+def test_prefilter_mode_scores_only_lexical_candidates(backend):
+    async def run():
+        await rag.init_collection("pairs")
+        return await rag.search_collection("pairs", "word7 vs word12", k=5, mode="prefilter")
+
+    results = asyncio.run(run())
+    cache = snapshot("pairs")
+    candidates = cache["lexical"].prefilter_rows(cache["lexical"].scores("word7 vs word12"))
+    assert candidates is not None
+    allowed = {int(cache["data"].ids[row]) for row in candidates}
+    assert results and {item["id"] for item in results} <= allowed
+    assert [item["similarity"] for item in results] == sorted((item["similarity"] for item in results), reverse=True)
+
+
+def test_hybrid_mode_is_rrf_of_dense_and_lexical(backend):
+    query, n = "word3 vs word40", LEXICAL_HYBRID_CANDIDATES
+
+    async def run():
+        await rag.init_collection("pairs")
+        dense = await rag.search_collection("pairs", query, k=n, mode="dense")
+        lexical = await rag.search_collection("pairs", query, k=n, mode="lexical")
+        hybrid = await rag.search_collection("pairs", query, k=10, mode="hybrid")
+        return dense, lexical, hybrid
+
+    dense, lexical, hybrid = asyncio.run(run())
+    expected, _ = rrf_fuse([np.array([item["id"] for item in dense]), np.array([item["id"] for item in lexical])], k=10)
+    assert [item["id"] for item in hybrid] == expected.tolist()
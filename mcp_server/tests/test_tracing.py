@@ -0,0 +1,65 @@
+import asyncio
+import time
+import pytest
+import tracing
+from metrics import stage, timed_tool
+from tracing import run_traced, span, traced_call
+
+
+@pytest.fixture
+def settings(monkeypatch, tmp_path):
+    """Tracing switches restored after the test; profiles written to the test's directory."""
+    monkeypatch.setattr(tracing, "PROFILE_DIR", tmp_path / "profiles")
+    for key, value in list(tracing._SETTINGS.items()):
+        monkeypatch.setitem(tracing._SETTINGS, key, value)
+    return tracing._SETTINGS
+
+
+def test_spans_nest_and_follow_work_into_the_executor():
+    def blocking():
+        with span("in_executor"):
+            time.sleep(0.01)
+
+    async def call():
+        with traced_call("tracing_test") as trace:
+            with stage("outer"):
+                with span("inner"):
+                    pass
+                await run_traced(blocking)
+        return trace
+
+    trace = asyncio.run(call())
+    spans = {name: depth for name, _, _, depth in trace.spans}
+    assert spans == {"outer": 0, "inner": 1, "in_executor": 1}
+    assert "in_executor=" in trace.breakdown() and trace.elapsed >= 0.01
+    with span("outside_a_call"):  # No trace: nothing recorded, nothing raised
+        pass
+
+
+def test_slow_calls_are_kept_and_counted(settings):
+    tracing.configure(slow_request_seconds=0.005)
+
+    @timed_tool
+    async def tracing_slow_tool():
+        with stage("slow_stage"):
+            await asyncio.sleep(0.01)
+
+    asyncio.run(tracing_slow_tool())
+    slow = tracing.status()["recent_slow_requests"][-1]
+    assert slow["tool"] == "tracing_slow_tool" and slow["spans"][0]["name"] == "slow_stage"
+
+
+def test_profiles_next_calls_on_demand(settings):
+    written = tracing.status()["profiles_written"]
+    tracing.configure(profile_next_calls=1)
+
+    @timed_tool
+    async def tracing_profiled_tool():
+        await asyncio.sleep(0)
+
+    asyncio.run(tracing_profiled_tool())
+    asyncio.run(tracing_profiled_tool())
+    status = tracing.status()
+    assert status["profile_next_calls"] == 0 and status["profiles_written"] == written + 1
+    profiles = list((tracing.PROFILE_DIR).glob("*_tracing_profiled_tool_*"))
+    assert sorted(p.suffix for p in profiles) == [".prof", ".txt"]
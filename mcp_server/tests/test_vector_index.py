@@ -0,0 +1,45 @@
+import numpy as np
+from embedding_store import EmbeddingStore
+from fake_backend import make_embeddings
+from vector_index import FlatIPIndex, IVFIndex, normalize_rows
+
+N, DIM, K = 20000, 32, 10
+
+
+def make_store(vectors):
+    store = EmbeddingStore(lambda: vectors, len(vectors), vectors.shape[1])
+    store.build()
+    return store
+
+
+def recall(index, exact, queries):
+    hits = 0
+    for query in queries:
+        _, rows = index.search(query, K)
+        _, expected = exact.search(query, K)
+        hits += len(set(rows.tolist()) & set(expected.tolist()))
+    return hits / (K * len(queries))
+
+
+def test_ivf_recall_against_flat_search():
+    vectors = make_embeddings(N, DIM)
+    store = make_store(vectors)
+    rng = np.random.default_rng(1)
+    queries = normalize_rows(vectors[rng.integers(0, N, 100)] + 0.05 * rng.standard_normal((100, DIM)).astype(np.float32))
+    ivf, flat = IVFIndex.build(store), FlatIPIndex(store)
+    assert np.diff(ivf.offsets).sum() == N
+    assert recall(ivf, flat, queries) >= 0.9
+    assert recall(ivf, flat, queries[:20]) <= recall(IVFIndex(store, ivf.centroids, ivf.order, ivf.offsets, nprobe=len(ivf.centroids)), flat, queries[:20])
+
+
+def test_ivf_apply_rows_makes_new_rows_searchable():
+    vectors = make_embeddings(N, DIM)
+    ivf = IVFIndex.build(make_store(vectors))
+    new = normalize_rows(np.random.default_rng(2).standard_normal((5, DIM)).astype(np.float32))
+    grown = np.concatenate([vectors, new])
+    ivf.store = make_store(grown)
+    ivf.apply_rows(np.arange(N, N + 5), new)
+    assert np.diff(ivf.offsets).sum() == N + 5
+    for i, vector in enumerate(new):
+        _, rows = ivf.search(vector, 1)
+        assert rows[0] == N + i
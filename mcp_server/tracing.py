@@ -0,0 +1,163 @@
+import asyncio
+import cProfile
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from config import logger, TRACE_SLOW_REQUEST_SECONDS, PROFILE_NEXT_CALLS, PROFILE_SLOW_SECONDS, PROFILE_DIR
+
+# Per-request trace spans and on-demand profiling of MCP tool calls.
+# - metrics.timed_tool opens a trace per tool call; span() records named, nested spans into the trace of
+#   the current request (a context variable, so concurrent requests and the tasks they start stay apart).
+#   metrics.stage() opens a span for every stage (model_load, cache_load, encode, search, http, ...).
+# - Calls slower than the slow-request threshold are logged with their spans and kept in a small ring
+#   buffer (status()), so a slow call shows where its time went without raising the log level.
+# - Profiling (cProfile) for the next N calls, and/or for every call with only the profiles of calls
+#   slower than a threshold kept, written to logs/profiles/ as .prof (pstats) plus a .txt summary.
+#   Armed at startup from PROFILE_NEXT_CALLS / PROFILE_SLOW_SECONDS or at runtime through configure()
+#   (the configure_profiling tool). cProfile is per thread and one profile runs at a time: it also
+#   covers other coroutines the event loop ran during the call, and calls starting meanwhile are skipped.
+# Executor threads don't inherit the context: run_traced() carries it over for work a request waits on.
+
+
+MAX_SPANS = 256  # Per trace; bulk writes and backfills can have many chunks
+_TRACE = ContextVar("trace", default=None)
+_DEPTH = ContextVar("trace_depth", default=0)
+_LOCK = threading.Lock()
+_SETTINGS = {
+    "slow_request_seconds": TRACE_SLOW_REQUEST_SECONDS,  # 0 disables the slow-request log
+    "profile_next_calls": PROFILE_NEXT_CALLS,
+    "profile_slow_seconds": PROFILE_SLOW_SECONDS,  # 0 disables threshold profiling
+}
+_PROFILING = {"active": False, "dumped": 0}
+_RECENT_SLOW = deque(maxlen=20)
+
+
+class Trace:
+    __slots__ = ("name", "start", "spans", "elapsed", "slow")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []  # (name, offset s, duration s, depth) in completion order
+        self.elapsed = 0.0
+        self.slow = False
+
+    def summary(self):
+        spans = sorted(self.spans, key=lambda s: s[1])
+        return {
+            "tool": self.name,
+            "ms": round(self.elapsed * 1000, 1),
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "spans": [{"name": "  " * depth + name, "start_ms": round(offset * 1000, 1), "ms": round(duration * 1000, 1)}
+                      for name, offset, duration, depth in spans],
+        }
+
+    def breakdown(self):
+        """One line: total time per span name in order of first start, with call counts."""
+        totals = {}
+        for name, _, duration, _ in sorted(self.spans, key=lambda s: s[1]):
+            count, seconds = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, seconds + duration)
+        return "; ".join(f"{name}={seconds * 1000:.1f}ms" + (f" (x{count})" if count > 1 else "")
+                         for name, (count, seconds) in totals.items())
+
+
+@contextmanager
+def span(name):
+    """Records the block as a span of the current request's trace (no-op outside a traced call)."""
+    trace = _TRACE.get()
+    if trace is None:
+        yield
+        return
+    depth = _DEPTH.get()
+    token = _DEPTH.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _DEPTH.reset(token)
+        if len(trace.spans) < MAX_SPANS:
+            trace.spans.append((name, start - trace.start, time.perf_counter() - start, depth))
+
+
+def run_traced(fn, *args):
+    """Runs fn(*args) in the default executor with the current trace context (spans inside are recorded)."""
+    return asyncio.get_running_loop().run_in_executor(None, copy_context().run, fn, *args)
+
+
+@contextmanager
+def traced_call(name):
+    """Trace (and, when armed, profile) one tool call. Yields the Trace; `elapsed` and `slow` are set on exit."""
+    trace = Trace(name)
+    token = _TRACE.set(trace)
+    profile = _start_profile()
+    try:
+        yield trace
+    finally:
+        trace.elapsed = time.perf_counter() - trace.start
+        _TRACE.reset(token)
+        if profile is not None:
+            _finish_profile(profile, trace)
+        threshold = _SETTINGS["slow_request_seconds"]
+        if threshold > 0 and trace.elapsed >= threshold:
+            trace.slow = True
+            _RECENT_SLOW.append(trace.summary())
+            logger.warning(f"slow request: {name} took {trace.elapsed:.2f}s (threshold {threshold:.2f}s). Spans: {trace.breakdown()}")
+
+
+def _start_profile():
+    with _LOCK:
+        if _PROFILING["active"] or (_SETTINGS["profile_next_calls"] <= 0 and _SETTINGS["profile_slow_seconds"] <= 0):
+            return None
+        forced = _SETTINGS["profile_next_calls"] > 0
+        if forced:
+            _SETTINGS["profile_next_calls"] -= 1
+        _PROFILING["active"] = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:  # Another profiler (e.g. a debugger) is active in this thread
+        logger.warning(f"tracing: Could not start profiler: {e}")
+        _PROFILING["active"] = False
+        return None
+    return profiler, forced
+
+
+def _finish_profile(profile, trace):
+    profiler, forced = profile
+    profiler.disable()
+    _PROFILING["active"] = False
+    threshold = _SETTINGS["profile_slow_seconds"]
+    if not forced and trace.elapsed < threshold:
+        return
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        base = PROFILE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}_{trace.name}_{trace.elapsed * 1000:.0f}ms"
+        profiler.dump_stats(f"{base}.prof")
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            f.write(f"{trace.name}: {trace.elapsed:.3f}s\n")
+            f.writelines(f"  {s['start_ms']:>9.1f}ms {s['ms']:>9.1f}ms  {s['name']}\n" for s in trace.summary()["spans"])
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+        _PROFILING["dumped"] += 1
+        logger.info(f"tracing: Profile of {trace.name} ({trace.elapsed:.2f}s) written to {base}.prof")
+    except OSError as e:
+        logger.error(f"tracing: Could not write profile of {trace.name}: {e}")
+
+
+def configure(profile_next_calls=None, profile_slow_seconds=None, slow_request_seconds=None):
+    """Changes the profiling switches and slow-request threshold at runtime (None keeps a setting). Returns status()."""
+    with _LOCK:
+        for key, value in (("profile_next_calls", profile_next_calls), ("profile_slow_seconds", profile_slow_seconds),
+                           ("slow_request_seconds", slow_request_seconds)):
+            if value is not None:
+                _SETTINGS[key] = max(value, 0)
+    logger.info(f"tracing: Settings now {_SETTINGS}.")
+    return status()
+
+
+def status():
+    return {**_SETTINGS, "profiling_active": _PROFILING["active"], "profiles_written": _PROFILING["dumped"],
+            "profile_dir": str(PROFILE_DIR), "recent_slow_requests": list(_RECENT_SLOW)}
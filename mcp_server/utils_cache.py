@@ -1,172 +1,419 @@
 import asyncio
+import copy
 import time
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import torch
-import pickle
 import os
-from config import logger
-from base64 import b64decode # Need b64decode here for processing in init_cache
+from config import logger, MODEL_NAME, NEIGHBOUR_GRAPH_K
+from embedding_backend import load_embedding_backend
+from base64 import b64decode # Delta rows (decode_embedding_rows); full builds decode in corpus_builder.py
+from vector_index import normalize_rows, build_index, load_index
+from embedding_store import EmbeddingStore
+from cache_format import read_cache, write_cache, update_header, open_embeddings, generation_path, header_path
+from metrics import stage, inc, register_gauge
+from corpus_builder import CorpusBuilder, DeltaWindowExceeded, sync_window
+from lexical_index import LexicalIndex
+from neighbour_graph import NeighbourGraph
+from cache_state import COLLECTIONS, CACHES, empty_cache, snapshot, publish
+from readiness import set_state, single_flight, LOADING, READY, FAILED
+from tracing import run_traced
 
-MODEL = None
-LOCAL_CACHE_FILE = "mcp_server_cache.pkl"
+MODEL = None  # EmbeddingBackend, see embedding_backend.py
 CACHE_EXPIRY_SECONDS = 24 * 60 * 60  # 1 day
+# Expired caches younger than this are refreshed with a delta sync (new items only); older ones are
+# re-downloaded in full, which also picks up embeddings backfilled by other processes for older items.
+CACHE_FULL_REFRESH_SECONDS = 7 * 24 * 60 * 60  # 7 days
 
-PAIRS_CACHE = {
-    "data": None,
-    "db_embeddings": None,
-    "last_updated_timestamp": None  # Store timestamp directly
-}
+PAIRS_CACHE = CACHES["pairs"]
+TOPICS_CACHE = CACHES["topics"]
+LOCAL_CACHE_PREFIX = COLLECTIONS["pairs"]["prefix"]
 
 async def load_model_async():
-    global MODEL
-    start_time = time.time()
-    logger.info("load_model_async: Attempting to load model...")
     if MODEL is None:
-        logger.info(f"load_model_async: MODEL is None. Checking CUDA availability: {torch.cuda.is_available()}")
-        try:
-            loop = asyncio.get_event_loop()
-            # Run SentenceTransformer loading in executor to avoid blocking event loop
-            MODEL = await loop.run_in_executor(
-                None,
-                lambda: SentenceTransformer("Snowflake/snowflake-arctic-embed-l-v2.0", device="cuda")
-            )
-            logger.info(f"load_model_async: Model loaded successfully in {time.time() - start_time:.2f}s.")
-        except Exception as e:
-             logger.exception(f"load_model_async: Failed to load model after {time.time() - start_time:.2f}s. Error: {e}")
-             # Decide if we should raise or just return None? For now, MODEL remains None.
-    else:
-        logger.info(f"load_model_async: Model already loaded. Took {time.time() - start_time:.2f}s.")
+        # Concurrent callers (background warm-up, tool calls) share one load
+        await single_flight("model", _load_model)
     return MODEL
 
-def load_cache_from_file():
-    """Attempts to load cache data from the local file."""
+async def _load_model():
+    global MODEL
     start_time = time.time()
-    logger.info(f"load_cache_from_file: Attempting to load cache from {LOCAL_CACHE_FILE}...")
-    if os.path.exists(LOCAL_CACHE_FILE):
-        try:
-            with open(LOCAL_CACHE_FILE, "rb") as f:
-                cached_data = pickle.load(f)
-                # Basic validation
-                if isinstance(cached_data, dict) and "last_updated_timestamp" in cached_data:
-                    load_duration = time.time() - start_time
-                    cache_age = time.time() - cached_data.get("last_updated_timestamp", 0)
-                    logger.info(f"load_cache_from_file: Cache loaded successfully in {load_duration:.2f}s. Cache age: {cache_age:.0f}s.")
-                    return cached_data
-                else:
-                    logger.error(f"load_cache_from_file: Invalid cache file format found in {LOCAL_CACHE_FILE}. Took {time.time() - start_time:.2f}s.")
-        except (pickle.UnpicklingError, EOFError) as e:
-            logger.error(f"load_cache_from_file: Could not unpickle cache from {LOCAL_CACHE_FILE}. Error: {e}. Took {time.time() - start_time:.2f}s.")
-        except FileNotFoundError:
-             # Should not happen due to os.path.exists check, but handle defensively
-             logger.error(f"load_cache_from_file: File {LOCAL_CACHE_FILE} not found unexpectedly. Took {time.time() - start_time:.2f}s.")
-        except Exception as e:
-            logger.exception(f"load_cache_from_file: An unexpected error occurred while loading cache: {e}. Took {time.time() - start_time:.2f}s.")
-    else:
-        logger.info(f"load_cache_from_file: Cache file {LOCAL_CACHE_FILE} does not exist. Took {time.time() - start_time:.2f}s.")
+    logger.info("load_model_async: MODEL is None. Loading embedding backend...")
+    set_state("model", LOADING)
+    try:
+        loop = asyncio.get_event_loop()
+        # Run model loading in executor to avoid blocking event loop (device is picked automatically)
+        with stage("model_load") as t:
+            MODEL = await loop.run_in_executor(None, load_embedding_backend)
+        logger.info(f"load_model_async: Model loaded successfully in {t.elapsed:.2f}s.")
+        set_state("model", READY, f"{MODEL.kind} on {MODEL.device}")
+    except Exception as e:
+         logger.exception(f"load_model_async: Failed to load model after {time.time() - start_time:.2f}s. Error: {e}")
+         # MODEL remains None, the next call retries
+         set_state("model", FAILED, str(e))
+
+def load_cache_from_file(collection="pairs"):
+    """Attempts to open the local cache (memory-mapped, no unpickling)."""
+    start_time = time.time()
+    prefix = COLLECTIONS[collection]["prefix"]
+    logger.info(f"load_cache_from_file: Attempting to load {collection} cache from {header_path(prefix)}...")
+    try:
+        with stage("cache_load") as t:
+            loaded = read_cache(prefix, MODEL_NAME)
+        if loaded is None:
+            logger.info(f"load_cache_from_file: No valid {collection} cache found. Took {t.elapsed:.2f}s.")
+            return None
+        header, items, db_embs = loaded
+        cache_age = time.time() - header["last_updated_timestamp"]
+        logger.info(f"load_cache_from_file: {collection} cache generation {header['generation']} ({header['count']} rows) loaded in {t.elapsed:.2f}s. Cache age: {cache_age:.0f}s.")
+        return {
+            "data": items,
+            "db_embeddings": db_embs,
+            "last_updated_timestamp": header["last_updated_timestamp"],
+            "generation": header["generation"],
+            "max_seen_id": header.get("max_seen_id"),
+            "pending_ids": header.get("pending_ids") or [],
+            # Headers written before artifact stamps existed keyed the artifacts on the timestamp
+            "artifact_stamp": header.get("artifact_stamp", header["last_updated_timestamp"]),
+        }
+    except Exception as e:
+        logger.exception(f"load_cache_from_file: An unexpected error occurred while loading {collection} cache: {e}. Took {time.time() - start_time:.2f}s.")
     return None
 
-def save_cache_to_file(cache_data):
-    """Saves the current cache data to the local file."""
+def artifact_stamp(cache_data):
+    """Stamp the derived artifacts are saved and validated with. Only changes when rows change, so a
+    refresh that just moves last_updated_timestamp forward keeps them valid."""
+    return cache_data.get("artifact_stamp") or cache_data.get("last_updated_timestamp") or 0
+
+def save_cache_to_file(cache_data, collection="pairs"):
+    """Atomically writes the cache as a new generation and re-opens the embeddings memory-mapped."""
     start_time = time.time()
-    logger.info(f"save_cache_to_file: Attempting to save cache to {LOCAL_CACHE_FILE}...")
+    spec = COLLECTIONS[collection]
+    logger.info(f"save_cache_to_file: Attempting to save {collection} cache under {spec['prefix']}...")
     try:
-        with open(LOCAL_CACHE_FILE, "wb") as f:
-            pickle.dump(cache_data, f)
-        logger.info(f"save_cache_to_file: Cache saved successfully in {time.time() - start_time:.2f}s.")
+        with stage("cache_save") as t:
+            cache_data["artifact_stamp"] = artifact_stamp(cache_data)
+            header = write_cache(spec["prefix"], cache_data["data"], cache_data["db_embeddings"],
+                                 MODEL_NAME, cache_data["last_updated_timestamp"],
+                                 extra={"max_seen_id": cache_data.get("max_seen_id"), "pending_ids": cache_data.get("pending_ids") or [],
+                                        "artifact_stamp": cache_data["artifact_stamp"]},
+                                 fields=spec["fields"])
+            # Swap the heap copy for the memory-mapped file so its pages are shared with the OS page cache
+            cache_data["db_embeddings"] = open_embeddings(spec["prefix"], header)
+            cache_data["generation"] = header["generation"]
+        logger.info(f"save_cache_to_file: {collection} cache saved successfully in {t.elapsed:.2f}s.")
     except Exception as e:
-        logger.exception(f"save_cache_to_file: Failed to save cache: {e}. Took {time.time() - start_time:.2f}s.")
+        logger.exception(f"save_cache_to_file: Failed to save {collection} cache: {e}. Took {time.time() - start_time:.2f}s.")
+
+def build_vector_index(cache_data, collection="pairs"):
+    """Encodes the compact embedding store and loads (or builds and persists) the vector index on top of it.
+    Expects db_embeddings to be normalised already (done once when the cache is built)."""
+    db_embs = cache_data.get("db_embeddings")
+    if db_embs is None or len(db_embs) == 0:
+        cache_data["index"] = None
+        cache_data["store"] = None
+        cache_data["lexical"] = None
+        cache_data["graph"] = None
+        return None
+    with stage("index_build") as t:
+        # Full vectors are only read for re-ranking; when memory-mapped, only touched pages become resident
+        store = EmbeddingStore(lambda: db_embs, len(db_embs), db_embs.shape[1])
+        stamp = artifact_stamp(cache_data)
+        generation = cache_data.get("generation")
+        codes_base = generation_path(COLLECTIONS[collection]["prefix"], generation, "") if generation else None
+        # Codes saved with the generation are memory-mapped, shared with every process using the cache
+        if codes_base is None or not store.load_codes(codes_base, stamp):
+            store.build()
+            if codes_base is not None:
+                try:
+                    store.save_codes(codes_base, stamp)
+                except Exception as e:
+                    logger.exception(f"build_vector_index: Failed to save embedding codes for {collection}: {e}")
+        cache_data["store"] = store
+        index_file = generation_path(COLLECTIONS[collection]["prefix"], generation or 0, ".index.npz")
+        index = load_index(index_file, store, stamp)
+        if index is None:
+            index = build_index(store)
+            try:
+                index.save(index_file, stamp)
+            except Exception as e:
+                logger.exception(f"build_vector_index: Failed to save index to {index_file}: {e}")
+    cache_data["index"] = index
+    cache_data["lexical"] = build_lexical_index(cache_data, collection)
+    # The graph is built on first use (neighbour_graph_async); one saved for this stamp is picked up here
+    cache_data["graph"] = load_neighbour_graph(cache_data, collection)
+    logger.info(f"build_vector_index: {index.kind} index ready for {len(index)} {collection} vectors in {t.elapsed:.2f}s.")
+    return index
+
+def build_lexical_index(cache_data, collection="pairs"):
+    """Loads the generation's lexical index, or builds and saves it (BM25 weights depend on the whole corpus)."""
+    items, stamp = cache_data["data"], artifact_stamp(cache_data)
+    path = generation_path(COLLECTIONS[collection]["prefix"], cache_data.get("generation") or 0, ".lexical.npz")
+    lexical = LexicalIndex.load(path, stamp, len(items))
+    if lexical is None:
+        fields = COLLECTIONS[collection].get("lexical_fields", COLLECTIONS[collection]["fields"])
+        lexical = LexicalIndex.build([" ".join(filter(None, (items.value(f, row) for f in fields))) for row in range(len(items))])
+        try:
+            lexical.save(path, stamp)
+        except Exception as e:
+            logger.exception(f"build_lexical_index: Failed to save lexical index to {path}: {e}")
+    return lexical
+
+def _graph_path(cache_data, collection):
+    if not COLLECTIONS[collection].get("neighbour_graph") or NEIGHBOUR_GRAPH_K <= 0:
+        return None
+    return generation_path(COLLECTIONS[collection]["prefix"], cache_data.get("generation") or 0, ".graph.npz")
+
+def load_neighbour_graph(cache_data, collection="pairs"):
+    """The generation's saved neighbour graph, or None (not built yet or disabled for the collection)."""
+    path = _graph_path(cache_data, collection)
+    return NeighbourGraph.load(path, artifact_stamp(cache_data), len(cache_data["db_embeddings"])) if path else None
+
+def build_neighbour_graph(cache_data, collection="pairs"):
+    """Loads the generation's neighbour graph, or builds and saves it (None when disabled for the collection)."""
+    path = _graph_path(cache_data, collection)
+    if path is None:
+        return None
+    with stage("graph_build"):
+        return NeighbourGraph.load_or_build(path, artifact_stamp(cache_data), cache_data["index"], cache_data["db_embeddings"])
 
-async def init_cache(fetch_all_pairs_async):
-    global PAIRS_CACHE
+async def snapshot_with_graph(collection="pairs"):
+    """snapshot() with the neighbour graph: the first caller builds it in an executor and publishes the
+    state with it attached. The graph stays None when the collection has none or no index."""
+    cache = snapshot(collection)
+    if cache.get("graph") is not None or cache.get("index") is None or _graph_path(cache, collection) is None:
+        return cache
+    graph = await single_flight(("graph", collection, cache["version"]), lambda: _build_graph_in_executor(cache, collection))
+    return {**cache, "graph": graph}
+
+async def _build_graph_in_executor(cache, collection):
+    graph = await run_traced(build_neighbour_graph, cache, collection)
+    if CACHES[collection]["version"] == cache["version"]:  # A refresh published meanwhile builds its own
+        publish(collection, {**cache, "graph": graph})
+    return graph
+
+def build_snapshot(state, collection="pairs", save=False):
+    """A complete, unpublished cache state from `state` (data, embeddings, timestamps): saved as a new
+    generation first if `save`, then with its store, vector index, lexical index and graph. Blocking."""
+    fresh = {**empty_cache(), **state}
+    if save:
+        save_cache_to_file(fresh, collection)
+    build_vector_index(fresh, collection)
+    return fresh
+
+async def build_snapshot_async(state, collection="pairs", save=False):
+    # In an executor: queries keep running on the published state while the next one is built
+    return await run_traced(build_snapshot, state, collection, save)
+
+async def init_cache(fetch_all_async, force_refresh=False, fetch_new_async=None, collection="pairs"):
     overall_start_time = time.time()
-    logger.info("init_cache: Starting cache initialization...")
+    spec = COLLECTIONS[collection]
+    logger.info(f"init_cache: Starting {collection} cache initialization...")
 
     # Ensure model is loaded first
     await load_model_async()
 
     # 1. Try loading from local cache file
-    loaded_cache = load_cache_from_file()
-    if loaded_cache:
+    loaded_cache = load_cache_from_file(collection)
+    if loaded_cache and not force_refresh:
         cache_timestamp = loaded_cache.get("last_updated_timestamp", 0)
         current_time = time.time()
         if (current_time - cache_timestamp) < CACHE_EXPIRY_SECONDS:
-            PAIRS_CACHE.update(loaded_cache)
-            logger.info(f"init_cache: Cache loaded successfully from file (Timestamp: {time.ctime(cache_timestamp)}). Init duration: {time.time() - overall_start_time:.2f}s.")
-            return PAIRS_CACHE
+            cache = publish(collection, await build_snapshot_async(loaded_cache, collection))
+            logger.info(f"init_cache: {collection} cache loaded successfully from file (Timestamp: {time.ctime(cache_timestamp)}). Init duration: {time.time() - overall_start_time:.2f}s.")
+            return cache
+        elif (fetch_new_async is not None and loaded_cache.get("max_seen_id") is not None
+              and (current_time - cache_timestamp) < CACHE_FULL_REFRESH_SECONDS):
+            logger.info(f"init_cache: Local cache {spec['prefix']} is expired (Timestamp: {time.ctime(cache_timestamp)}). Running a delta sync.")
+            publish(collection, await build_snapshot_async(loaded_cache, collection))
+            cache = await delta_update_cache(fetch_new_async, fetch_all_async, collection)
+            logger.info(f"init_cache: {collection} cache refreshed with a delta sync. Init duration: {time.time() - overall_start_time:.2f}s.")
+            return cache
         else:
-            logger.info(f"init_cache: Local cache file {LOCAL_CACHE_FILE} is expired (Timestamp: {time.ctime(cache_timestamp)}). Fetching fresh data.")
+            logger.info(f"init_cache: Local cache {spec['prefix']} is expired (Timestamp: {time.ctime(cache_timestamp)}). Fetching fresh data.")
 
     # 2. If local cache is invalid, expired, or missing, fetch from backend
-    logger.info("init_cache: Fetching fresh data for cache from backend...")
+    logger.info(f"init_cache: Fetching fresh {collection} data for cache from backend...")
     fetch_start_time = time.time()
     try:
-        all_pairs = await fetch_all_pairs_async()
-        fetch_duration = time.time() - fetch_start_time
-        logger.info(f"init_cache: Fetched {len(all_pairs)} total pairs from backend in {fetch_duration:.2f}s.")
-
-        logger.info("init_cache: Processing fetched pairs and embeddings...")
-        processing_start_time = time.time()
-        pairs_with_embeddings = [p for p in all_pairs if p.get("vector_embedding")]
-        db_embs = []
-        decode_errors = 0
-        for p in pairs_with_embeddings:
-            try:
-                emb_bytes = b64decode(p["vector_embedding"])
-                emb = np.frombuffer(emb_bytes, dtype=np.float32)
-                # Optional: Add dimension check here if needed
-                db_embs.append(emb)
-            except Exception as decode_err:
-                decode_errors += 1
-                logger.error(f"init_cache: Could not decode/process embedding for pair {p.get('id', 'N/A')}. Error: {decode_err}")
-
-        processing_duration = time.time() - processing_start_time
-        logger.info(f"init_cache: Processed embeddings in {processing_duration:.2f}s. Found {len(pairs_with_embeddings)} pairs with embeddings. {decode_errors} decode errors.")
-
-        # Update PAIRS_CACHE only if fetch was successful
-        PAIRS_CACHE["data"] = pairs_with_embeddings
-        PAIRS_CACHE["last_updated_timestamp"] = time.time()
-        if db_embs:
-            logger.debug(f"init_cache: Stacking {len(db_embs)} embeddings into numpy array.")
-            PAIRS_CACHE["db_embeddings"] = np.stack(db_embs)
-        else:
-             logger.warning("init_cache: No valid embeddings found after processing. Setting db_embeddings to None.")
-             PAIRS_CACHE["db_embeddings"] = None
+        with stage("corpus_fetch") as fetch_timer:
+            corpus = await fetch_all_async()
+        if not isinstance(corpus, CorpusBuilder):
+            # Plain item lists (e.g. fetch_all_pairs_async) are decoded in one go
+            corpus = CorpusBuilder(spec["fields"], capacity=len(corpus)).add_page(corpus)
+        # Pages were decoded into one float32 matrix as they arrived (see corpus_builder.py)
+        logger.info(f"init_cache: Fetched {corpus.n_fetched} total {collection} from backend in {fetch_timer.elapsed:.2f}s. "
+                    f"Found {corpus.n_rows} {collection} with embeddings. {corpus.decode_errors} decode errors.")
 
-        # 3. Save the newly fetched data to local cache file
-        save_cache_to_file(PAIRS_CACHE)
-        logger.info(f"init_cache: Cache initialized successfully from backend. Total duration: {time.time() - overall_start_time:.2f}s.")
+        # Build the next state only if fetch was successful; queries use the current one meanwhile
+        db_embs = corpus.embeddings()
+        fresh = {"data": corpus.item_store(), "last_updated_timestamp": time.time(), "max_seen_id": corpus.max_seen_id,
+                 "pending_ids": corpus.pending_ids}
+        if db_embs is not None:
+            # Normalise once here instead of on every query (in place, no copy of the matrix)
+            fresh["db_embeddings"] = normalize_rows(db_embs)
+        else:
+             logger.warning(f"init_cache: No valid {collection} embeddings found after processing. Setting db_embeddings to None.")
+        # 3. Save the newly fetched data to local cache file (re-opened memory-mapped), then publish
+        cache = publish(collection, await build_snapshot_async(fresh, collection, save=db_embs is not None))
+        logger.info(f"init_cache: {collection} cache initialized successfully from backend. Total duration: {time.time() - overall_start_time:.2f}s.")
 
     except Exception as fetch_err:
-        logger.exception(f"init_cache: ERROR Failed to fetch/process data from backend: {fetch_err}. Duration: {time.time() - fetch_start_time:.2f}s")
+        logger.exception(f"init_cache: ERROR Failed to fetch/process {collection} data from backend: {fetch_err}. Duration: {time.time() - fetch_start_time:.2f}s")
         # Decide how to handle failure
-        if loaded_cache:
-            logger.warning("init_cache: Using potentially stale cache due to backend fetch failure.")
-            PAIRS_CACHE.update(loaded_cache) # Ensure stale cache is used if available
+        cache = CACHES[collection]
+        if loaded_cache and loaded_cache.get("generation") != cache.get("generation"):
+            logger.warning(f"init_cache: Using potentially stale {collection} cache due to backend fetch failure.")
+            cache = publish(collection, await build_snapshot_async(loaded_cache, collection)) # Ensure stale cache is used if available
+        elif cache["data"] is not None:
+            logger.warning(f"init_cache: Keeping the current {collection} cache due to backend fetch failure.")
         else:
-            logger.error("init_cache: Proceeding without cache due to backend fetch failure and no valid local cache.")
-            # Reset cache state if fetch fails and no local cache exists
-            PAIRS_CACHE = {"data": None, "db_embeddings": None, "last_updated_timestamp": None}
+            logger.error(f"init_cache: Proceeding without {collection} cache due to backend fetch failure and no valid local cache.")
         # Log total duration even on failure
         logger.info(f"init_cache: Initialization failed. Total duration: {time.time() - overall_start_time:.2f}s.")
 
-    return PAIRS_CACHE
+    return cache
 
-async def update_cache(fetch_all_pairs_async):
-    # Force a fetch and save, bypassing expiry check by deleting local file first.
-    global PAIRS_CACHE
+async def update_cache(fetch_all_async, collection="pairs"):
+    # Force a fetch and save, bypassing the expiry check. The previous cache generation stays
+    # on disk until the new one is published, so a failed refresh still leaves a usable cache.
     start_time = time.time()
-    logger.info("update_cache: Starting force update of cache from backend...")
+    logger.info(f"update_cache: Starting force update of {collection} cache from backend...")
+    cache = await init_cache(fetch_all_async, force_refresh=True, collection=collection)
+    logger.info(f"update_cache: {collection} cache force update finished. Timestamp: {time.ctime(cache.get('last_updated_timestamp') or 0)}. Duration: {time.time() - start_time:.2f}s")
+    return cache
+
+def load_local_cache(collection="pairs"):
+    """Loads the local cache file into the collection's cache if nothing is loaded yet (ignores expiry). Returns True if a cache is loaded.
+    Blocking (builds the snapshot): for executor threads and CLI runs, the event loop uses load_local_cache_async."""
+    if CACHES[collection]["data"] is None:
+        loaded_cache = load_cache_from_file(collection)
+        if loaded_cache:
+            publish(collection, build_snapshot(loaded_cache, collection))
+    return CACHES[collection]["data"] is not None
+
+async def load_local_cache_async(collection="pairs"):
+    """load_local_cache in an executor; concurrent callers share one load."""
+    if CACHES[collection]["data"] is None:
+        await single_flight(("load_local", collection), lambda: _load_local_cache_in_executor(collection))
+    return CACHES[collection]["data"] is not None
+
+async def _load_local_cache_in_executor(collection):
+    return await run_traced(load_local_cache, collection)
 
-    # Temporarily remove local cache to force fetch in init_cache
-    if os.path.exists(LOCAL_CACHE_FILE):
+def decode_embedding_rows(items, fields=("item1", "item2")):
+    """Decodes backend items into delta rows ({id, *fields, embedding}), skipping items without a valid embedding."""
+    rows = []
+    for p in items:
+        if not p.get("vector_embedding"):
+            continue
         try:
-            os.remove(LOCAL_CACHE_FILE)
-            logger.info(f"update_cache: Temporarily removed {LOCAL_CACHE_FILE} to force refresh.")
-        except Exception as e:
-            logger.error(f"update_cache: Could not remove local cache file {LOCAL_CACHE_FILE} for refresh: {e}")
+            emb = np.frombuffer(b64decode(p["vector_embedding"]), dtype=np.float32)
+            rows.append({"id": p["id"], **{field: p.get(field) for field in fields}, "embedding": emb})
+        except Exception as decode_err:
+            inc("decode_errors_total")
+            logger.error(f"decode_embedding_rows: Could not decode embedding for item {p.get('id', 'N/A')}. Error: {decode_err}")
+    return rows
+
+def apply_cache_delta(rows, max_seen_id=None, collection="pairs", pending_ids=None):
+    """Patches existing rows and appends new ones without re-fetching the corpus.
+
+    `rows` are dicts with id, the collection's fields and a float32 `embedding`. The embedding store,
+    vector index and graph are updated incrementally on copies (the published state stays untouched
+    for running queries), saved as a new cache generation and published. Blocking.
+    `pending_ids` replaces the ids delta syncs re-check; applied rows are no longer pending either way.
+    Returns False if there is no cache to patch (a full init_cache is needed instead).
+    """
+    start_time = time.time()
+    spec = COLLECTIONS[collection]
+    load_local_cache(collection)
+    fresh = snapshot(collection)
+    data, db_embs = fresh["data"], fresh["db_embeddings"]
+    if data is None or db_embs is None:
+        logger.warning(f"apply_cache_delta: No {collection} cache loaded, a full refresh is required.")
+        return False
+    if rows:
+        vectors = normalize_rows(np.stack([r["embedding"] for r in rows]))
+        if vectors.shape[1] != db_embs.shape[1]:
+            logger.error(f"apply_cache_delta: Embedding dim {vectors.shape[1]} does not match cache dim {db_embs.shape[1]}. Skipping delta.")
+            return False
+        # Known ids are patched, new ones appended (O(1) row lookups, see item_store.py)
+        data, row_ids = data.with_rows(rows)
+        # One sequential copy of the (memory-mapped) matrix, no network or base64 decoding
+        matrix = np.empty((len(data), db_embs.shape[1]), dtype=np.float32)
+        matrix[:len(db_embs)] = db_embs
+        matrix[row_ids] = vectors
+        fresh["data"] = data
+        fresh["db_embeddings"] = matrix
+    fresh["last_updated_timestamp"] = time.time()
+    if rows:
+        fresh["artifact_stamp"] = fresh["last_updated_timestamp"]
+    if max_seen_id is not None:
+        fresh["max_seen_id"] = max(max_seen_id, fresh.get("max_seen_id") or 0)
+    applied = {r["id"] for r in rows}
+    fresh["pending_ids"] = [i for i in (fresh.get("pending_ids") or [] if pending_ids is None else pending_ids) if i not in applied]
+    if not rows:
+        # Nothing changed, only move the watermark and timestamp forward
+        update_header(spec["prefix"], last_updated_timestamp=fresh["last_updated_timestamp"],
+                      max_seen_id=fresh["max_seen_id"], pending_ids=fresh["pending_ids"])
+    else:
+        save_cache_to_file(fresh, collection)
+        store, index = fresh.get("store"), fresh.get("index")
+        if store is None or index is None:
+            build_vector_index(fresh, collection)
+        else:
+            full, stamp = fresh["db_embeddings"], fresh["artifact_stamp"]
+            # Copy-on-write: the copies get new code/bucket arrays, the published ones keep serving
+            store = copy.copy(store).apply_rows(lambda: full, row_ids, vectors)
+            index = copy.copy(index)
+            index.store = store
+            index.apply_rows(row_ids, vectors)
+            base = generation_path(spec["prefix"], fresh.get("generation") or 0, "")
+            store.save_codes(base, stamp)
+            index.save(base + ".index.npz", stamp)
+            fresh["store"], fresh["index"] = store, index
+            fresh["lexical"] = build_lexical_index(fresh, collection)
+            if fresh.get("graph") is not None:
+                fresh["graph"] = fresh["graph"].apply_rows(index, full, row_ids)
+                fresh["graph"].save(base + ".graph.npz", stamp)
+    publish(collection, fresh)
+    logger.info(f"apply_cache_delta: Applied {len(rows)} {collection} rows ({len(fresh['data'])} total) in {time.time() - start_time:.2f}s.")
+    return True
+
+async def delta_update_cache(fetch_new_async, fetch_all_async, collection="pairs"):
+    """Fetches only items newer than the cache watermark and publishes them as a patched state.
+    Falls back to a full update_cache when there is no cache or watermark yet."""
+    start_time = time.time()
+    cache = CACHES[collection]
+    await load_local_cache_async(collection)
+    watermark = cache.get("max_seen_id")
+    if cache["data"] is None or watermark is None:
+        logger.info(f"delta_update_cache: No {collection} cache watermark available, running a full update.")
+        return await update_cache(fetch_all_async, collection)
+    # Walks back below items still without an embedding (bounded), so they are picked up once backfilled
+    since_id, pending = sync_window(watermark, cache.get("pending_ids"))
+    logger.info(f"delta_update_cache: Fetching {collection} newer than id {since_id} ({len(pending)} pending)...")
+    try:
+        fetched = await fetch_new_async(since_id)
+    except DeltaWindowExceeded as e:
+        logger.warning(f"delta_update_cache: {e}; running a full update of {collection}.")
+        return await update_cache(fetch_all_async, collection)
+    except Exception as e:
+        logger.exception(f"delta_update_cache: Failed to fetch new {collection}: {e}")
+        return cache
+    # The walk covers every pending id, so the items it found without an embedding are the new pending set
+    missing = [p["id"] for p in fetched if not p.get("vector_embedding")]
+    max_seen_id = max([watermark] + [p["id"] for p in fetched])
+    # Items at or below the watermark are cached already unless they were pending
+    pending_set = set(pending)
+    new_items = [p for p in fetched if p["id"] > watermark or p["id"] in pending_set]
+    rows = decode_embedding_rows(new_items, COLLECTIONS[collection]["fields"])
+    applied = await asyncio.get_running_loop().run_in_executor(
+        None, apply_cache_delta, rows, max_seen_id, collection, sync_window(max_seen_id, missing)[1])
+    if not applied:
+        return await update_cache(fetch_all_async, collection)
+    logger.info(f"delta_update_cache: Fetched {len(fetched)} {collection}, applied {len(rows)} with embeddings. Duration: {time.time() - start_time:.2f}s")
+    return cache
+
+
 
-    # Call init_cache which will now be forced to fetch
-    await init_cache(fetch_all_pairs_async)
-    logger.info(f"update_cache: Cache force update finished. Timestamp: {time.ctime(PAIRS_CACHE.get('last_updated_timestamp', 0))}. Duration: {time.time() - start_time:.2f}s")
-    return PAIRS_CACHE
+register_gauge("model_memory_bytes", lambda: {(): MODEL.memory_bytes() if MODEL is not None else None},
+               "Bytes of embedding model parameters and buffers")
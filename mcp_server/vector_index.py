@@ -0,0 +1,197 @@
+import os
+import time
+import numpy as np
+from config import logger, VECTOR_INDEX_KIND, EXACT_SEARCH_MAX_ROWS, IVF_NLIST, IVF_NPROBE, IVF_TRAIN_ROWS
+
+# Vector index layer for the similarity search.
+# All indexes work on L2-normalised float32 rows, so inner product == cosine similarity.
+# Indexes decide *which* rows to score; the EmbeddingStore (embedding_store.py) decides *how*
+# (coarse codes + full-precision re-rank).
+# - FlatIPIndex: scans every row
+# - IVFIndex: inverted file index (k-means coarse quantizer), scans only `nprobe` clusters
+
+
+def normalize_rows(matrix):
+    """L2-normalises rows in place (float32). Zero-norm rows are left as zeros."""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if not matrix.flags.writeable:
+        matrix = matrix.copy()
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    zero_rows = np.where(norms[:, 0] == 0)[0]
+    if len(zero_rows) > 0:
+        logger.warning(f"normalize_rows: Found {len(zero_rows)} zero-norm embeddings. They will rank last.")
+        norms[zero_rows] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def top_k(scores, k):
+    """Returns indices of the k highest scores, sorted descending."""
+    actual_k = min(k, len(scores))
+    if actual_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if actual_k < len(scores) // 2:  # Heuristic for when argpartition is faster
+        idx = np.argpartition(scores, -actual_k)[-actual_k:]
+        return idx[np.argsort(scores[idx])[::-1]]
+    return np.argsort(scores)[::-1][:actual_k]
+
+
+def top_k_rows(scores, k):
+    """Row-wise top_k of a (n_queries, n) score matrix. Returns (n_queries, k) indices, each row sorted descending."""
+    actual_k = min(k, scores.shape[1])
+    if actual_k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64)
+    if actual_k < scores.shape[1]:
+        idx = np.argpartition(scores, -actual_k, axis=1)[:, -actual_k:]
+    else:
+        idx = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, idx, axis=1), axis=1)[:, ::-1]
+    return np.take_along_axis(idx, order, axis=1)
+
+
+class FlatIPIndex:
+    """Inner-product search over all rows."""
+    kind = "flat"
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def search(self, query, k, **_):
+        return self.store.search(query, k)
+
+    def search_batch(self, queries, k, **_):
+        return self.store.search_batch(queries, k)
+
+    def apply_rows(self, row_ids, vectors):
+        # Rows are scored straight from the store, which is updated separately
+        return self
+
+    def save(self, path, stamp):
+        # Nothing to persist, the flat index is derived from the embeddings themselves.
+        return None
+
+
+class IVFIndex:
+    """Inverted file index: rows are bucketed by nearest k-means centroid.
+
+    Recall/latency knob: `nprobe` (number of buckets scanned per query).
+    Build-time knob: `nlist` (number of buckets, default ~4*sqrt(N)), trained on at most IVF_TRAIN_ROWS rows.
+    """
+    kind = "ivf"
+
+    def __init__(self, store, centroids, order, offsets, nprobe=IVF_NPROBE):
+        self.store = store
+        self.centroids = centroids
+        self.order = order  # row ids grouped by bucket
+        self.offsets = offsets  # bucket b is order[offsets[b]:offsets[b + 1]]
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.store)
+
+    @classmethod
+    def build(cls, store, nlist=None, nprobe=IVF_NPROBE, n_iter=10, seed=0):
+        vectors = store.full_vectors()
+        n = len(vectors)
+        nlist = nlist or IVF_NLIST or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, max(nlist, min(nlist * 64, IVF_TRAIN_ROWS)))
+        sample = np.asarray(vectors[np.sort(rng.choice(n, size=sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(n_iter):  # Spherical k-means on the sample
+            assign = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            # Empty buckets keep their previous centroid
+            filled = np.bincount(assign, minlength=nlist) > 0
+            centroids = normalize_rows(np.where(filled[:, None], sums, centroids))
+        assign = cls._assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+        return cls(store, centroids, order, offsets, nprobe)
+
+    @staticmethod
+    def _assign(vectors, centroids, block_elements=1 << 24):
+        """Nearest centroid per row, scored in blocks of at most `block_elements` similarities (64 MB)."""
+        assign = np.empty(len(vectors), dtype=np.int64)
+        block = max(1, block_elements // max(len(centroids), 1))
+        for start in range(0, len(vectors), block):
+            assign[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+        return assign
+
+    def search(self, query, k, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe = top_k(self.centroids @ query, nprobe)
+        candidates = np.concatenate([self.order[self.offsets[b]:self.offsets[b + 1]] for b in probe])
+        if len(candidates) < k:
+            # Too few rows in the probed buckets, fall back to a full scan
+            return self.store.search(query, k)
+        return self.store.search(query, k, rows=np.sort(candidates))
+
+    def search_batch(self, queries, k, nprobe=None):
+        """Scans the union of the buckets probed by any of the queries in one batched pass."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = np.unique(top_k_rows(queries @ self.centroids.T, nprobe))
+        candidates = np.concatenate([self.order[self.offsets[b]:self.offsets[b + 1]] for b in probes])
+        if len(candidates) < k:
+            return self.store.search_batch(queries, k)
+        return self.store.search_batch(queries, k, rows=np.sort(candidates))
+
+    def apply_rows(self, row_ids, vectors):
+        """Assigns patched/appended rows to their nearest existing bucket (no k-means retraining)."""
+        n_rows = len(self.store)
+        assign = np.full(n_rows, -1, dtype=np.int64)
+        assign[self.order] = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+        assign[row_ids] = self._assign(vectors, self.centroids)
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.searchsorted(assign[self.order], np.arange(len(self.centroids) + 1))
+        return self
+
+    def save(self, path, stamp):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, kind=self.kind, stamp=stamp, n_rows=len(self.store),
+                 centroids=self.centroids, order=self.order, offsets=self.offsets)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def from_file(cls, data, store):
+        return cls(store, data["centroids"], data["order"], data["offsets"])
+
+
+def resolve_index_kind(n_rows, kind=VECTOR_INDEX_KIND):
+    """`auto` uses exact search for small corpora and IVF above EXACT_SEARCH_MAX_ROWS."""
+    if kind == "auto":
+        return "flat" if n_rows <= EXACT_SEARCH_MAX_ROWS else "ivf"
+    return kind
+
+
+def build_index(store, kind=VECTOR_INDEX_KIND):
+    """Builds an index over the vectors of an EmbeddingStore."""
+    start_time = time.time()
+    kind = resolve_index_kind(len(store), kind)
+    index = IVFIndex.build(store) if kind == "ivf" else FlatIPIndex(store)
+    logger.info(f"build_index: Built {index.kind} index over {len(store)} vectors in {time.time() - start_time:.2f}s.")
+    return index
+
+
+def load_index(path, store, stamp, kind=VECTOR_INDEX_KIND):
+    """Loads a persisted index if it matches the given store and cache stamp, else returns None."""
+    if resolve_index_kind(len(store), kind) == FlatIPIndex.kind:
+        return FlatIPIndex(store)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if float(data["stamp"]) != float(stamp) or int(data["n_rows"]) != len(store):
+                logger.info(f"load_index: Index file {path} is stale. Rebuilding.")
+                return None
+            if str(data["kind"]) == IVFIndex.kind:
+                return IVFIndex.from_file(data, store)
+    except Exception as e:
+        logger.error(f"load_index: Could not load index from {path}: {e}")
+    return None